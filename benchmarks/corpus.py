@@ -0,0 +1,138 @@
+"""
+Synthetic chat log and note corpora shaped like the ones the bot writes under ./src.
+Records use the same fields and file naming as save_chat_log() and save_notes(), with random
+unit vectors, a fixed vocabulary, and speakers, channels and timestamps spread over recent weeks.
+"""
+from datetime import datetime
+from time import time
+from uuid import UUID
+import json
+import os
+import random
+import numpy as np
+
+WORDS = (
+    "memory note channel thread server voice image reply prompt model token cache index vector summary "
+    "message bot user question answer weather music game code python discord server role admin owner "
+    "today tomorrow yesterday week weekend morning night coffee movie book friend project deadline bug "
+    "fix deploy restart latency budget guild embed search notes context history example conversation"
+).split()
+SPEAKERS = 20
+CHANNELS = 10
+SPAN_DAYS = 60
+NOTE_BLOCK_SIZE = 20  # chat logs summarized per note block
+NOTES_COVERAGE = 0.8  # share of the oldest chat logs already covered by note blocks
+CORPUS_MARKER = "corpus.json"
+
+
+def timestamp_to_datetime(unix_time):
+    # same format as src.memory.timestamp_to_datetime, kept here so generation needs no API keys
+    return datetime.fromtimestamp(unix_time).strftime("%A, %B %d, %Y at %I:%M%p %Z")
+
+
+def sentence(rng, low=6, high=30):
+    return " ".join(rng.choice(WORDS) for _ in range(rng.randint(low, high)))
+
+
+def unit_vectors(np_rng, count, dims):
+    vectors = np_rng.standard_normal((count, dims)).astype(np.float32)
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors
+
+
+def make_records(records, dims, seed=0, now=None):
+    """
+    Builds chat log records in chronological order.
+    Returns:
+        list: Dicts with the fields save_chat_log() stores.
+    """
+    rng = random.Random(seed)
+    np_rng = np.random.default_rng(seed)
+    now = now or time()
+    times = sorted(now - rng.random() * SPAN_DAYS * 86400 for _ in range(records))
+    result = []
+    for start in range(0, records, 10000):  # generate vectors in chunks to bound peak memory
+        vectors = unit_vectors(np_rng, min(10000, records - start), dims)
+        for offset, vector in enumerate(vectors):
+            i = start + offset
+            speaker = f"user{rng.randrange(SPEAKERS)}"
+            timestring = timestamp_to_datetime(times[i])
+            result.append({
+                "speaker": speaker,
+                "timestamp": times[i],
+                "uuid": str(UUID(int=rng.getrandbits(128), version=4)),
+                "vector": [round(float(v), 6) for v in vector],
+                "message": "%s: %s - %s" % (speaker, timestring, sentence(rng)),
+                "timestring": timestring,
+                "channel_id": 1000 + rng.randrange(CHANNELS),
+            })
+    return result
+
+
+def make_notes(records, dims, seed=0):
+    # note blocks over the oldest chat logs, like save_summary_block() writes
+    rng = random.Random(seed + 1)
+    np_rng = np.random.default_rng(seed + 1)
+    covered = records[:int(len(records) * NOTES_COVERAGE)]
+    blocks = [covered[i: i + NOTE_BLOCK_SIZE] for i in range(0, len(covered), NOTE_BLOCK_SIZE)]
+    vectors = unit_vectors(np_rng, len(blocks), dims)
+    return [
+        {
+            "notes": "\n".join("- " + sentence(rng, 4, 12) for _ in range(5)),
+            "uuids": [i["uuid"] for i in block],
+            "times": [i["timestamp"] for i in block],
+            "uuid": str(UUID(int=rng.getrandbits(128), version=4)),
+            "vector": [round(float(v), 6) for v in vector],
+        }
+        for block, vector in zip(blocks, vectors)
+    ]
+
+
+def make_database(guilds, users=50, seed=0):
+    # a database.json shaped like the one main.py keeps
+    rng = random.Random(seed + 2)
+    database = {"Guilds": {}, "message_history": {}}
+    for g in range(guilds):
+        threads = {
+            str(10 ** 17 + u): {
+                "threads": [{"thread_id": rng.getrandbits(60), "message_id": rng.getrandbits(60)} for _ in range(3)],
+                "counter": rng.randint(1, 3),
+            }
+            for u in range(users)
+        }
+        database["Guilds"][str(10 ** 17 + g)] = {"name": f"guild {g}", "images": {}, "user_threads": threads}
+    return database
+
+
+def save_json(filepath, payload):
+    # same encoding as src.memory.save_json
+    with open(filepath, "w", encoding="utf-8") as outfile:
+        json.dump(payload, outfile, ensure_ascii=False, sort_keys=True, indent=2)
+
+
+def write_corpus(workdir, records, dims, seed=0):
+    """
+    Writes chat logs, notes and the notes prompt under workdir/src, reusing an existing corpus of the same shape.
+    Returns:
+        bool: True if a new corpus was written.
+    """
+    marker = os.path.join(workdir, CORPUS_MARKER)
+    shape = {"records": records, "dims": dims, "seed": seed}
+    if os.path.exists(marker):
+        with open(marker, "r", encoding="utf-8") as infile:
+            if json.load(infile) == shape:
+                return False
+        raise ValueError(f"{workdir} holds a corpus of a different shape; use an empty directory")
+    for folder in ("chat_logs", "notes", "memories"):
+        os.makedirs(os.path.join(workdir, "src", folder), exist_ok=True)
+    logs = make_records(records, dims, seed)
+    for record in logs:
+        save_json(os.path.join(workdir, "src", "chat_logs", "log_%s_user.json" % record["timestamp"]), record)
+    for i, note in enumerate(make_notes(logs, dims, seed)):
+        save_json(os.path.join(workdir, "src", "notes", "notes_%s.json" % (note["times"][-1] + i * 1e-6)), note)
+    repo_prompt = os.path.join(os.path.dirname(os.path.dirname(os.path.realpath(__file__))), "src", "prompt_notes.txt")
+    with open(repo_prompt, "r", encoding="utf-8") as infile, open(os.path.join(workdir, "src", "prompt_notes.txt"), "w", encoding="utf-8") as outfile:
+        outfile.write(infile.read())
+    with open(marker, "w", encoding="utf-8") as outfile:
+        json.dump(shape, outfile)
+    return True
@@ -0,0 +1,363 @@
+"""
+End-to-end load harness for the real on_message handler.
+
+    python -m benchmarks.e2e --channels 50 --messages 5
+    python -m benchmarks.e2e --channels 50 --stream --profile openai_stream=0.8:0.4:0.02
+
+Provider SDKs are pointed at the local stand-ins in benchmarks/stubs.py, and a fake Discord layer
+(channels, messages, guild members) with its own REST latency drives src.main.on_message. Each
+simulated channel holds one conversation, sending its next message a short think time after the
+bot's previous reply. The run reports throughput, end-to-end latency and the bot's own per-stage
+latency histograms, and writes them to a JSON file.
+"""
+from statistics import mean
+from time import perf_counter, time
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+sys.path.insert(0, REPO_DIR)
+
+from benchmarks.corpus import write_corpus, sentence  # noqa: E402
+from benchmarks.stubs import StubServers, parse_profile, DEFAULT_PROFILES, StubProfile  # noqa: E402
+
+DEFAULT_CHANNELS = 50
+DEFAULT_MESSAGES = 5
+DEFAULT_THINK_SECONDS = 2.0
+DEFAULT_DISCORD_LATENCY = 0.08  # seconds per Discord REST call
+DEFAULT_DISCORD_JITTER = 0.05
+DEFAULT_RECORDS = 1000
+GUILD_ID = 10 ** 17
+BOT_USER_ID = 938447947857821696
+ids = itertools.count(10 ** 18)
+
+
+class FakeDiscord:
+    """
+    Shared state of the fake Discord layer: REST latency, a count of every call made, and the
+    channels and users its gateway cache holds.
+    """
+
+    def __init__(self, latency, jitter, seed=0):
+        self.latency = latency
+        self.jitter = jitter
+        self.rng = random.Random(seed)
+        self.calls = {}
+        self.channels = {}
+        self.users = {}
+
+    async def rest(self, name):
+        self.calls[name] = self.calls.get(name, 0) + 1
+        await asyncio.sleep(self.latency + self.rng.uniform(0, self.jitter))
+
+
+class FakeUser:
+    def __init__(self, user_id, name, bot=False):
+        self.id = user_id
+        self.name = name
+        self.bot = bot
+        self.system = False
+        self.voice = None
+
+    def mentioned_in(self, message):
+        return True  # every simulated message @mentions the bot
+
+    def __eq__(self, other):
+        return isinstance(other, FakeUser) and other.id == self.id
+
+    def __hash__(self):
+        return hash(self.id)
+
+
+class FakeTyping:
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+
+class FakeGuild:
+    def __init__(self, discord, guild_id):
+        self.discord = discord
+        self.id = guild_id
+        self.name = "load test"
+        self.members = {}
+
+    def get_member(self, user_id):
+        return self.members.get(user_id)
+
+    async def fetch_member(self, user_id):
+        await self.discord.rest("fetch_member")
+        return self.members[user_id]
+
+
+class FakeChannel:
+    def __init__(self, discord, guild, channel_id, name):
+        import discord as pycord
+
+        self.discord = discord
+        self.guild = guild
+        self.id = channel_id
+        self.name = name
+        self.type = pycord.ChannelType.text
+        self.parent = None
+        self.messages = {}
+        self.jump_url = f"https://discord.com/channels/{guild.id if guild is not None else '@me'}/{channel_id}"
+
+    def add(self, author, content):
+        message = FakeMessage(self, author, content)
+        self.messages[message.id] = message
+        return message
+
+    async def send(self, content=None, **kwargs):
+        await self.discord.rest("send")
+        return self.add(self.discord.bot_user, content)
+
+    async def fetch_message(self, message_id):
+        await self.discord.rest("fetch_message")
+        return self.messages[message_id]
+
+    async def history(self, limit=100):
+        await self.discord.rest("history")
+        for message in list(self.messages.values())[::-1][:limit]:
+            yield message
+
+    def typing(self):
+        return FakeTyping()
+
+
+class FakeMessage:
+    def __init__(self, channel, author, content):
+        self.id = next(ids)
+        self.channel = channel
+        self.guild = channel.guild
+        self.author = author
+        self.content = content or ""
+        self.reference = None
+        self.attachments = []
+        self.mention_everyone = False
+        self.thread = None
+        self.replies = []
+
+    @property
+    def clean_content(self):
+        return self.content
+
+    async def edit(self, content=None, **kwargs):
+        await self.channel.discord.rest("edit")
+        self.content = content
+        return self
+
+    async def delete(self, **kwargs):
+        await self.channel.discord.rest("delete")
+        self.channel.messages.pop(self.id, None)
+
+    async def reply(self, content=None, **kwargs):
+        await self.channel.discord.rest("reply")
+        self.replies.append(content)
+        return self.channel.add(self.channel.discord.bot_user, content)
+
+    async def add_reaction(self, emoji):
+        await self.channel.discord.rest("add_reaction")
+
+
+def percentile(samples, q):
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    return ordered[min(int(q * len(ordered)), len(ordered) - 1)]
+
+
+def install_fakes(main, discord):
+    """
+    Points the bot object at the fake Discord layer instead of the gateway and REST API.
+    """
+    async def fetch_channel(channel_id):
+        await discord.rest("fetch_channel")
+        return discord.channels[channel_id]
+
+    async def fetch_user(user_id):
+        await discord.rest("fetch_user")
+        return FakeUser(int(user_id), f"user{user_id}")
+
+    async def change_presence(**kwargs):
+        discord.calls["change_presence"] = discord.calls.get("change_presence", 0) + 1
+
+    def get_message(message_id):
+        # every message in a fake channel was seen on the gateway
+        for channel in discord.channels.values():
+            if message_id in channel.messages:
+                return channel.messages[message_id]
+        return None
+
+    main.bot._connection.user = discord.bot_user
+    main.bot.get_channel = discord.channels.get
+    main.bot.get_user = discord.users.get
+    main.bot.get_message = get_message
+    main.bot.fetch_channel = fetch_channel
+    main.bot.fetch_user = fetch_user
+    main.bot.change_presence = change_presence
+
+
+async def conversation(main, channel, user, messages, think, rng, results):
+    for _ in range(messages):
+        message = channel.add(user, f"<@{BOT_USER_ID}> {sentence(rng, 5, 25)}?")
+        started = perf_counter()
+        await main.on_message(message)
+        elapsed = perf_counter() - started
+        failed = any(str(reply).startswith("Error") for reply in message.replies)
+        results.append({"channel": channel.id, "seconds": elapsed, "error": failed})
+        await asyncio.sleep(think * rng.uniform(0.5, 1.5))
+
+
+def latency_summary(seconds, errors, wall):
+    return {
+        "messages": len(seconds),
+        "errors": errors,
+        "wall_seconds": wall,
+        "throughput_per_second": len(seconds) / wall if wall else 0.0,
+        "mean_seconds": mean(seconds) if seconds else 0.0,
+        "p50_seconds": percentile(seconds, 0.5),
+        "p95_seconds": percentile(seconds, 0.95),
+        "p99_seconds": percentile(seconds, 0.99),
+        "max_seconds": max(seconds, default=0.0),
+    }
+
+
+def stage_summary(metrics):
+    return {
+        stage: {"count": h.count, "p50": h.percentile(0.5), "p95": h.percentile(0.95), "p99": h.percentile(0.99), "max": h.max}
+        for stage, h in metrics.rows()
+    }
+
+
+async def boot(args, stubs):
+    """
+    Starts the stand-ins, imports the bot against them from args.workdir and installs the fake Discord layer.
+    Returns:
+        (the src.main module, its loop monitor, the FakeDiscord)
+    """
+    endpoints = stubs.start_in_thread()
+    os.environ.update(endpoints)
+    # src.constants reads these at import; every call they authorize goes to the stand-ins
+    for name in ("GUILD_ID", "GOOGLE_AI_KEY", "DISCORD_BOT_TOKEN", "DISCORD_CLIENT_ID", "OPENAI_API_KEY",
+                 "OWNER_ID", "ELEVENLABS_API_KEY", "MISTRAL_API_KEY"):
+        os.environ.setdefault(name, "0")
+    write_corpus(args.workdir, args.records, args.dims, args.seed)
+    os.chdir(args.workdir)  # the bot keeps database.json and ./src/chat_logs relative to its working directory
+    from src import main
+    from src.ingest import ingest_queue
+    from src.loop_monitor import start_loop_monitor
+
+    main.llm_provider = args.provider
+    main.streamMode = args.stream
+    loop = asyncio.get_running_loop()
+    if args.workers:
+        from src.workers import WorkerPool
+
+        main.worker_pool = WorkerPool(args.workers)
+        await main.worker_pool.start()
+    else:
+        ingest_queue.start(loop)
+    monitor = start_loop_monitor(loop)
+
+    discord = FakeDiscord(args.discord_latency, args.discord_jitter, args.seed)
+    discord.bot_user = FakeUser(BOT_USER_ID, main.config_service.current.config.name, bot=True)
+    install_fakes(main, discord)
+    return main, monitor, discord
+
+
+async def run(args, profiles):
+    stubs = StubServers(profiles, dims=args.dims, seed=args.seed)
+    main, monitor, discord = await boot(args, stubs)
+    from src.metrics import metrics
+
+    guild = FakeGuild(discord, GUILD_ID)
+    main.database["Guilds"].setdefault(str(GUILD_ID), {"name": guild.name, "images": {}, "user_threads": {}})
+    tasks = []
+    results = []
+    for i in range(args.channels):
+        channel = FakeChannel(discord, guild, GUILD_ID + 1 + i, f"load-{i}")
+        discord.channels[channel.id] = channel
+        user = FakeUser(GUILD_ID + 10000 + i, f"user{i}")
+        guild.members[user.id] = user
+        discord.users[user.id] = user
+        tasks.append(conversation(main, channel, user, args.messages, args.think, random.Random(args.seed + i), results))
+
+    started = perf_counter()
+    try:
+        await asyncio.gather(*tasks)
+    finally:
+        wall = perf_counter() - started
+        monitor.stop()
+        if main.worker_pool is not None:
+            await main.worker_pool.stop()
+        stubs.stop_thread()
+    summary = latency_summary([i["seconds"] for i in results], sum(i["error"] for i in results), wall)
+    stages = stage_summary(metrics)
+    return {
+        "meta": {"time": time(), "channels": args.channels, "messages": args.messages, "stream": args.stream,
+                 "provider": args.provider, "workers": args.workers, "think": args.think, "records": args.records, "dims": args.dims,
+                 "discord_latency": args.discord_latency, "profiles": {k: vars(v) for k, v in profiles.items()}},
+        "summary": summary,
+        "stages": stages,
+        "stubs": stubs.stats(),
+        "discord_calls": discord.calls,
+        "loop": monitor.stats(),
+    }, metrics.report(), monitor.report()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Drives the real on_message handler against local provider and Discord stand-ins.")
+    parser.add_argument("--channels", type=int, default=DEFAULT_CHANNELS, help="concurrent simulated conversations")
+    parser.add_argument("--messages", type=int, default=DEFAULT_MESSAGES, help="messages sent in each conversation")
+    parser.add_argument("--think", type=float, default=DEFAULT_THINK_SECONDS, help="average pause between a reply and the next message")
+    parser.add_argument("--stream", action="store_true", help="stream completions")
+    parser.add_argument("--provider", choices=["openai", "google"], default="openai")
+    parser.add_argument("--workers", type=int, default=0, help="worker processes for the response pipeline, 0 runs it in the bot process")
+    parser.add_argument("--profile", action="append", default=[],
+                        help="service=latency[:jitter[:error_rate[:chunk_delay]]], e.g. openai_chat=2.0:0.5:0.05")
+    parser.add_argument("--discord-latency", type=float, default=DEFAULT_DISCORD_LATENCY)
+    parser.add_argument("--discord-jitter", type=float, default=DEFAULT_DISCORD_JITTER)
+    parser.add_argument("--records", type=int, default=DEFAULT_RECORDS, help="synthetic chat logs already in memory")
+    parser.add_argument("--dims", type=int, default=1536)
+    parser.add_argument("--workdir", default=None, help="where the corpus and database.json live; a temporary directory by default")
+    parser.add_argument("--output", default="e2e_results.json")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+
+    profiles = {name: StubProfile(**vars(profile)) for name, profile in DEFAULT_PROFILES.items()}
+    for text in args.profile:
+        parse_profile(text, profiles)
+    output = os.path.abspath(args.output)
+    temporary = args.workdir is None
+    args.workdir = os.path.abspath(args.workdir or tempfile.mkdtemp(prefix="glovedbot_e2e_"))
+    home = os.getcwd()
+    try:
+        result, stage_report, loop_report = asyncio.run(run(args, profiles))
+    finally:
+        os.chdir(home)
+        if temporary:
+            shutil.rmtree(args.workdir, ignore_errors=True)
+    with open(output, "w", encoding="utf-8") as outfile:
+        json.dump(result, outfile, indent=2)
+    s = result["summary"]
+    print(f"\n{s['messages']} messages over {args.channels} channels in {s['wall_seconds']:.1f}s "
+          f"({s['throughput_per_second']:.2f}/s), {s['errors']} errors")
+    print(f"end to end: p50 {s['p50_seconds']:.2f}s, p95 {s['p95_seconds']:.2f}s, p99 {s['p99_seconds']:.2f}s, max {s['max_seconds']:.2f}s\n")
+    print(stage_report)
+    print("\nEvent loop stalls:\n" + loop_report)
+    print(f"\nResults written to {output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,143 @@
+"""
+Import-time profile of the bot's startup.
+
+    python -m benchmarks.import_profile --output import_baseline.json
+    python -m benchmarks.import_profile --compare import_baseline.json --budget 1.5
+
+Imports src.main in a fresh interpreter under `python -X importtime`, from an empty working directory
+with placeholder credentials, and reports the total import time, the slowest modules and the time
+spent per top-level package. --compare prints the change against an earlier report, which must not be
+the --output file, and exits non-zero when the total grew past --threshold; --budget fails the run when
+the total exceeds that many seconds.
+"""
+from time import time
+import argparse
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+
+DEFAULT_TOP = 25  # slowest modules listed
+DEFAULT_THRESHOLD = 0.2  # total import time growth that counts as a regression
+PLACEHOLDER_ENV = ("GUILD_ID", "DISCORD_BOT_TOKEN", "DISCORD_CLIENT_ID", "OWNER_ID")
+
+
+def import_times(module, env):
+    """
+    Imports a module in a fresh interpreter and parses its -X importtime output.
+    Returns:
+        list: (module, self seconds, cumulative seconds) in import order.
+    """
+    process = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=env["PWD"], env=env, capture_output=True, text=True,
+    )
+    if process.returncode != 0:
+        raise RuntimeError(f"Importing {module} failed:\n{process.stderr[-2000:]}")
+    rows = []
+    for line in process.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        rows.append((name.strip(), int(self_us) / 1e6, int(cumulative_us) / 1e6))
+    return rows
+
+
+def profile(module="src.main", top=DEFAULT_TOP, enabled=None):
+    workdir = tempfile.mkdtemp(prefix="glovedbot_imports_")
+    env = dict(os.environ, PWD=workdir, PYTHONPATH=REPO_DIR, PYTHONDONTWRITEBYTECODE="1")
+    # src.constants requires these at import; nothing is contacted while importing
+    for name in PLACEHOLDER_ENV:
+        env.setdefault(name, "0")
+    if enabled is not None:
+        env["ENABLED_PROVIDERS"] = enabled
+    try:
+        rows = import_times(module, env)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+    packages = {}
+    for name, self_seconds, _ in rows:
+        package = name.split(".")[0]
+        packages[package] = packages.get(package, 0.0) + self_seconds
+    return {
+        "meta": {
+            "time": time(),
+            "module": module,
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "enabled_providers": env.get("ENABLED_PROVIDERS"),
+        },
+        "total": sum(row[1] for row in rows),
+        "modules": len(rows),
+        "slowest": [{"module": name, "self": self_seconds, "cumulative": cumulative}
+                    for name, self_seconds, cumulative in sorted(rows, key=lambda row: -row[2])[:top]],
+        "packages": dict(sorted(packages.items(), key=lambda item: -item[1])),
+    }
+
+
+def print_report(report, top=DEFAULT_TOP):
+    print(f"Imported {report['meta']['module']}: {report['modules']} modules in {report['total'] * 1000:.0f}ms")
+    print(f"\n{'package':<40} {'self ms':>10}")
+    for package, seconds in list(report["packages"].items())[:top]:
+        print(f"{package:<40} {seconds * 1000:>10.1f}")
+    print(f"\n{'module':<60} {'cumulative ms':>14} {'self ms':>10}")
+    for row in report["slowest"]:
+        print(f"{row['module']:<60} {row['cumulative'] * 1000:>14.1f} {row['self'] * 1000:>10.1f}")
+
+
+def compare(current, baseline, threshold=DEFAULT_THRESHOLD):
+    """
+    Prints the total and per-package import time against the baseline report's.
+    Returns:
+        bool: Whether the total grew by more than the threshold.
+    """
+    print(f"\n{'package':<40} {'before ms':>10} {'after ms':>10}")
+    for package in sorted(set(current["packages"]) | set(baseline["packages"]), key=lambda i: -current["packages"].get(i, 0.0)):
+        before = baseline["packages"].get(package, 0.0)
+        after = current["packages"].get(package, 0.0)
+        if abs(after - before) >= 0.001:
+            print(f"{package:<40} {before * 1000:>10.1f} {after * 1000:>10.1f}")
+    change = current["total"] / baseline["total"] - 1 if baseline["total"] else 0.0
+    regressed = change > threshold
+    print(f"{'total':<40} {baseline['total'] * 1000:>10.1f} {current['total'] * 1000:>10.1f} {change:>+8.1%}{'  REGRESSION' if regressed else ''}")
+    return regressed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Profiles the bot's import time.")
+    parser.add_argument("--module", default="src.main", help="module to import")
+    parser.add_argument("--enabled", default=None, help="ENABLED_PROVIDERS to import with, e.g. openai")
+    parser.add_argument("--top", type=int, default=DEFAULT_TOP, help="slowest modules and packages listed")
+    parser.add_argument("--output", default="import_profile.json", help="JSON report file")
+    parser.add_argument("--compare", default=None, help="earlier report to compare against")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD, help="total growth that counts as a regression")
+    parser.add_argument("--budget", type=float, default=None, help="fail when the total import time exceeds this many seconds")
+    args = parser.parse_args(argv)
+    if args.compare and os.path.abspath(args.compare) == os.path.abspath(args.output):
+        parser.error("--compare and --output are the same file, the baseline would be overwritten")
+
+    current = profile(args.module, args.top, args.enabled)
+    print_report(current, args.top)
+    baseline = None
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as infile:
+            baseline = json.load(infile)
+    with open(args.output, "w", encoding="utf-8") as outfile:
+        json.dump(current, outfile, indent=2)
+    print(f"Report written to {args.output}")
+    failed = False
+    if baseline is not None and compare(current, baseline, args.threshold):
+        failed = True
+    if args.budget is not None and current["total"] > args.budget:
+        print(f"Import time {current['total']:.2f}s is over the {args.budget:.2f}s budget")
+        failed = True
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,284 @@
+"""
+Deterministic replay of traffic recorded by src/recorder.py.
+
+    python -m benchmarks.replay src/recordings --speed 1
+    python -m benchmarks.replay src/recordings/traffic_1700000000.000.jsonl --speed 10
+
+Every recorded message the bot answered is re-sent at its recorded offset (divided by --speed, or
+back to back with --speed 0) to the same guild, channel and thread ids, with filler text of the
+recorded length, through the fake Discord layer of benchmarks/e2e.py. Provider calls are answered
+by the stand-ins in recorded order per provider and model, with the recorded latency, failure and
+reply size, so bursts and thread fan-out are reproduced as they happened. The report compares
+replayed latency with the recorded latency and lists messages whose provider calls or outcome
+diverged from the recording. Attachments are counted but not replayed.
+"""
+from collections import Counter, defaultdict, deque
+from time import perf_counter, time
+import argparse
+import asyncio
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+sys.path.insert(0, REPO_DIR)
+
+from benchmarks.corpus import sentence  # noqa: E402
+from benchmarks.e2e import (  # noqa: E402
+    BOT_USER_ID, DEFAULT_DISCORD_LATENCY, DEFAULT_DISCORD_JITTER, DEFAULT_RECORDS,
+    FakeChannel, FakeGuild, FakeUser, boot, latency_summary, percentile, stage_summary,
+)
+from benchmarks.stubs import StubServers, STUB_REPLY_WORDS  # noqa: E402
+
+SERVICE_PROVIDERS = {
+    "openai_chat": "openai",
+    "openai_stream": "openai",
+    "openai_embeddings": "openai",
+    "gemini": "google",
+    "mistral": "mistral",
+    "elevenlabs": "elevenlabs",
+}
+WORDS_PER_TOKEN = 0.75
+DIVERGENCE_EXAMPLES = 10
+
+
+def load_recording(paths):
+    """
+    Reads recorded events from files or directories of traffic_*.jsonl files.
+    Returns:
+        list: Every event, oldest first.
+    """
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            files += sorted(os.path.join(path, i) for i in os.listdir(path) if i.startswith("traffic_") and i.endswith(".jsonl"))
+        else:
+            files.append(path)
+    events = []
+    for file in files:
+        with open(file, "r", encoding="utf-8") as infile:
+            events += [json.loads(line) for line in infile if line.strip()]
+    return sorted(events, key=lambda i: i["time"])
+
+
+class Recording:
+    def __init__(self, events):
+        self.messages = [i for i in events if i["kind"] == "message"]
+        self.replies = {i["message_id"]: i for i in events if i["kind"] == "reply"}
+        self.calls = [i for i in events if i["kind"] == "provider"]
+        self.driven = [i for i in self.messages if i["message_id"] in self.replies]  # the messages the bot answered
+        self.calls_by_message = defaultdict(Counter)
+        for call in self.calls:
+            if call["message_id"] is not None:
+                self.calls_by_message[call["message_id"]][(call["provider"], call["model"], call["stage"])] += 1
+
+    def queues(self):
+        # recorded provider calls per (provider, model), in the order they were made
+        queues = defaultdict(deque)
+        for call in self.calls:
+            queues[(call["provider"], call["model"])].append(call)
+        return queues
+
+
+class ReplayStubs(StubServers):
+    """
+    Answers each provider request with the next recorded call for the same provider and model.
+    """
+
+    def __init__(self, recording, dims=1536, seed=0):
+        super().__init__(dims=dims, seed=seed)
+        self.recorded = recording.queues()
+        self.unrecorded = Counter()  # (provider, model) requests the recording had no sample left for
+
+    def plan(self, service, model):
+        key = (SERVICE_PROVIDERS[service], model)
+        queue = self.recorded.get(key)
+        if not queue:
+            self.unrecorded[key] += 1
+            return super().plan(service, model)
+        call = queue.popleft()
+        words = int(call["completion_tokens"] * WORDS_PER_TOKEN) or STUB_REPLY_WORDS
+        return {"seconds": call["seconds"], "error": 500 if call["error"] else None, "words": words}
+
+
+def filler(rng, length):
+    text = sentence(rng, max(length // 5, 1), max(length // 5, 1) + 1)
+    return text[:max(length, 1)]
+
+
+class Replayer:
+    def __init__(self, main, discord, recording, speed, seed=0):
+        self.main = main
+        self.discord = discord
+        self.recording = recording
+        self.speed = speed
+        self.rng = random.Random(seed)
+        self.guilds = {}
+        self.users = {}
+        self.replayed = {}  # replayed message id -> recorded message id
+        self.calls = defaultdict(Counter)  # recorded message id -> provider calls made while replaying it
+        self.replies = {}  # replayed message id -> the reply event the bot would have recorded
+        self.results = []
+
+    def record_call(self, provider, model, stage, seconds, tags, *counts):
+        recorded = self.replayed.get(tags.get("message"))
+        if recorded is not None:
+            self.calls[recorded][(provider, model, stage)] += 1
+
+    def record_reply(self, message_id, characters, seconds, cached=False, error=False):
+        # stands in for traffic_recorder.record_reply, so replayed latency is measured exactly as recorded latency was
+        self.replies[message_id] = {"characters": characters, "seconds": seconds, "cached": cached, "error": error}
+
+    def guild(self, guild_id):
+        if guild_id is None:
+            return None
+        if guild_id not in self.guilds:
+            self.guilds[guild_id] = FakeGuild(self.discord, guild_id)
+            self.main.database["Guilds"].setdefault(str(guild_id), {"name": "replay", "images": {}, "user_threads": {}})
+        return self.guilds[guild_id]
+
+    def channel(self, event):
+        if event["channel_id"] not in self.discord.channels:
+            channel = FakeChannel(self.discord, self.guild(event["guild_id"]), event["channel_id"], f"replay-{event['channel_id']}")
+            if event["parent_id"] is not None:
+                channel.parent = FakeChannel(self.discord, channel.guild, event["parent_id"], "gloved-gpt")
+            self.discord.channels[channel.id] = channel
+        return self.discord.channels[event["channel_id"]]
+
+    def user(self, event, guild):
+        if event["author"] not in self.users:
+            self.users[event["author"]] = FakeUser(int(event["author"], 16) % 10 ** 17 + 10 ** 17, f"user_{event['author'][:6]}")
+        user = self.users[event["author"]]
+        if guild is not None:
+            guild.members[user.id] = user
+        return user
+
+    async def send(self, event, due):
+        lag = perf_counter() - due
+        channel = self.channel(event)
+        user = self.user(event, channel.guild)
+        mention = f"<@{BOT_USER_ID}> "
+        message = channel.add(user, mention + filler(self.rng, event["content_length"] - len(mention)))
+        self.replayed[str(message.id)] = event["message_id"]
+        started = perf_counter()
+        await self.main.on_message(message)
+        reply = self.replies.get(str(message.id), {"seconds": perf_counter() - started, "error": True, "cached": False})
+        self.results.append({"message_id": event["message_id"], "lag": lag, **reply})
+
+    async def run(self):
+        start = perf_counter()
+        first = self.recording.driven[0]["time"] if self.recording.driven else 0
+        tasks = []
+        for event in self.recording.driven:
+            due = start + ((event["time"] - first) / self.speed if self.speed else 0)
+            await asyncio.sleep(max(due - perf_counter(), 0))
+            tasks.append(asyncio.ensure_future(self.send(event, due)))
+        await asyncio.gather(*tasks)
+        from src.memory import summary_tasks
+        await asyncio.gather(*summary_tasks.values(), return_exceptions=True)  # summaries are provider calls too
+        return perf_counter() - start
+
+    def divergences(self):
+        rows = []
+        for result in self.results:
+            recorded_id = result["message_id"]
+            expected = self.recording.calls_by_message.get(recorded_id, Counter())
+            actual = self.calls.get(recorded_id, Counter())
+            recorded_error = self.recording.replies[recorded_id]["error"]
+            if expected != actual or recorded_error != result["error"]:
+                rows.append({
+                    "message_id": recorded_id,
+                    "missing_calls": {"/".join(k): v for k, v in (expected - actual).items()},
+                    "extra_calls": {"/".join(k): v for k, v in (actual - expected).items()},
+                    "recorded_error": recorded_error,
+                    "replayed_error": result["error"],
+                })
+        return rows
+
+
+async def run(args, recording):
+    stubs = ReplayStubs(recording, dims=args.dims, seed=args.seed)
+    main, monitor, discord = await boot(args, stubs)
+    from src.metrics import metrics
+    from src.usage import usage_ledger
+
+    replayer = Replayer(main, discord, recording, args.speed, args.seed)
+    usage_ledger.listeners.append(replayer.record_call)
+    main.traffic_recorder.record_reply = replayer.record_reply
+    try:
+        wall = await replayer.run()
+    finally:
+        monitor.stop()
+        stubs.stop_thread()
+    recorded = [recording.replies[i["message_id"]]["seconds"] for i in replayer.results]
+    divergences = replayer.divergences()
+    return {
+        "meta": {"time": time(), "speed": args.speed, "messages_recorded": len(recording.messages),
+                 "messages_replayed": len(recording.driven), "provider_calls_recorded": len(recording.calls),
+                 "attachments_skipped": sum(len(i["attachments"]) for i in recording.driven)},
+        "replayed": latency_summary([i["seconds"] for i in replayer.results], sum(i["error"] for i in replayer.results), wall),
+        "recorded": latency_summary(recorded, sum(recording.replies[i["message_id"]]["error"] for i in replayer.results),
+                                    (recording.driven[-1]["time"] - recording.driven[0]["time"]) if recording.driven else 0.0),
+        "schedule_lag_p95": percentile([i["lag"] for i in replayer.results], 0.95),
+        "divergences": len(divergences),
+        "divergence_examples": divergences[:DIVERGENCE_EXAMPLES],
+        "unrecorded_provider_calls": {"/".join(map(str, k)): v for k, v in stubs.unrecorded.items()},
+        "stages": stage_summary(metrics),
+        "discord_calls": discord.calls,
+        "loop": monitor.stats(),
+    }, metrics.report()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Replays recorded traffic against the bot with provider responses served from the recording.")
+    parser.add_argument("paths", nargs="+", help="recording files or directories of traffic_*.jsonl files")
+    parser.add_argument("--speed", type=float, default=1.0, help="replay speed multiplier; 0 sends every message at once")
+    parser.add_argument("--provider", choices=["openai", "google"], default="openai")
+    parser.add_argument("--stream", action="store_true", help="stream completions")
+    parser.add_argument("--discord-latency", type=float, default=DEFAULT_DISCORD_LATENCY)
+    parser.add_argument("--discord-jitter", type=float, default=DEFAULT_DISCORD_JITTER)
+    parser.add_argument("--records", type=int, default=DEFAULT_RECORDS, help="synthetic chat logs already in memory")
+    parser.add_argument("--dims", type=int, default=1536)
+    parser.add_argument("--workdir", default=None, help="where the corpus and database.json live; a temporary directory by default")
+    parser.add_argument("--output", default="replay_results.json")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+
+    recording = Recording(load_recording(args.paths))
+    if not recording.driven:
+        print("No answered messages in the recording.")
+        return 1
+    output = os.path.abspath(args.output)
+    temporary = args.workdir is None
+    args.workdir = os.path.abspath(args.workdir or tempfile.mkdtemp(prefix="glovedbot_replay_"))
+    home = os.getcwd()
+    try:
+        result, stage_report = asyncio.run(run(args, recording))
+    finally:
+        os.chdir(home)
+        if temporary:
+            shutil.rmtree(args.workdir, ignore_errors=True)
+    with open(output, "w", encoding="utf-8") as outfile:
+        json.dump(result, outfile, indent=2)
+    replayed, recorded = result["replayed"], result["recorded"]
+    print(f"\nReplayed {replayed['messages']} messages at {args.speed}x in {replayed['wall_seconds']:.1f}s "
+          f"({replayed['throughput_per_second']:.2f}/s), schedule lag p95 {result['schedule_lag_p95'] * 1000:.0f}ms")
+    print(f"{'':<10} {'p50':>8} {'p95':>8} {'p99':>8} {'max':>8} {'errors':>7}")
+    for label, s in (("recorded", recorded), ("replayed", replayed)):
+        print(f"{label:<10} {s['p50_seconds']:>7.2f}s {s['p95_seconds']:>7.2f}s {s['p99_seconds']:>7.2f}s {s['max_seconds']:>7.2f}s {s['errors']:>7}")
+    print(f"\n{result['divergences']} messages diverged from the recording")
+    for row in result["divergence_examples"]:
+        print(f"  {row['message_id']}: missing {row['missing_calls']}, extra {row['extra_calls']}, "
+              f"error {row['recorded_error']} -> {row['replayed_error']}")
+    if result["unrecorded_provider_calls"]:
+        print(f"Provider calls with no recorded sample: {result['unrecorded_provider_calls']}")
+    print("\n" + stage_report)
+    print(f"\nResults written to {output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,241 @@
+"""
+Benchmarks for the memory and prompt hot paths over synthetic corpora.
+
+    python -m benchmarks.run --records 1000,10000 --output bench_baseline.json
+    python -m benchmarks.run --records 1000,10000 --compare bench_baseline.json
+
+Each scale gets its own corpus under --workdir (a temporary directory by default; pass a directory
+to keep large corpora between runs). Provider calls are replaced by an in-process stub, so the
+numbers cover only the bot's own work. Results are written as JSON; --compare prints the change
+against an earlier results file and exits non-zero when a benchmark slowed past --threshold; it must
+not be the --output file, which would be overwritten.
+"""
+from statistics import mean, median
+from time import perf_counter, time
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+sys.path.insert(0, REPO_DIR)
+
+# src.constants reads these at import; the benchmarks never reach any service
+for name in ("GUILD_ID", "GOOGLE_AI_KEY", "DISCORD_BOT_TOKEN", "DISCORD_CLIENT_ID", "OPENAI_API_KEY",
+             "OWNER_ID", "ELEVENLABS_API_KEY", "MISTRAL_API_KEY"):
+    os.environ.setdefault(name, "0")
+
+from benchmarks.corpus import write_corpus, make_database, sentence  # noqa: E402
+from src import memory  # noqa: E402
+from src.base import Message, Conversation, Prompt  # noqa: E402
+from src.local_embed import LocalIndex  # noqa: E402
+from src.memory_index import MetadataIndex  # noqa: E402
+from src.providers import providers  # noqa: E402
+from src.utils import split_into_shorter_messages  # noqa: E402
+
+DEFAULT_RECORDS = "1000,10000"
+DEFAULT_DIMS = 1536
+DEFAULT_REPEAT = 5
+DEFAULT_THRESHOLD = 0.10  # a median this much slower than the baseline counts as a regression
+FETCH_COUNT = 10
+
+
+class StubResponse:
+    def __init__(self, **fields):
+        self.__dict__.update(fields)
+
+
+class StubClient:
+    """
+    Stands in for the OpenAI client: instant canned completions and random unit embeddings.
+    """
+
+    def __init__(self, dims):
+        self.dims = dims
+        self.chat = StubResponse(completions=StubResponse(create=self.complete))
+        self.embeddings = StubResponse(create=self.embed)
+
+    def complete(self, model, messages, **kwargs):
+        text = "- " + "\n- ".join(messages[-1]["content"].split("\n")[-5:])
+        usage = StubResponse(prompt_tokens=len(messages[-1]["content"]) // 4, completion_tokens=len(text) // 4)
+        return StubResponse(choices=[StubResponse(message=StubResponse(content=text))], usage=usage)
+
+    def embed(self, input, model):
+        inputs = input if isinstance(input, list) else [input]
+        data = [StubResponse(embedding=[random.gauss(0, 1) for _ in range(self.dims)]) for _ in inputs]
+        return StubResponse(data=data, usage=StubResponse(prompt_tokens=sum(len(i) for i in inputs) // 4, completion_tokens=0))
+
+
+def reset_memory():
+    # forget everything src.memory cached from the previous corpus
+    memory.convo_index = None
+    memory.notes_index = None
+    memory.convo_files.clear()
+    memory.local_index = LocalIndex()
+    memory.metadata_index = MetadataIndex()
+    memory.notes_history.clear()
+
+
+def timed(fn, repeat, setup=None):
+    samples = []
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        start = perf_counter()
+        fn()
+        samples.append(perf_counter() - start)
+    return {"min": min(samples), "median": median(samples), "mean": mean(samples), "repeat": repeat}
+
+
+def benchmarks(records, dims):
+    """
+    Returns (name, fn, setup) for every benchmark; run them with the corpus directory as the working directory.
+    """
+    rng = random.Random(records)
+    logs = memory.load_convo()
+    query = logs[len(logs) // 2]
+    vector = [v + 0.01 for v in query["vector"]]  # near a real record without being identical to it
+    text = query["message"].split(" - ", 1)[-1]
+    block = logs[-FETCH_COUNT:]
+    examples = [Conversation([Message(f"user{i % 3}", sentence(rng)) for i in range(6)]) for _ in range(3)]
+    convo = Conversation([Message(i["speaker"], i["message"]) for i in logs[-50:]])
+    prompt = Prompt(header=Message("System", sentence(rng, 200, 300)), examples=examples, convo=convo)
+    reply = sentence(rng, 3000, 3000)
+    database = make_database(max(records // 100, 10))
+
+    def save_database():
+        # same serialization as main.save_database()
+        with open("database.json", "w") as f:
+            json.dump(database, f, indent=4)
+
+    def load_database():
+        with open("database.json", "r") as f:
+            json.load(f)
+
+    def cold_index():
+        reset_memory()
+
+    def warm_index():
+        memory.load_convo_index()
+        memory.load_notes_index()
+
+    return [
+        ("load_convo", memory.load_convo, None),
+        ("load_convo_index", memory.load_convo_index, cold_index),
+        ("fetch_memories", lambda: memory.fetch_memories(vector, logs, FETCH_COUNT), None),
+        ("fetch_notes_first", lambda: memory.fetch_notes_first(vector, FETCH_COUNT, text=text), warm_index),
+        ("fetch_local_memories", lambda: memory.fetch_local_memories(text, FETCH_COUNT), warm_index),
+        ("summarize_memories", lambda: memory.summarize_memories(block), warm_index),
+        ("prompt_render", prompt.render, None),
+        ("split_into_shorter_messages", lambda: split_into_shorter_messages(reply), None),
+        ("database_save", save_database, None),
+        ("database_load", load_database, save_database),
+    ]
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=REPO_DIR, capture_output=True, text=True).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def run(scales, dims, repeat, workdir, only=None, seed=0):
+    providers.install("openai", StubClient(dims))
+    results = []
+    home = os.getcwd()
+    for records in scales:
+        corpus = os.path.join(workdir, f"records_{records}_dims_{dims}")
+        started = perf_counter()
+        if write_corpus(corpus, records, dims, seed):
+            print(f"Generated {records} records in {perf_counter() - started:.1f}s under {corpus}")
+        os.chdir(corpus)
+        try:
+            reset_memory()
+            for name, fn, setup in benchmarks(records, dims):
+                if only and name not in only:
+                    continue
+                stats = timed(fn, repeat, setup)
+                results.append({"name": name, "records": records, "dims": dims, **stats})
+                print(f"{name:<30} {records:>9} {stats['median'] * 1000:>12.3f}ms (min {stats['min'] * 1000:.3f}ms)")
+        finally:
+            shutil.rmtree(os.path.join(corpus, "src", "memories"), ignore_errors=True)
+            os.makedirs(os.path.join(corpus, "src", "memories"), exist_ok=True)
+            os.chdir(home)
+    return {
+        "meta": {
+            "time": time(),
+            "commit": git_commit(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "dims": dims,
+            "repeat": repeat,
+            "seed": seed,
+        },
+        "results": results,
+    }
+
+
+def compare(current, baseline, threshold=DEFAULT_THRESHOLD):
+    """
+    Prints each benchmark's median against the baseline file's.
+    Returns:
+        list: The (name, records) pairs that slowed down by more than the threshold.
+    """
+    before = {(i["name"], i["records"], i["dims"]): i for i in baseline["results"]}
+    regressions = []
+    print(f"\n{'benchmark':<30} {'records':>9} {'before ms':>12} {'after ms':>12} {'change':>8}")
+    for row in current["results"]:
+        old = before.get((row["name"], row["records"], row["dims"]))
+        if old is None:
+            continue
+        change = row["median"] / old["median"] - 1 if old["median"] else 0.0
+        flag = "  REGRESSION" if change > threshold else ""
+        print(f"{row['name']:<30} {row['records']:>9} {old['median'] * 1000:>12.3f} {row['median'] * 1000:>12.3f} {change:>+8.1%}{flag}")
+        if flag:
+            regressions.append((row["name"], row["records"]))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmarks the memory and prompt hot paths over synthetic corpora.")
+    parser.add_argument("--records", default=DEFAULT_RECORDS, help="comma separated corpus sizes, e.g. 1000,100000,1000000")
+    parser.add_argument("--dims", type=int, default=DEFAULT_DIMS, help="embedding dimensions")
+    parser.add_argument("--repeat", type=int, default=DEFAULT_REPEAT, help="timed runs per benchmark")
+    parser.add_argument("--only", default="", help="comma separated benchmark names to run")
+    parser.add_argument("--workdir", default=None, help="where corpora are generated and kept between runs")
+    parser.add_argument("--output", default="bench_results.json", help="JSON results file")
+    parser.add_argument("--compare", default=None, help="earlier results file to compare against")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD, help="slowdown that counts as a regression")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+    if args.compare and os.path.abspath(args.compare) == os.path.abspath(args.output):
+        parser.error("--compare and --output are the same file, the baseline would be overwritten")
+
+    scales = [int(i) for i in args.records.split(",") if i.strip()]
+    only = set(filter(None, args.only.split(",")))
+    workdir = args.workdir or tempfile.mkdtemp(prefix="glovedbot_bench_")
+    try:
+        current = run(scales, args.dims, args.repeat, os.path.abspath(workdir), only, args.seed)
+    finally:
+        if args.workdir is None:
+            shutil.rmtree(workdir, ignore_errors=True)
+    baseline = None
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as infile:
+            baseline = json.load(infile)
+    with open(args.output, "w", encoding="utf-8") as outfile:
+        json.dump(current, outfile, indent=2)
+    print(f"Results written to {args.output}")
+    if baseline is not None and compare(current, baseline, args.threshold):
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
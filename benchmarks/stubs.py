@@ -0,0 +1,255 @@
+"""
+Local stand-ins for the provider APIs the bot calls.
+One aiohttp server answers OpenAI chat (plain and streamed) and embeddings, Gemini generateContent,
+Mistral chat and ElevenLabs text-to-speech in the shapes their SDKs expect. Every service has its own
+latency, jitter and error injection, and the server counts the requests and errors it served.
+"""
+from dataclasses import dataclass
+from time import time
+import asyncio
+import base64
+import hashlib
+import json
+import random
+import threading
+import numpy as np
+
+STUB_HOST = "127.0.0.1"
+STUB_REPLY_WORDS = 60
+SERVICES = ("openai_chat", "openai_stream", "openai_embeddings", "gemini", "mistral", "elevenlabs")
+
+
+@dataclass
+class StubProfile:
+    latency: float = 0.0  # seconds before the response (or before the first streamed chunk)
+    jitter: float = 0.0  # up to this much extra latency, uniformly random
+    error_rate: float = 0.0  # share of requests answered with error_status
+    error_status: int = 500
+    chunk_delay: float = 0.0  # seconds between streamed chunks
+
+
+DEFAULT_PROFILES = {
+    "openai_chat": StubProfile(latency=1.5, jitter=1.0),
+    "openai_stream": StubProfile(latency=0.4, jitter=0.3, chunk_delay=0.02),
+    "openai_embeddings": StubProfile(latency=0.15, jitter=0.1),
+    "gemini": StubProfile(latency=1.0, jitter=0.8),
+    "mistral": StubProfile(latency=1.0, jitter=0.8),
+    "elevenlabs": StubProfile(latency=1.5, jitter=1.0),
+}
+
+
+def parse_profile(text, profiles):
+    # "openai_chat=2.0:0.5:0.05" -> latency 2.0s, jitter 0.5s, 5% errors
+    name, _, values = text.partition("=")
+    if name not in SERVICES:
+        raise ValueError(f"Unknown stub service {name}, expected one of {', '.join(SERVICES)}")
+    fields = ("latency", "jitter", "error_rate", "chunk_delay")
+    for field, value in zip(fields, values.split(":")):
+        if value:
+            setattr(profiles[name], field, float(value))
+    return profiles
+
+
+def stub_vector(text, dims):
+    # deterministic unit vector per text, so repeated messages embed identically
+    seed = int.from_bytes(hashlib.sha256(text.encode("utf-8")).digest()[:8], "little")
+    vector = np.random.default_rng(seed).standard_normal(dims).astype(np.float32)
+    return vector / np.linalg.norm(vector)
+
+
+def stub_reply(prompt, words=STUB_REPLY_WORDS):
+    rng = random.Random(prompt[-200:])
+    vocabulary = prompt.split() or ["ok"]
+    return " ".join(rng.choice(vocabulary) for _ in range(words))
+
+
+class StubServers:
+    def __init__(self, profiles=None, dims=1536, seed=0):
+        self.profiles = profiles or {name: StubProfile(**vars(profile)) for name, profile in DEFAULT_PROFILES.items()}
+        self.dims = dims
+        self.rng = random.Random(seed)
+        self.requests = dict.fromkeys(SERVICES, 0)
+        self.errors = dict.fromkeys(SERVICES, 0)
+        self.runner = None
+        self.url = None
+        self.loop = None
+        self.thread = None
+
+    def plan(self, service, model):
+        """
+        Decides how one request is answered; override to serve something other than the service profile.
+        Returns:
+            dict: "seconds" of latency, whether it fails with an "error" status (or None), and reply "words".
+        """
+        profile = self.profiles[service]
+        failed = self.rng.random() < profile.error_rate
+        return {
+            "seconds": profile.latency + self.rng.uniform(0, profile.jitter),
+            "error": profile.error_status if failed else None,
+            "words": STUB_REPLY_WORDS,
+        }
+
+    async def delay(self, service, model=None):
+        """
+        Waits out the request's latency.
+        Returns:
+            (error response to send instead or None, the request's plan)
+        """
+        from aiohttp import web
+
+        plan = self.plan(service, model)
+        self.requests[service] += 1
+        await asyncio.sleep(plan["seconds"])
+        if plan["error"] is not None:
+            self.errors[service] += 1
+            body = {"error": {"message": f"injected {service} error", "type": "server_error", "code": plan["error"]}}
+            return web.json_response(body, status=plan["error"]), plan
+        return None, plan
+
+    def completion_body(self, model, content, prompt):
+        return {
+            "id": f"chatcmpl-stub-{self.rng.getrandbits(32):x}",
+            "object": "chat.completion",
+            "created": int(time()),
+            "model": model,
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+            "usage": {"prompt_tokens": len(prompt) // 4, "completion_tokens": len(content) // 4, "total_tokens": (len(prompt) + len(content)) // 4},
+        }
+
+    async def chat(self, request, service="openai_chat"):
+        from aiohttp import web
+
+        body = await request.json()
+        prompt = "\n".join(str(m.get("content", "")) for m in body.get("messages", []))
+        model = body.get("model", "stub")
+        if body.get("stream") and service == "openai_chat":
+            service = "openai_stream"
+        error, plan = await self.delay(service, model)
+        if error is not None:
+            return error
+        content = stub_reply(prompt, plan["words"])
+        if not body.get("stream"):
+            return web.json_response(self.completion_body(model, content, prompt))
+        response = web.StreamResponse(headers={"Content-Type": "text/event-stream"})
+        await response.prepare(request)
+        created = int(time())
+        for word in content.split(" "):
+            chunk = {
+                "id": "chatcmpl-stub",
+                "object": "chat.completion.chunk",
+                "created": created,
+                "model": model,
+                "choices": [{"index": 0, "delta": {"content": word + " "}, "finish_reason": None}],
+            }
+            await response.write(f"data: {json.dumps(chunk)}\n\n".encode("utf-8"))
+            await asyncio.sleep(self.profiles[service].chunk_delay)
+        await response.write(b"data: [DONE]\n\n")
+        await response.write_eof()
+        return response
+
+    async def mistral(self, request):
+        return await self.chat(request, "mistral")
+
+    async def embeddings(self, request):
+        from aiohttp import web
+
+        body = await request.json()
+        inputs = body["input"] if isinstance(body["input"], list) else [body["input"]]
+        error, plan = await self.delay("openai_embeddings", body.get("model"))
+        if error is not None:
+            return error
+        data = []
+        for index, text in enumerate(inputs):
+            vector = stub_vector(str(text), self.dims)
+            if body.get("encoding_format") == "base64":
+                embedding = base64.b64encode(vector.tobytes()).decode("ascii")
+            else:
+                embedding = vector.tolist()
+            data.append({"object": "embedding", "index": index, "embedding": embedding})
+        tokens = sum(len(str(i)) for i in inputs) // 4
+        return web.json_response({"object": "list", "data": data, "model": body.get("model", "stub"), "usage": {"prompt_tokens": tokens, "total_tokens": tokens}})
+
+    async def gemini(self, request):
+        from aiohttp import web
+
+        body = await request.json()
+        error, plan = await self.delay("gemini", request.match_info["call"].split(":")[0])
+        if error is not None:
+            return error
+        prompt = "\n".join(part.get("text", "") for content in body.get("contents", []) for part in content.get("parts", []))
+        candidate = {"content": {"parts": [{"text": stub_reply(prompt, plan["words"])}], "role": "model"}, "finishReason": "STOP", "index": 0, "safetyRatings": []}
+        return web.json_response({"candidates": [candidate], "promptFeedback": {"safetyRatings": []}})
+
+    async def elevenlabs(self, request):
+        from aiohttp import web
+
+        body = await request.json()
+        error, plan = await self.delay("elevenlabs", body.get("model_id"))
+        if error is not None:
+            return error
+        return web.Response(body=b"\xff\xfb\x90\x00" + bytes(413), content_type="audio/mpeg")  # one silent MP3 frame
+
+    async def start(self, host=STUB_HOST, port=0):
+        """
+        Starts the server; port 0 picks a free one.
+        Returns:
+            dict: Base URLs to point each SDK at.
+        """
+        from aiohttp import web
+
+        app = web.Application(client_max_size=64 * 1024 * 1024)
+        app.router.add_post("/openai/v1/chat/completions", self.chat)
+        app.router.add_post("/openai/v1/embeddings", self.embeddings)
+        app.router.add_post("/mistral/v1/chat/completions", self.mistral)
+        app.router.add_post(r"/v1beta/models/{call:[^/]+}", self.gemini)
+        app.router.add_post("/elevenlabs/v1/text-to-speech/{voice}", self.elevenlabs)
+        app.router.add_post("/elevenlabs/v1/text-to-speech/{voice}/stream", self.elevenlabs)
+        self.runner = web.AppRunner(app)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, host, port)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        self.url = f"http://{host}:{port}"
+        return {
+            "OPENAI_BASE_URL": f"{self.url}/openai/v1",
+            "MISTRAL_ENDPOINT": f"{self.url}/mistral",
+            "GOOGLE_AI_ENDPOINT": self.url,
+            "ELEVEN_BASE_URL": f"{self.url}/elevenlabs/v1",
+        }
+
+    async def stop(self):
+        if self.runner is not None:
+            await self.runner.cleanup()
+            self.runner = None
+
+    def start_in_thread(self, host=STUB_HOST, port=0):
+        """
+        Runs the server on its own event loop in a daemon thread, like a remote API it keeps answering
+        while the caller's loop is blocked (the bot reads streamed completions synchronously).
+        Returns:
+            dict: Base URLs to point each SDK at.
+        """
+        ready = threading.Event()
+        endpoints = {}
+
+        def serve():
+            self.loop = asyncio.new_event_loop()
+            endpoints.update(self.loop.run_until_complete(self.start(host, port)))
+            ready.set()
+            self.loop.run_forever()
+
+        self.thread = threading.Thread(target=serve, name="provider-stubs", daemon=True)
+        self.thread.start()
+        ready.wait()
+        return endpoints
+
+    def stop_thread(self):
+        if self.loop is None:
+            return
+        asyncio.run_coroutine_threadsafe(self.stop(), self.loop).result()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+        self.loop = None
+
+    def stats(self):
+        return {name: {"requests": self.requests[name], "errors": self.errors[name]} for name in SERVICES}
@@ -0,0 +1,13 @@
+"""
+Starts the bot:
+
+    python -m src
+
+Spawned process pool children (src/executors.py) re-run the main module of the process that spawned
+them, unless it is a package's __main__ like this one. Started this way they never load src.main, with
+its database, bot and command registration.
+"""
+from src.main import run
+
+if __name__ == "__main__":
+    run()
@@ -0,0 +1,117 @@
+"""
+Per-guild setup after connecting, and application command sync.
+Guilds are bootstrapped concurrently behind a semaphore, and each one is only written to when the
+admin role is missing, its permissions have drifted or the owner lacks it. Command sync is skipped
+when the command definitions hash the same as at the last sync and Discord still lists the same ids,
+reusing those ids.
+"""
+from time import perf_counter
+import asyncio
+import hashlib
+import json
+import discord
+from discord.utils import get as discord_get
+from src.entities import entities
+from src.metrics import span
+
+BOOTSTRAP_CONCURRENCY = 5  # guilds set up at once
+ADMIN_PERMISSIONS = discord.Permissions(administrator=True)
+
+
+async def bootstrap_guild(guild, role_name, owner_id):
+    """
+    Makes sure the guild has the admin role with administrator permissions and that the owner holds it.
+    Returns:
+        list: The changes made, empty when nothing had drifted.
+    """
+    changes = []
+    me = guild.me
+    if me is None or not me.guild_permissions.manage_roles:
+        print(f"Missing Manage Roles in {guild.name} (ID: {guild.id}), skipping admin role!")
+        return changes
+    role = discord_get(guild.roles, name=role_name)
+    if role is None:
+        role = await guild.create_role(name=role_name, permissions=ADMIN_PERMISSIONS)
+        changes.append("created role")
+    elif role >= me.top_role:
+        print(f"Role ({role.name}) is above the bot's top role in {guild.name}, skipping!")
+        return changes
+    elif role.permissions != ADMIN_PERMISSIONS:
+        await role.edit(permissions=ADMIN_PERMISSIONS)
+        changes.append("reset role permissions")
+    owner = await entities.member(guild, owner_id)  # member cache first, REST only on a miss
+    if owner is None:
+        print(f"Owner not found in {guild.name} (ID: {guild.id})!")
+        return changes
+    if role not in owner.roles:
+        await owner.add_roles(role)
+        changes.append(f"added role to {owner.name}")
+    return changes
+
+
+async def bootstrap_guilds(guilds, role_name, owner_id, concurrency=BOOTSTRAP_CONCURRENCY):
+    """
+    Bootstraps every guild, at most concurrency at a time; one guild failing does not stop the rest.
+    Returns:
+        dict: Guild id -> the changes made, or the exception that guild failed with.
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+    start = perf_counter()
+
+    async def one(guild):
+        async with semaphore:
+            with span("bootstrap.guild", guild.id):
+                try:
+                    changes = await bootstrap_guild(guild, role_name, owner_id)
+                except Exception as e:
+                    print(f"Failed to set up admin role in {guild.name} (ID: {guild.id}): {e}")
+                    return guild.id, e
+        if changes:
+            print(f"{guild.name} (ID: {guild.id}): {', '.join(changes)}")
+        return guild.id, changes
+
+    results = dict(await asyncio.gather(*(one(guild) for guild in guilds)))
+    changed = sum(1 for i in results.values() if i and not isinstance(i, Exception))
+    failed = sum(1 for i in results.values() if isinstance(i, Exception))
+    print(f"Bootstrapped {len(results)} guilds in {perf_counter() - start:.1f}s ({changed} changed, {failed} failed)")
+    return results
+
+
+def command_hash(commands, application_id):
+    payload = [str(application_id)] + sorted(json.dumps(cmd.to_dict(), sort_keys=True, default=str) for cmd in commands)
+    return hashlib.sha256("\n".join(payload).encode("utf-8")).hexdigest()
+
+
+async def sync_commands(bot, cache):
+    """
+    Syncs application commands unless they are unchanged since the sync recorded in cache.
+    Only global commands are cached; with guild commands every connect does a full sync.
+    Args:
+        bot (discord.Bot): The bot whose pending commands are synced.
+        cache (dict): Persistent dict holding the last sync's "hash" and command "ids".
+    Returns:
+        bool: Whether a sync with Discord was done.
+    """
+    commands = bot.pending_application_commands
+    digest = command_hash(commands, bot.application_id)
+    ids = cache.get("ids", {})
+    cacheable = all(cmd.guild_ids is None for cmd in commands)
+    # py-cord keeps no public way to register already-synced commands, so the skip depends on this mapping
+    registry = getattr(bot, "_application_commands", None)
+    if cacheable and isinstance(registry, dict) and cache.get("hash") == digest and all(cmd.name in ids for cmd in commands):
+        # one cheap read catches commands changed on Discord's side, e.g. by another instance with the same token
+        remote = await bot.http.get_global_commands(bot.application_id)
+        if {i["name"]: str(i["id"]) for i in remote} == {cmd.name: ids[cmd.name] for cmd in commands}:
+            for cmd in commands:
+                cmd.id = int(ids[cmd.name])
+                registry[cmd.id] = cmd  # what sync_commands fills in from Discord's reply
+            print(f"Commands unchanged, skipped sync of {len(commands)} commands")
+            return False
+        print("Commands changed on Discord since the last sync, syncing")
+    with span("bootstrap.command_sync"):
+        await bot.sync_commands()
+    cache.clear()
+    if cacheable:
+        cache.update(hash=digest, ids={cmd.name: str(cmd.id) for cmd in commands if cmd.id is not None})
+    print(f"Synced {len(commands)} commands")
+    return True
@@ -1,30 +1,42 @@
 from time import time
 from uuid import uuid4
 from src.memory import *
-from datetime import datetime
 from src.base import Message, Prompt, Conversation
 from src.utils import (split_into_shorter_messages, discord_message_to_message)
 import discord
 from src.constants import (
-    BOT_INSTRUCTIONS,
-    BOT_NAME,
-    EXAMPLE_CONVOS,
+    MAX_MESSAGE_HISTORY,
     logger,
 )
+from src.ingest import ingest_queue
+from src.memory_index import MemoryFilter
+from src.response_cache import response_cache
+from src.pipeline import Pipeline, Stage
 from typing import Optional, List
-import json
+import re
 import asyncio
 from enum import Enum
 from dataclasses import dataclass
-import openai
-from openai import OpenAI
+from types import SimpleNamespace
+from src.providers import providers
+from src.usage import track_usage, openai_usage
+from src.executors import executors
+from src.outbound import outbound, PROGRESS
+from src.entities import entities
+from src.config_service import config_service
 
-client = OpenAI()
-bot = discord.Client()
 
+bot_identity = None  # the bot's Discord name once connected; prompts use it in place of the config's name
 
-MY_BOT_NAME = BOT_NAME
-MY_BOT_EXAMPLE_CONVOS = EXAMPLE_CONVOS
+
+def set_bot_identity(name):
+    global bot_identity
+    bot_identity = name
+
+
+def prompt_persona(digest=None):
+    # the persona of the config version a request started with, memoized per version and bot name
+    return config_service.get(digest).persona(bot_identity)
 
 
 class CompletionResult(Enum):
@@ -52,12 +64,13 @@ async def generate_completion_response(
     try:
         timestamp = time()
         timestring = timestring = timestamp_to_datetime(timestamp)
+        persona = prompt_persona()
         prompt = Prompt(
             header=Message(
-                "System", f"Instructions for {MY_BOT_NAME}: {BOT_INSTRUCTIONS}"
+                "System", f"Instructions for {persona.name}: {persona.instructions}"
             ),
-            examples=MY_BOT_EXAMPLE_CONVOS,
-            convo=Conversation(messages + [Message(f"{timestring} {MY_BOT_NAME}")]),
+            examples=persona.examples,
+            convo=Conversation(messages + [Message(f"{timestring} {persona.name}")]),
         )
 
         rendered = prompt.render()
@@ -73,9 +86,9 @@ async def generate_completion_response(
 
         # You can rollback to using text-davincini-003 by swapping the active "response =" and "reply ="
 
-        response = client.chat.completions.create(model="gpt-3.5-turbo",
-                                                  messages=[{"role": "system", "content": rendered}],
-                                                  stream=True)
+        response = providers.get("openai").chat.completions.create(model="gpt-3.5-turbo",
+                                                                    messages=[{"role": "system", "content": rendered}],
+                                                                    stream=True)
 
         # Below for "text-davinci-003" model
         # reply = response.choices[0].text.strip()
@@ -101,19 +114,19 @@ async def generate_completion_response(
                 # Discord best practices recommend adding a sleep timer when editing messages frequently
                 await asyncio.sleep(0.5)
 
-    except openai.InvalidRequestError as e:
-        if "This model's maximum context length" in e.user_message:
-            return CompletionData(
-                status=CompletionResult.TOO_LONG, reply_text=None, status_text=str(e)
-            )
-        else:
+    except Exception as e:
+        # matched by name so the openai SDK is only imported once a client is built
+        if type(e).__name__ in ("InvalidRequestError", "BadRequestError"):
+            if "This model's maximum context length" in getattr(e, "user_message", str(e)):
+                return CompletionData(
+                    status=CompletionResult.TOO_LONG, reply_text=None, status_text=str(e)
+                )
             logger.exception(e)
             return CompletionData(
                 status=CompletionResult.INVALID_REQUEST,
                 reply_text=None,
                 status_text=str(e),
             )
-    except Exception as e:
         logger.exception(e)
         return CompletionData(
             status=CompletionResult.OTHER_ERROR, reply_text=None, status_text=str(e)
@@ -159,132 +172,205 @@ async def process_response(
         )
 
 
-async def GenerateOpenAIResponse(channel: discord.TextChannel, message: discord.Message = None):
-    MentionContent = message.content.removeprefix("<@938447947857821696> ")
-    if bot.user.mentioned_in(message):
-        message.content = message.content.removeprefix("<@938447947857821696> ")
+RESPONSE_STAGE_TIMEOUTS = {
+    "status": 5.0,
+    "history": 5.0,
+    "mentions": 5.0,
+    "notes": 20.0,
+}
+
+
+async def status_stage(ctx):
+    # progress text: not awaited, and dropped by the outbound scheduler when the channel is short of budget
+    outbound.edit(ctx["interactive_response"], "**```Loading Memories...```**", PROGRESS)
+
+
+async def embed_stage(ctx):
     logger.info("Embedding Message!")
-    vector = gpt3_embedding(message)
+    # the content without the bot's mention; the message itself may be py-cord's cached copy and is left as is
+    return await embed_with_deadline(SimpleNamespace(content=ctx["content"]))
+
+
+async def store_stage(ctx):
+    vector = ctx["embed"]
+    message = ctx["message"]
     timestamp = time()
-    timestring = timestring = timestamp_to_datetime(timestamp)
+    timestring = timestamp_to_datetime(timestamp)
     user = message.author.name
-    extracted_message = "%s: %s - %s" % (user, timestring, MentionContent)
-    info = {
-        "speaker": user,
-        "timestamp": timestamp,
-        "uuid": str(uuid4()),
-        "vector": vector,
-        "message": extracted_message,
-        "timestring": timestring,
-    }
-    filename = "log_%s_user" % timestamp
-    save_json(f"./src/chat_logs/{filename}.json", info)
-    history = load_convo()
-    logger.info("Loading Memories!")
-    thinkingText = "**```Loading Memories...```**"
-    await interactive_response.edit(content=thinkingText)
-    memories = fetch_memories(vector, history, 5)
-    current_notes, vector = summarize_memories(memories)
-    logger.info(current_notes)
-    print(
-        "-------------------------------------------------------------------------------"
-    )
-    add_notes(current_notes)
-    if len(notes_history) >= 2:
-        print(notes_history[-2])
+    if vector is not None:
+        info = {
+            "speaker": user,
+            "timestamp": timestamp,
+            "uuid": str(uuid4()),
+            "vector": vector,
+            "message": "%s: %s - %s" % (user, timestring, ctx["content"]),
+            "timestring": timestring,
+            "channel_id": ctx["channel"].id,
+        }
+        save_chat_log("log_%s_user" % timestamp, info)
     else:
-        print(
-            "The list does not have enough elements to access the second-to-last element."
-        )
-    message_notes = Message(user="memories", text=current_notes)
-    context_notes = None
-    if len(notes_history) >= 2:
-        context_notes = Message(user="context", text=notes_history[-2])
+        # remote embedder unavailable, store the message once it recovers
+        ingest_queue.enqueue(ctx["message_id"], user, ctx["content"], source="user", channel_id=ctx["channel"].id)
+    return timestamp
+
+
+async def cache_stage(ctx):
+    vector = ctx["embed"]
+    if vector is None or not ctx["cache_enabled"]:
+        return None
+    return response_cache.lookup(ctx["cache_namespace"], ctx["prompt_prefix"], vector)
+
+
+def retrieve_memories(vector, content, speaker):
+    if vector is None:
+        return None, fetch_local_memories(content, 5)
+    reused_notes, memories = fetch_notes_first(vector, 5, text=content)
+    if reused_notes is None:
+        where = MemoryFilter(speaker=speaker, since=time() - PERSONAL_MEMORY_DAYS * 24 * 60 * 60)
+        seen = {i["uuid"] for i in memories}
+        personal = fetch_filtered_memories(vector, PERSONAL_MEMORY_COUNT, where)
+        memories += [i for i in personal if i["uuid"] not in seen]
+    return reused_notes, memories
+
+
+async def memories_stage(ctx):
+    # vector scoring over a large hot index runs in a thread, so it never holds up gateway heartbeats
+    if not memory_ready():
+        logger.info("Memory index still loading! Answering from recent history only.")
+        return None, []
+    return await executors.run("scan", retrieve_memories, ctx["embed"], ctx["content"], ctx["message"].author.name, size=hot_index_size())
+
+
+async def notes_stage(ctx):
+    reused_notes, memories = ctx["memories"]
+    channel_id = ctx["channel"].id
+    summary = channel_summaries.get(channel_id)
+    summarize_after_reply = reused_notes is None
+    if reused_notes is not None:
+        logger.info("Reusing existing notes!")
+        current_notes = reused_notes["notes"]
+    elif summary is None and SYNC_SUMMARY_WHEN_MISSING and memories:
+        logger.info("No summary for this channel yet! Summarizing...")
+        current_notes = await refresh_summary(channel_id, memories)
+        summarize_after_reply = False
     else:
-        print("The list does not have enough elements create context")
-    logger.info(
-        f"Message to process - {message.author}: {message.content[:50]} - {channel.id} {channel.jump_url}"
-    )
-    thinkingText = "**```Reading Previous Messages...```**"
-    await interactive_response.edit(content=thinkingText)
-    if not channel.type == discord.ChannelType.text:
+        current_notes = memories_to_text(memories)
+    return current_notes, summary, summarize_after_reply
+
+
+def notes_fallback(ctx, error):
+    reused_notes, memories = ctx["memories"]
+    return memories_to_text(memories), channel_summaries.get(ctx["channel"].id), True
+
+
+async def history_stage(ctx):
+    message = ctx["message"]
+    if not ctx["text_channel"]:
         logger.info("Public Thread Message Recieved!")
         channel_messages = [
             discord_message_to_message(msg)
             async for msg in message.channel.history(limit=MAX_MESSAGE_HISTORY)
+            if msg.id != ctx["interactive_response"].id
         ]
     else:
         channel_messages = [discord_message_to_message(message)]
-    if message.thread is None:
-        logger.info("Thread Message Recieved!")
-        logger.info(message.content)
     channel_messages = [x for x in channel_messages if x is not None]
     channel_messages.reverse()
-    channel_messages.insert(0, message_notes)
-    if context_notes:
-        channel_messages.insert(0, context_notes)
-    timestamp = time()
-    timestring = timestring = timestamp_to_datetime(timestamp)
+    return channel_messages
+
+
+def history_fallback(ctx, error):
+    return [x for x in [discord_message_to_message(ctx["message"])] if x is not None]
+
+
+async def resolve_user_name(bot, user_id):
+    user = await entities.user(bot, user_id)
+    return user.name
+
+
+async def mentions_stage(ctx):
+    texts = [ctx["content"]] + [m.text for m in ctx["history"] if m.text]
+    ids = sorted(set(re.findall(r"<@(\d+)>", "\n".join(texts))))
+    names = await asyncio.gather(*[resolve_user_name(ctx["bot"], i) for i in ids], return_exceptions=True)
+    return {i: name for i, name in zip(ids, names) if isinstance(name, str)}
+
+
+async def render_stage(ctx):
+    current_notes, summary, summarize_after_reply = ctx["notes"]
+    channel_messages = list(ctx["history"])
+    channel_messages.insert(0, Message(user="memories", text=current_notes))
+    if summary is not None:
+        channel_messages.insert(0, Message(user="context", text=summary))
+    timestring = timestamp_to_datetime(time())
+    persona = prompt_persona(ctx.get("config_digest"))
     prompt = Prompt(
         header=Message(
-            "System", f"Instructions for {MY_BOT_NAME}: {BOT_INSTRUCTIONS}"
-        ),
-        examples=MY_BOT_EXAMPLE_CONVOS,
-        convo=Conversation(
-            channel_messages + [Message(f"{timestring} {MY_BOT_NAME}")]
+            "System", f"Instructions for {persona.name}: {persona.instructions}"
         ),
+        examples=persona.examples,
+        convo=Conversation(channel_messages + [Message(f"{timestring} {persona.name}")]),
     )
     rendered = prompt.render()
-    mentions = re.findall(r"<@(\d+)>", rendered)
-    for mention in mentions:
-        user = await bot.fetch_user(mention)
-        rendered = rendered.replace(f"<@{mention}>", user.name)
-    rendered.replace(
-        f"\n<|endoftext|>GlovedBot: **```Reading Previous Messages...```**", ""
-    )
-    logger.info(rendered)
-    logger.info("Prompt Rendered!")
-    thinkingText = "**```Creating Response...```** \n"
-    await interactive_response.edit(content=thinkingText)
-    completions = client.chat.completions.create(
-        model="gpt-4",
-        messages=[{"role": "system", "content": rendered}],
-        temperature=1.0,
-        stream=streamMode,
-    )
-    if not streamMode:
-        logger.info("Stream Mode Off")
-        full_reply_content = completions.choices[0].message.content
-        reply_content = [
-            full_reply_content[i: i + 2000]
-            for i in range(0, len(full_reply_content), 2000)
-        ]
-        await interactive_response.edit(content=reply_content[0])
-        for msg in reply_content[1:]:
-            interactive_response = await channel.send(msg)
-            logger.info("Message character limit reached. Sending chunk.")
-    else:
-        logger.info("Stream Mode On")
-        collected_chunks = []
-        collected_messages = []
-        full_reply_content_combined = ""
-        logger.info("Getting chunks...")
-        for chunk in completions:
-            await asyncio.sleep(0.4)
-            collected_chunks.append(chunk)
-            chunk_message = chunk.choices[0].delta
-            if chunk_message.content is not None:
-                collected_messages.append(chunk_message)
-            full_reply_content = "".join([m.content for m in collected_messages])
-            if full_reply_content and not full_reply_content.isspace():
-                await interactive_response.edit(
-                    content=thinkingText + full_reply_content
-                )
-            if len(full_reply_content) > 1950:
-                full_reply_content_combined = full_reply_content
-                await interactive_response.edit(content=full_reply_content)
-                interactive_response = await channel.send(thinkingText)
-                collected_messages = []
-                logger.info("Message character limit reached. Started new message.")
-        logger.info("full_reply_content: " + full_reply_content)
-        await interactive_response.edit(content=full_reply_content)
+    for user_id, name in ctx["mentions"].items():
+        rendered = rendered.replace(f"<@{user_id}>", name)
+    for user_id in set(re.findall(r"<@(\d+)>", rendered)):
+        # mentions that only appear in memories, resolved from the cache alone
+        user = ctx["bot"].get_user(int(user_id))
+        if user is not None:
+            rendered = rendered.replace(f"<@{user_id}>", user.name)
+    return rendered
+
+
+RESPONSE_STAGES = [
+    Stage("status", status_stage, timeout=RESPONSE_STAGE_TIMEOUTS["status"], fallback=lambda ctx, error: None),
+    Stage("embed", embed_stage),
+    Stage("store", store_stage, deps=("embed",)),
+    # a cached reply ends the run before retrieval, history and rendering; the message is stored either way
+    Stage("cache", cache_stage, deps=("embed", "store"), stop=lambda reply: reply is not None),
+    Stage("memories", memories_stage, deps=("embed", "cache")),
+    Stage("notes", notes_stage, deps=("memories", "cache"), timeout=RESPONSE_STAGE_TIMEOUTS["notes"], fallback=notes_fallback),
+    Stage("history", history_stage, timeout=RESPONSE_STAGE_TIMEOUTS["history"], fallback=history_fallback),
+    Stage("mentions", mentions_stage, deps=("history",), timeout=RESPONSE_STAGE_TIMEOUTS["mentions"], fallback=lambda ctx, error: {}),
+    Stage("render", render_stage, deps=("notes", "history", "mentions")),
+]
+DISCORD_STAGES = ("status", "history", "mentions")  # the stages that talk to Discord
+
+response_pipeline = Pipeline(RESPONSE_STAGES, name="response")
+# split mode: the gateway process runs the Discord stages, a worker process the memory work and rendering
+gateway_pipeline = Pipeline([i for i in RESPONSE_STAGES if i.name in DISCORD_STAGES], name="gateway")
+worker_pipeline = Pipeline([i for i in RESPONSE_STAGES if i.name not in DISCORD_STAGES], name="worker", inputs=DISCORD_STAGES)
+
+
+async def prepare_response(
+    bot: discord.Client,
+    channel: discord.TextChannel,
+    message: discord.Message,
+    interactive_response: discord.Message,
+    **inputs,
+) -> dict:
+    """
+    Runs everything that has to happen before the completion call: embedding and storing the message,
+    memory retrieval, the response cache lookup, channel history, mention resolution and prompt rendering.
+    Independent stages run concurrently.
+    Args:
+        bot (discord.Client): The bot, used to resolve mentions.
+        channel (discord.TextChannel): The channel the response is written to.
+        message (discord.Message): The message being answered.
+        interactive_response (discord.Message): The status message that will hold the response.
+        **inputs: content, message_id, text_channel, cache_enabled, cache_namespace, prompt_prefix and config_digest.
+    Returns:
+        dict: The pipeline context; "render" holds the rendered prompt and "cache" any cached reply. On a
+        cache hit the stages still running are skipped, so only "embed", "store" and "cache" are certain to be set.
+    """
+    ctx = dict(inputs, bot=bot, channel=channel, message=message, interactive_response=interactive_response)
+    return await response_pipeline.run(ctx)
+
+
+def create_completion(**args):
+    # a non-streamed completion that records its own usage; called through provider_calls, identical requests
+    # sharing it are billed once, to the request that made the call
+    with track_usage("openai", args["model"], "completion") as usage:
+        completions = providers.get("openai").chat.completions.create(**args)
+        reply = completions.choices[0].message.content or ""
+        usage.update(openai_usage(completions), characters=sum(len(i["content"]) for i in args["messages"]) + len(reply))
+    return completions
@@ -0,0 +1,183 @@
+"""
+Hot reloading of config.yaml, the bot's persona and example conversations.
+The file is watched with watchdog and every change is parsed and validated with dacite before it is
+swapped in as a new, immutable config version; an invalid edit is reported and the running version
+kept. Requests capture the version they started with, so a swap never changes a prompt halfway through.
+Anything derived from a version (the persona with the bot's Discord name, the prompt prefix hash the
+response cache is keyed by) is memoized on that version, and listeners drop what the old one produced.
+"""
+from collections import OrderedDict
+from dataclasses import asdict, dataclass
+from time import time
+import asyncio
+import hashlib
+import json
+import os
+from typing import List
+import dacite
+import yaml
+from src.base import Config, Conversation, Message
+from src.constants import CONFIG, SCRIPT_DIR
+from src.response_cache import prefix_hash
+
+CONFIG_PATH = os.path.join(SCRIPT_DIR, "config.yaml")
+CONFIG_DEBOUNCE_SECONDS = 0.5  # editors save in several writes, reload once they settle
+CONFIG_VERSIONS_KEPT = 4  # recent versions kept for requests that started before a swap
+CONFIG_WRITE_EVENTS = ("created", "modified", "moved", "closed")  # watchdog events that can change the file
+
+
+class ConfigError(Exception):
+    pass
+
+
+def validate_config(data):
+    """
+    Builds a Config from parsed YAML, rejecting unknown keys, wrong types and an empty persona.
+    Raises:
+        ConfigError: The config is invalid.
+    """
+    try:
+        config = dacite.from_dict(Config, data, config=dacite.Config(strict=True))
+    except (dacite.DaciteError, TypeError) as e:
+        raise ConfigError(str(e)) from e
+    if not config.name.strip() or not config.instructions.strip():
+        raise ConfigError("name and instructions must not be empty")
+    return config
+
+
+def read_config(path=CONFIG_PATH):
+    with open(path, "r", encoding="utf-8") as infile:
+        try:
+            return validate_config(yaml.safe_load(infile))
+        except yaml.YAMLError as e:
+            raise ConfigError(str(e)) from e
+
+
+def config_digest(config):
+    payload = json.dumps(asdict(config), sort_keys=True)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()[:16]
+
+
+@dataclass(frozen=True)
+class Persona:
+    name: str
+    instructions: str
+    examples: List[Conversation]
+    prefix: str  # hash of everything static in the prompt, the response cache key
+
+
+class ConfigVersion:
+    def __init__(self, number, config):
+        self.number = number
+        self.config = config
+        self.digest = config_digest(config)
+        self.loaded = time()
+        self.personas = {}  # bot name -> Persona
+
+    def persona(self, name=None):
+        """
+        The persona for prompts, with the config's own name replaced by the bot's Discord name.
+        Args:
+            name (str): The bot's Discord name, None to keep the config's name.
+        """
+        name = name or self.config.name
+        if name not in self.personas:
+            examples = []
+            for c in self.config.example_conversations:
+                examples.append(Conversation(messages=[
+                    Message(user=name, text=m.text) if m.user == self.config.name else m for m in c.messages
+                ]))
+            prefix = prefix_hash(name, self.config.instructions, *[c.render() for c in examples])
+            self.personas[name] = Persona(name, self.config.instructions, examples, prefix)
+        return self.personas[name]
+
+
+class ConfigService:
+    def __init__(self, path=CONFIG_PATH, config=CONFIG):
+        self.path = path
+        self.current = ConfigVersion(1, config)  # swapped as a whole, never mutated
+        self.versions = OrderedDict([(self.current.digest, self.current)])
+        self.listeners = []  # called with (old, new) after every swap
+        self.observer = None
+        self.reload_handle = None
+        self.loop = None
+        self.reloads = 0
+        self.failures = 0
+
+    def get(self, digest=None):
+        # the version a request started with, or the current one if that has been forgotten
+        if digest is not None and digest not in self.versions:
+            self.reload()  # another process may have swapped first, e.g. the gateway before a worker
+        return self.versions.get(digest, self.current)
+
+    def reload(self):
+        """
+        Reads config.yaml and swaps it in if it is valid and differs from the current version.
+        Returns:
+            bool: Whether a new version was swapped in.
+        """
+        try:
+            config = read_config(self.path)
+        except (OSError, ConfigError) as e:
+            self.failures += 1
+            print(f"Config reload failed, keeping version {self.current.number}: {e}")
+            return False
+        old = self.current
+        if config_digest(config) == old.digest:
+            return False
+        new = ConfigVersion(old.number + 1, config)
+        self.versions[new.digest] = new
+        while len(self.versions) > CONFIG_VERSIONS_KEPT:
+            self.versions.popitem(last=False)
+        self.current = new
+        self.reloads += 1
+        print(f"Config version {new.number} loaded ({new.config.name}, {len(new.config.example_conversations)} example conversations)")
+        for listener in self.listeners:
+            try:
+                listener(old, new)
+            except Exception as e:
+                print(f"Config listener failed: {e}")
+        return True
+
+    def schedule_reload(self):
+        if self.reload_handle is not None:
+            self.reload_handle.cancel()
+        self.reload_handle = self.loop.call_later(CONFIG_DEBOUNCE_SECONDS, self.reload)
+
+    def start(self, loop=None):
+        """
+        Starts watching config.yaml; watchdog calls back from its own thread, reloads run on the loop.
+        """
+        if self.observer is not None:
+            return self.observer
+        from watchdog.events import FileSystemEventHandler
+        from watchdog.observers import Observer
+
+        self.loop = loop or asyncio.get_running_loop()
+        service = self
+        filename = os.path.basename(self.path)
+
+        class Handler(FileSystemEventHandler):
+            def on_any_event(self, event):
+                if event.event_type not in CONFIG_WRITE_EVENTS:
+                    return  # our own reads show up as opened and closed_no_write events
+                paths = [getattr(event, "src_path", ""), getattr(event, "dest_path", "")]
+                if any(os.path.basename(i) == filename for i in paths if i):
+                    service.loop.call_soon_threadsafe(service.schedule_reload)
+
+        self.observer = Observer()
+        self.observer.schedule(Handler(), os.path.dirname(self.path))
+        self.observer.daemon = True
+        self.observer.start()
+        return self.observer
+
+    def stop(self):
+        if self.observer is not None:
+            self.observer.stop()
+            self.observer = None
+
+    def report(self):
+        return f"version {self.current.number} ({self.current.digest}), {self.reloads} reloads, {self.failures} failed"
+
+
+config_service = ConfigService()
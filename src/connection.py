@@ -0,0 +1,119 @@
+"""
+Supervision of the Discord gateway connection.
+py-cord already resumes or re-identifies after ordinary network drops, with its own backoff. This
+supervisor tracks the connection's state around that, pauses work that needs Discord while the gateway
+is down, and reopens the client when py-cord gives up instead of letting the process exit. What the bot
+keeps in memory (entity and response caches, memory indexes, queued replies) lives through an outage;
+only py-cord's own gateway caches are rebuilt, from the new session's READY.
+"""
+from time import time
+import asyncio
+import random
+import discord
+from src.metrics import metrics
+
+RECONNECT_BASE_SECONDS = 2.0  # first wait before reopening a client py-cord gave up on, doubled after every failure
+RECONNECT_MAX_SECONDS = 300.0
+RECONNECT_STABLE_SECONDS = 60.0  # a connection that lasted this long starts the backoff over
+FATAL_ERRORS = (discord.LoginFailure, discord.PrivilegedIntentsRequired)  # reconnecting cannot fix these
+
+
+class ConnectionSupervisor:
+    def __init__(self, base=RECONNECT_BASE_SECONDS, maximum=RECONNECT_MAX_SECONDS, stable=RECONNECT_STABLE_SECONDS):
+        self.base = base
+        self.maximum = maximum
+        self.stable = stable
+        self.state = "starting"  # "starting", "connected", "disconnected", "reconnecting" or "stopped"
+        self.disconnected_at = None
+        self.listeners = []  # called with False when the gateway drops and True when it is back
+        self.stopping = False
+        self.outages = 0
+        self.resumes = 0
+        self.sessions = 0
+        self.restarts = 0  # clients reopened after py-cord gave up
+        self.longest = 0.0
+
+    def notify(self, online):
+        for listener in self.listeners:
+            try:
+                listener(online)
+            except Exception as e:
+                print(f"Connection listener failed: {e}")
+
+    def disconnected(self):
+        # py-cord dispatches a disconnect for every failed attempt, only the first one starts an outage
+        if self.disconnected_at is not None or self.stopping:
+            return
+        self.state = "disconnected"
+        self.disconnected_at = time()
+        self.outages += 1
+        print(f"BOT DISCONNECTED AT {int(self.disconnected_at)}, pausing Discord calls until it is back")
+        self.notify(False)
+
+    def connected(self, resumed=False):
+        """
+        Records a new gateway session or a resumed one and resumes paused work.
+        Args:
+            resumed (bool): True when the old session was resumed, so no events were missed.
+        """
+        self.state = "connected"
+        if resumed:
+            self.resumes += 1
+        else:
+            self.sessions += 1
+        if self.disconnected_at is None:
+            return
+        outage = time() - self.disconnected_at
+        self.disconnected_at = None
+        self.longest = max(self.longest, outage)
+        metrics.record("gateway.outage", outage)
+        print(f"Reconnected after {outage:.1f}s ({'resumed' if resumed else 'new session'}), flushing paused Discord calls")
+        self.notify(True)
+
+    async def run(self, bot, token):
+        """
+        Logs in and keeps the gateway connected until stop() is called, reopening the client with
+        exponential backoff whenever py-cord's own reconnect loop gives up.
+        Raises:
+            discord.LoginFailure: The token was rejected.
+            discord.PrivilegedIntentsRequired: The bot is missing intents it asks for.
+        """
+        backoff = self.base
+        while not self.stopping:
+            started = time()
+            try:
+                if bot.is_closed():
+                    bot.clear()  # reopens the HTTP session; our own state is untouched
+                await bot.login(token)
+                await bot.connect(reconnect=True)
+            except FATAL_ERRORS:
+                raise
+            except Exception as e:
+                print(f"Discord connection gave up: {e!r}")
+            if self.stopping:
+                break
+            self.disconnected()
+            if time() - started >= self.stable:
+                backoff = self.base
+            delay = backoff * random.uniform(0.5, 1.0)  # jittered so a fleet does not reconnect in lockstep
+            backoff = min(backoff * 2, self.maximum)
+            self.state = "reconnecting"
+            print(f"Reopening the Discord connection in {delay:.1f}s...")
+            await asyncio.sleep(delay)
+            self.restarts += 1
+        self.state = "stopped"
+
+    async def stop(self, bot):
+        self.stopping = True
+        self.state = "stopped"
+        await bot.close()
+
+    def report(self):
+        state = self.state
+        if self.disconnected_at is not None:
+            state += f" for {time() - self.disconnected_at:.0f}s"
+        return (f"{state}, {self.sessions} sessions, {self.resumes} resumed, {self.outages} outages "
+                f"(longest {self.longest:.1f}s), {self.restarts} client restarts")
+
+
+connection = ConnectionSupervisor()
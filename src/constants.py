@@ -11,7 +11,7 @@ logger = logging.getLogger(__name__)
 
 load_dotenv()
 
-# load config.yaml
+# load config.yaml; this is the startup version, src.config_service swaps in later edits
 SCRIPT_DIR = os.path.dirname(os.path.realpath(__file__))
 CONFIG: Config = dacite.from_dict(Config, yaml.safe_load(open(os.path.join(SCRIPT_DIR, "config.yaml"), "r")))
 
@@ -20,13 +20,20 @@ BOT_INSTRUCTIONS = CONFIG.instructions
 EXAMPLE_CONVOS = CONFIG.example_conversations
 MY_GUILD = discord.Object(id=os.environ["GUILD_ID"])
 
-GOOGLE_AI_KEY = os.environ["GOOGLE_AI_KEY"]
 DISCORD_BOT_TOKEN = os.environ["DISCORD_BOT_TOKEN"]
 DISCORD_CLIENT_ID = os.environ["DISCORD_CLIENT_ID"]
-OPENAI_API_KEY = os.environ["OPENAI_API_KEY"]
 OWNER_ID = os.environ["OWNER_ID"]
-ELEVENLABS_API_KEY = os.environ["ELEVENLABS_API_KEY"]
-MISTRAL_API_KEY = os.environ["MISTRAL_API_KEY"]
+
+# provider keys are only needed for the providers in ENABLED_PROVIDERS, and are checked on first use
+GOOGLE_AI_KEY = os.environ.get("GOOGLE_AI_KEY")
+OPENAI_API_KEY = os.environ.get("OPENAI_API_KEY")
+ELEVENLABS_API_KEY = os.environ.get("ELEVENLABS_API_KEY")
+MISTRAL_API_KEY = os.environ.get("MISTRAL_API_KEY")
+ENABLED_PROVIDERS = [i.strip() for i in os.environ.get("ENABLED_PROVIDERS", "openai,google,mistral,elevenlabs").split(",") if i.strip()]
+
+# optional provider endpoint overrides, e.g. for local stand-ins; the OpenAI SDK reads OPENAI_BASE_URL itself
+GOOGLE_AI_ENDPOINT = os.environ.get("GOOGLE_AI_ENDPOINT")
+MISTRAL_ENDPOINT = os.environ.get("MISTRAL_ENDPOINT", "https://api.mistral.ai")
 
 # ALLOWED_CHANNEL_NAMES: List[str] = []
 # channel_names = os.environ["ALLOWED_CHANNEL_NAMES"].split(",")
@@ -45,9 +52,6 @@ MAX_CHARS_PER_REPLY_MSG = (
     1500  # discord has a 2k limit, we just break message into 1.5k
 )
 
-MY_BOT_NAME = BOT_NAME
-MY_BOT_EXAMPLE_CONVOS = EXAMPLE_CONVOS
-
 text_generation_config = {
     "temperature": 0.9,
     "top_p": 1,
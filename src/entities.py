@@ -0,0 +1,101 @@
+"""
+Cache-first resolution of Discord channels, guilds, users, members, voice states and messages.
+The gateway already keeps most of these in py-cord's caches, so REST is only used on a miss. Messages
+the gateway cache does not hold (older ones fetched over REST) are kept in a bounded LRU cache of
+our own, dropped again when Discord reports them edited or deleted. Hits and misses are counted
+per kind.
+"""
+from collections import OrderedDict
+import discord
+
+MESSAGE_CACHE_SIZE = 1000  # messages fetched over REST kept for reuse, least recently used are dropped first
+ENTITY_KINDS = ("channel", "guild", "user", "member", "voice", "message")
+
+
+class EntityResolver:
+    def __init__(self, message_cache_size=MESSAGE_CACHE_SIZE):
+        self.message_cache_size = message_cache_size
+        self.messages = OrderedDict()  # message id -> discord.Message
+        self.hits = {kind: 0 for kind in ENTITY_KINDS}
+        self.misses = {kind: 0 for kind in ENTITY_KINDS}
+
+    def count(self, kind, found):
+        if found is not None:
+            self.hits[kind] += 1
+        else:
+            self.misses[kind] += 1
+        return found
+
+    async def channel(self, bot, channel_id):
+        channel = self.count("channel", bot.get_channel(int(channel_id)))
+        return channel if channel is not None else await bot.fetch_channel(int(channel_id))
+
+    async def guild(self, bot, guild_id):
+        guild = self.count("guild", bot.get_guild(int(guild_id)))
+        return guild if guild is not None else await bot.fetch_guild(int(guild_id))
+
+    async def user(self, bot, user_id):
+        user = self.count("user", bot.get_user(int(user_id)))
+        return user if user is not None else await bot.fetch_user(int(user_id))
+
+    async def member(self, guild, user_id):
+        """
+        Returns:
+            discord.Member: The member, or None if the user is not in the guild.
+        """
+        member = self.count("member", guild.get_member(int(user_id)))
+        if member is not None:
+            return member
+        try:
+            return await guild.fetch_member(int(user_id))
+        except discord.NotFound:
+            return None
+
+    async def voice_state(self, guild, user_id):
+        """
+        Finds the voice channel a user is connected to. Voice states only ever come from the gateway,
+        so a REST fetch is only needed when the member itself is not cached.
+        Returns:
+            discord.VoiceState: The user's voice state, or None if they are not in a voice channel.
+        """
+        member = await self.member(guild, user_id)
+        voice = member.voice if member is not None else None
+        self.count("voice", voice)
+        return voice
+
+    async def message(self, bot, channel, message_id):
+        """
+        Looks a message up in the gateway cache, then in our own cache, then fetches it.
+        Raises:
+            discord.NotFound: The message was deleted.
+        """
+        message_id = int(message_id)
+        message = bot.get_message(message_id)
+        if message is None and message_id in self.messages:
+            self.messages.move_to_end(message_id)
+            message = self.messages[message_id]
+        if self.count("message", message) is not None:
+            return message
+        message = await channel.fetch_message(message_id)
+        self.remember(message)
+        return message
+
+    def remember(self, message):
+        self.messages[message.id] = message
+        self.messages.move_to_end(message.id)
+        while len(self.messages) > self.message_cache_size:
+            self.messages.popitem(last=False)
+
+    def forget(self, message_id):
+        self.messages.pop(int(message_id), None)
+
+    def report(self):
+        parts = []
+        for kind in ENTITY_KINDS:
+            lookups = self.hits[kind] + self.misses[kind]
+            if lookups:
+                parts.append(f"{kind}: {self.hits[kind] / lookups:.0%} of {lookups}")
+        return ", ".join(parts) or "no lookups yet"
+
+
+entities = EntityResolver()
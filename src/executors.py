@@ -0,0 +1,139 @@
+"""
+Shared executors for work that should not hold up the event loop.
+Pure-Python CPU work whose inputs pickle cheaply (JSON encoding and decoding, image re-encoding) goes
+to a process pool. Work that releases the GIL or needs this process's in-memory state (vector scoring
+over the memory indexes, blocking file and SDK calls) goes to a thread pool. Jobs smaller than their
+kind's threshold run inline, where the hand-off would cost more than the work. Queue depth, queue wait
+and run time are reported per pool.
+"""
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from functools import partial
+from time import perf_counter
+import asyncio
+import contextvars
+import json
+import multiprocessing
+import os
+import tempfile
+from src.metrics import metrics
+
+EXECUTOR_PROCESSES = int(os.environ.get("EXECUTOR_PROCESSES", str(min(4, os.cpu_count() or 1))))  # 0 sends process work to threads
+EXECUTOR_THREADS = int(os.environ.get("EXECUTOR_THREADS", "8"))
+OFFLOAD_KINDS = {  # kind -> (pool, smallest job worth handing off)
+    "scan": ("thread", 500),  # vector scoring over this process's memory indexes, in records
+    "io": ("thread", 0),  # blocking file, SDK and network calls
+    "json": ("process", 256 * 1024),  # JSON encoding and decoding, in bytes
+    "image": ("process", 512 * 1024),  # image decoding and re-encoding, in bytes
+}
+
+
+def measured(fn, *args, **kwargs):
+    # runs in the pool, so queue wait and run time can be told apart
+    start = perf_counter()
+    result = fn(*args, **kwargs)
+    return result, perf_counter() - start
+
+
+def write_json(path, snapshot, indent=None):
+    """
+    Atomically writes a JSON snapshot, pretty-printing it when indent is set.
+    The snapshot is encoded by the caller with json.dumps(), which uses the C encoder and sees the data
+    at one point in time; only the indented re-encode, which is pure Python, happens here.
+    Args:
+        path (str): The file to replace.
+        snapshot (str): The data, already encoded as compact JSON.
+        indent (int): Indentation for the written file, None to write the snapshot as-is.
+    """
+    folder = os.path.dirname(os.path.abspath(path))
+    handle, temp = tempfile.mkstemp(dir=folder, prefix=os.path.basename(path), suffix=".tmp")
+    try:
+        with os.fdopen(handle, "w", encoding="utf-8") as outfile:
+            if indent is None:
+                outfile.write(snapshot)
+            else:
+                json.dump(json.loads(snapshot), outfile, indent=indent)
+        os.replace(temp, path)
+    except BaseException:
+        os.remove(temp)
+        raise
+
+
+class Executors:
+    def __init__(self, processes=EXECUTOR_PROCESSES, threads=EXECUTOR_THREADS):
+        self.processes = processes
+        self.threads = threads
+        self.pools = {}  # "thread" or "process" -> executor, created on first use
+        self.queued = {"thread": 0, "process": 0}  # jobs handed off and not finished yet
+        self.inline = 0
+        metrics.gauge("executor.thread.depth", lambda: self.queued["thread"])
+        metrics.gauge("executor.process.depth", lambda: self.queued["process"])
+
+    def pool(self, name):
+        if name not in self.pools:
+            if name == "process":
+                # spawned rather than forked, since the gateway and SDKs have threads running by now; children
+                # only skip re-running the main module when it is a package's __main__, see src/__main__.py
+                self.pools[name] = ProcessPoolExecutor(self.processes, mp_context=multiprocessing.get_context("spawn"))
+            else:
+                self.pools[name] = ThreadPoolExecutor(self.threads, thread_name_prefix="executor")
+        return self.pools[name]
+
+    def route(self, kind, size=None):
+        name, threshold = OFFLOAD_KINDS[kind]
+        if size is not None and size < threshold:
+            return None
+        if name == "process" and not self.processes:
+            return "thread"
+        return name
+
+    async def run(self, kind, fn, *args, size=None, **kwargs):
+        """
+        Runs fn(*args, **kwargs) inline or in the pool for its kind, depending on the job's size.
+        Process pool jobs must be picklable and see none of this process's state; thread pool jobs
+        keep the caller's context variables, such as the usage tags of the message being served.
+        Args:
+            kind (str): One of OFFLOAD_KINDS, e.g. "scan" or "json".
+            fn: The function to run.
+            size (int): The job's size in the unit of its kind; None always hands it off.
+        Returns:
+            Whatever fn returns.
+        """
+        name = self.route(kind, size)
+        if name is None:
+            self.inline += 1
+            return fn(*args, **kwargs)
+        loop = asyncio.get_running_loop()
+        job = partial(measured, fn, *args, **kwargs)
+        if name == "thread":
+            job = partial(contextvars.copy_context().run, job)
+        self.queued[name] += 1
+        start = perf_counter()
+        try:
+            pool = self.pool(name)
+            try:
+                result, seconds = await loop.run_in_executor(pool, job)
+            except BrokenProcessPool:
+                # a pool process died, e.g. killed for memory; every job in flight on the pool lands here,
+                # so only the first replaces it, and all of them retry once on the replacement
+                if self.pools.get(name) is pool:
+                    print("Process pool broken, restarting it...")
+                    del self.pools[name]
+                    pool.shutdown(wait=False, cancel_futures=True)
+                result, seconds = await loop.run_in_executor(self.pool(name), job)
+        finally:
+            self.queued[name] -= 1
+        metrics.record(f"executor.{name}.run", seconds)
+        metrics.record(f"executor.{name}.wait", max(perf_counter() - start - seconds, 0.0))
+        return result
+
+    def shutdown(self):
+        for pool in self.pools.values():
+            pool.shutdown(wait=False, cancel_futures=True)
+        self.pools = {}
+
+    def report(self):
+        return ", ".join([f"{name}: {self.queued[name]} queued" for name in self.queued] + [f"{self.inline} run inline"])
+
+
+executors = Executors()
@@ -0,0 +1,200 @@
+"""
+Memory footprint diagnostics.
+Long-lived caches register themselves here with an optional soft limit on their entry count. The
+registry reports each one's approximate size, trims the ones over their limit on a timer (harder
+when process RSS passes its own soft limit), and takes tracemalloc snapshots on demand so the
+top growth sites between two snapshots can be compared.
+"""
+from time import time
+import asyncio
+import linecache
+import os
+import sys
+import tracemalloc
+
+FOOTPRINT_CHECK_SECONDS = 300
+FOOTPRINT_SAMPLE_ITEMS = 200  # containers bigger than this are sized from a sample and extrapolated
+FOOTPRINT_TRACE_FRAMES = 10
+FOOTPRINT_RSS_LIMIT_MB = int(os.environ.get("FOOTPRINT_RSS_LIMIT_MB", "0"))  # 0 disables the RSS soft limit
+FOOTPRINT_PRESSURE_RATIO = 0.5  # over the RSS limit, structures are trimmed to this share of their limit
+
+
+def parse_limits(text):
+    # "message_history=200,notes_history=50" -> {"message_history": 200, "notes_history": 50}
+    limits = {}
+    for item in filter(None, (i.strip() for i in text.split(","))):
+        name, _, value = item.partition("=")
+        limits[name.strip()] = int(value) if value.strip() else None
+    return limits
+
+
+FOOTPRINT_LIMITS = parse_limits(os.environ.get("FOOTPRINT_LIMITS", ""))  # overrides the limits passed to register()
+
+
+def deep_size(obj, seen=None):
+    """
+    Approximates the bytes reachable from an object, counting shared objects once.
+    Large containers are sized from an evenly spaced sample of their items.
+    """
+    if seen is None:
+        seen = set()
+    if id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+    nbytes = getattr(obj, "nbytes", None)
+    if isinstance(nbytes, int):  # numpy arrays
+        return sys.getsizeof(obj) if getattr(obj, "base", None) is not None else max(sys.getsizeof(obj), nbytes)
+    size = sys.getsizeof(obj)
+    if isinstance(obj, (str, bytes, bytearray, int, float, bool, type(None))):
+        return size
+    if isinstance(obj, dict):
+        items = list(obj.items())
+    elif isinstance(obj, (list, tuple, set, frozenset)):
+        items = list(obj)
+    elif hasattr(obj, "__dict__"):
+        return size + deep_size(vars(obj), seen)
+    else:
+        return size
+    if not items:
+        return size
+    step = max(len(items) // FOOTPRINT_SAMPLE_ITEMS, 1)
+    sample = items[::step]
+    sampled = sum(deep_size(item, seen) for item in sample)
+    return size + int(sampled * len(items) / len(sample))
+
+
+def process_rss():
+    # current resident set size in bytes, or None where /proc is not available
+    try:
+        with open("/proc/self/statm") as statm:
+            return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def trim_oldest(obj, limit):
+    """
+    Drops the oldest entries of a dict (insertion order) or list until it holds `limit` items.
+    Returns:
+        int: How many entries were dropped.
+    """
+    excess = len(obj) - limit
+    if excess <= 0:
+        return 0
+    if isinstance(obj, dict):
+        for key in list(obj)[:excess]:
+            del obj[key]
+    else:
+        del obj[:excess]
+    return excess
+
+
+class Footprint:
+    def __init__(self):
+        self.structures = {}  # name -> (getter, limit, evict)
+        self.evicted = {}  # name -> entries dropped since start
+        self.snapshot = None
+        self.snapshot_time = None
+        self.task = None
+
+    def register(self, name, getter, limit=None, evict=trim_oldest):
+        """
+        Registers a long-lived structure.
+        Args:
+            name (str): The label shown in reports and used in FOOTPRINT_LIMITS.
+            getter: Returns the structure; called on every check since some globals are rebound.
+            limit (int): Soft limit on its entry count, or None to only report it.
+            evict: Called as evict(structure, limit) to trim it, returning how many entries it dropped.
+        """
+        self.structures[name] = (getter, FOOTPRINT_LIMITS.get(name, limit), evict)
+        self.evicted.setdefault(name, 0)
+
+    def sizes(self):
+        rows = []
+        for name, (getter, limit, evict) in self.structures.items():
+            obj = getter()
+            entries = len(obj) if hasattr(obj, "__len__") else None
+            rows.append({"name": name, "entries": entries, "bytes": deep_size(obj), "limit": limit, "evicted": self.evicted[name]})
+        return sorted(rows, key=lambda row: row["bytes"], reverse=True)
+
+    def enforce(self, pressure=None):
+        """
+        Trims every structure that is over its soft limit.
+        Args:
+            pressure (bool): Trim to FOOTPRINT_PRESSURE_RATIO of each limit; by default this is
+                decided by comparing process RSS with FOOTPRINT_RSS_LIMIT_MB.
+        Returns:
+            dict: name -> entries dropped, for the structures that were trimmed.
+        """
+        if pressure is None:
+            rss = process_rss()
+            pressure = bool(FOOTPRINT_RSS_LIMIT_MB) and rss is not None and rss > FOOTPRINT_RSS_LIMIT_MB * 1024 * 1024
+        dropped = {}
+        for name, (getter, limit, evict) in self.structures.items():
+            if limit is None or evict is None:
+                continue
+            target = int(limit * FOOTPRINT_PRESSURE_RATIO) if pressure else limit
+            count = evict(getter(), target)
+            if count:
+                self.evicted[name] += count
+                dropped[name] = count
+        if dropped:
+            print(f"Footprint trimmed {dropped}{' under memory pressure' if pressure else ''}")
+        return dropped
+
+    async def enforce_loop(self):
+        while True:
+            await asyncio.sleep(FOOTPRINT_CHECK_SECONDS)
+            try:
+                self.enforce()
+            except Exception as e:
+                print(f"Error enforcing memory limits: {e}")
+
+    def start(self, loop=None):
+        if self.task is None or self.task.done():
+            loop = loop or asyncio.get_running_loop()
+            self.task = loop.create_task(self.enforce_loop())
+        return self.task
+
+    def take_snapshot(self, top=10):
+        """
+        Takes a tracemalloc snapshot, starting tracing first if needed, and compares it with the previous one.
+        Returns:
+            list: (location, size change in bytes, count change) for the top growth sites, or [] for the first snapshot.
+        """
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(FOOTPRINT_TRACE_FRAMES)
+        snapshot = tracemalloc.take_snapshot().filter_traces((
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, linecache.__file__),
+        ))
+        growth = []
+        if self.snapshot is not None:
+            for stat in snapshot.compare_to(self.snapshot, "lineno")[:top]:
+                frame = stat.traceback[0]
+                growth.append((f"{os.path.relpath(frame.filename)}:{frame.lineno}", stat.size_diff, stat.count_diff))
+        self.snapshot = snapshot
+        self.snapshot_time = time()
+        return growth
+
+    def stop_tracing(self):
+        self.snapshot = None
+        self.snapshot_time = None
+        if tracemalloc.is_tracing():
+            tracemalloc.stop()
+
+    def report(self):
+        rss = process_rss()
+        lines = [f"rss: {rss / 1048576:.1f}MB" if rss is not None else "rss: unknown"]
+        if tracemalloc.is_tracing():
+            current, peak = tracemalloc.get_traced_memory()
+            lines[0] += f", traced: {current / 1048576:.1f}MB (peak {peak / 1048576:.1f}MB)"
+        lines.append(f"{'structure':<22} {'entries':>8} {'size':>10} {'limit':>7} {'evicted':>8}")
+        for row in self.sizes():
+            entries = "-" if row["entries"] is None else row["entries"]
+            limit = "-" if row["limit"] is None else row["limit"]
+            lines.append(f"{row['name']:<22} {entries:>8} {row['bytes'] / 1024:>8.0f}KB {limit:>7} {row['evicted']:>8}")
+        return "\n".join(lines)
+
+
+footprint = Footprint()
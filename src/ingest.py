@@ -0,0 +1,138 @@
+"""
+Write-behind ingestion of the bot's own replies into long-term memory.
+Replies are enqueued once they have been sent, then embedded in batches when the queue goes quiet
+and appended to the chat logs like user messages, so memory covers both sides of each conversation.
+User messages that could not be embedded on the reply path are queued the same way. A batch the
+embedder keeps failing on stays queued and is retried later.
+"""
+import asyncio
+from time import time
+from uuid import uuid5, NAMESPACE_URL
+from src.memory import (
+    gpt3_batch_embedding,
+    indexed,
+    save_chat_log,
+    timestamp_to_datetime,
+)
+from src.segments import stored_uuids
+from src.singleflight import provider_calls, call_key
+
+INGEST_QUEUE_SIZE = 256  # replies waiting to be embedded, the oldest are dropped beyond this
+INGEST_BATCH_SIZE = 16  # replies embedded per API call
+INGEST_IDLE_SECONDS = 2.0  # wait for the queue to go quiet this long before embedding a partial batch
+INGEST_MAX_RETRIES = 3
+INGEST_RETRY_SECONDS = 60  # wait after a batch failed every retry before trying it again
+
+
+class IngestQueue:
+    """
+    A bounded queue of replies waiting to be embedded and saved to the chat logs.
+    Each reply is keyed so enqueueing the same reply twice only stores it once, even across restarts.
+    """
+
+    def __init__(self, maxsize=INGEST_QUEUE_SIZE, batch_size=INGEST_BATCH_SIZE, idle_seconds=INGEST_IDLE_SECONDS,
+                 max_retries=INGEST_MAX_RETRIES, retry_seconds=INGEST_RETRY_SECONDS):
+        self.maxsize = maxsize
+        self.batch_size = batch_size
+        self.idle_seconds = idle_seconds
+        self.max_retries = max_retries
+        self.retry_seconds = retry_seconds
+        self.pending = {}  # uuid -> (record, text, source) waiting to be embedded, in enqueue order
+        self.wakeup = asyncio.Event()
+        self.task = None
+        self.ingested = 0
+        self.dropped = 0
+        self.failed = 0
+
+    def enqueue(self, key, speaker, text, source="bot", **metadata):
+        """
+        Queues a reply for ingestion without waiting on the embedding call.
+        Args:
+            key: A stable identifier for the reply, e.g. the id of the message it answers.
+            speaker (str): The name stored as the speaker of the memory.
+            text (str): The reply text.
+            source (str): "bot" for the bot's replies or "user" for user messages; ends the chat log's filename.
+            **metadata: Extra fields stored on the chat log record.
+        Returns:
+            bool: True if the reply was queued, False if it was empty or already ingested.
+        """
+        if not text or text.isspace():
+            return False
+        identifier = str(uuid5(NAMESPACE_URL, str(key)))
+        if identifier in self.pending or indexed(identifier):
+            return False
+        if len(self.pending) >= self.maxsize:
+            del self.pending[next(iter(self.pending))]
+            self.dropped += 1
+            print("Ingest queue full! Dropped oldest reply.")
+        timestamp = time()
+        timestring = timestamp_to_datetime(timestamp)
+        record = {
+            **metadata,
+            "speaker": speaker,
+            "timestamp": timestamp,
+            "uuid": identifier,
+            "message": "%s: %s - %s" % (speaker, timestring, text),
+            "timestring": timestring,
+        }
+        self.pending[identifier] = (record, text, source)
+        self.wakeup.set()
+        return True
+
+    def start(self, loop=None):
+        if self.task is None or self.task.done():
+            loop = loop or asyncio.get_running_loop()
+            self.task = loop.create_task(self.run())
+        return self.task
+
+    async def run(self):
+        while True:
+            await self.wakeup.wait()
+            # let bursts settle so embedding happens while the bot is idle
+            while len(self.pending) < self.batch_size:
+                self.wakeup.clear()
+                try:
+                    await asyncio.wait_for(self.wakeup.wait(), timeout=self.idle_seconds)
+                except asyncio.TimeoutError:
+                    break
+            if not await self.flush():
+                await asyncio.sleep(self.retry_seconds)  # the embedder is down, the failed batch is still queued
+                self.wakeup.set()
+            elif not self.pending:
+                self.wakeup.clear()
+
+    async def flush(self):
+        """
+        Embeds and saves everything currently queued, one batch at a time.
+        Returns:
+            bool: False if a batch failed every retry; it and the batches after it stay queued.
+        """
+        while self.pending:
+            batch = list(self.pending.values())[:self.batch_size]
+            vectors = await self.embed(batch)
+            if vectors is None:
+                self.failed += len(batch)
+                return False
+            for record, text, source in batch:
+                self.pending.pop(record["uuid"], None)
+            cold = await asyncio.to_thread(stored_uuids, [record["uuid"] for record, text, source in batch])
+            for (record, text, source), vector in zip(batch, vectors):
+                if record["uuid"] in cold or indexed(record["uuid"]):
+                    continue  # already stored, e.g. queued while the memory index was still warming
+                record["vector"] = vector
+                save_chat_log("log_%s_%s" % (record["timestamp"], source), record)
+            self.ingested += len(batch)
+        return True
+
+    async def embed(self, batch):
+        for attempt in range(self.max_retries):
+            try:
+                texts = [text for record, text, source in batch]
+                return await provider_calls.do(call_key('text-embedding-ada-002', texts), asyncio.to_thread, gpt3_batch_embedding, texts)
+            except Exception as oops:
+                print(f"Error embedding replies (attempt {attempt + 1}/{self.max_retries}):", oops)
+                await asyncio.sleep(2 ** attempt)
+        return None
+
+
+ingest_queue = IngestQueue()
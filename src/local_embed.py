@@ -0,0 +1,110 @@
+"""
+A small CPU-only embedder that needs no network: hashed word and character n-gram TF-IDF,
+squashed to a few hundred dimensions with a fixed random projection.
+It keeps a lexical index of the hot chat logs next to the API vectors, used to prefilter large
+scans and to keep retrieval working when the remote embedder is slow or down.
+"""
+from numpy.linalg import norm
+import numpy as np
+import re
+import zlib
+
+LOCAL_BUCKETS = 2 ** 14  # hashed feature space
+LOCAL_DIMS = 256  # projected vector size
+LOCAL_SEED = 1536
+
+
+class LocalEmbedder:
+    def __init__(self, buckets=LOCAL_BUCKETS, dims=LOCAL_DIMS, seed=LOCAL_SEED):
+        rng = np.random.default_rng(seed)
+        self.buckets = buckets
+        self.projection = rng.choice(np.array([-1, 1], dtype=np.int8), size=(buckets, dims))
+        self.df = np.zeros(buckets, dtype=np.float32)  # document frequency per hashed feature
+        self.docs = 0
+
+    def features(self, text):
+        words = re.findall(r'\w+', text.lower())
+        grams = list(words)
+        for word in words:
+            padded = '<%s>' % word
+            grams += [padded[i:i + 3] for i in range(len(padded) - 2)]
+        if not grams:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)
+        hashes = [zlib.crc32(i.encode('utf-8')) % self.buckets for i in grams]
+        idx, counts = np.unique(hashes, return_counts=True)
+        return idx, counts.astype(np.float32)
+
+    def fit(self, text):
+        idx, _ = self.features(text)
+        self.df[idx] += 1
+        self.docs += 1
+
+    def embed(self, text):
+        idx, counts = self.features(text)
+        vector = np.zeros(self.projection.shape[1], dtype=np.float32)
+        if len(idx):
+            idf = np.log((1 + self.docs) / (1 + self.df[idx])) + 1
+            weights = (1 + np.log(counts)) * idf
+            vector = weights @ self.projection[idx].astype(np.float32)
+        return vector / max(norm(vector), 1e-12)
+
+
+class LocalIndex:
+    """
+    An in-RAM matrix of local vectors keyed by chat log uuid.
+    Removed rows are blanked and reclaimed once they make up half the matrix.
+    """
+
+    def __init__(self, embedder=None):
+        self.embedder = embedder or LocalEmbedder()
+        self.vectors = np.zeros((0, self.embedder.projection.shape[1]), dtype=np.float32)
+        self.uuids = list()
+        self.rows = {}  # uuid -> row in self.vectors
+        self.size = 0
+
+    def __len__(self):
+        return len(self.rows)
+
+    def add(self, uuid, text):
+        if uuid in self.rows:
+            return
+        self.embedder.fit(text)
+        if self.size == len(self.vectors):
+            grown = np.zeros((max(64, len(self.vectors) * 2), self.vectors.shape[1]), dtype=np.float32)
+            grown[:self.size] = self.vectors[:self.size]
+            self.vectors = grown
+        self.vectors[self.size] = self.embedder.embed(text)
+        self.uuids.append(uuid)
+        self.rows[uuid] = self.size
+        self.size += 1
+
+    def remove(self, uuids):
+        for uuid in uuids:
+            row = self.rows.pop(uuid, None)
+            if row is not None:
+                self.vectors[row] = 0
+                self.uuids[row] = None
+        if self.size and len(self.rows) * 2 < self.size:
+            keep = [row for row, uuid in enumerate(self.uuids) if uuid is not None]
+            self.vectors = self.vectors[keep].copy()
+            self.uuids = [self.uuids[row] for row in keep]
+            self.rows = {uuid: row for row, uuid in enumerate(self.uuids)}
+            self.size = len(keep)
+
+    def search(self, text, count, uuids=None):
+        # returns [(uuid, score)] for the rows lexically closest to the text, optionally only among the given uuids
+        if uuids is None:
+            rows = np.arange(self.size)
+        else:
+            rows = np.array([self.rows[i] for i in uuids if i in self.rows], dtype=np.int64)
+        if not len(rows):
+            return list()
+        scores = self.vectors[rows] @ self.embedder.embed(text)
+        order = np.argsort(-scores)[:count]
+        return [(self.uuids[rows[i]], float(scores[i])) for i in order if self.uuids[rows[i]] is not None]
+
+
+def record_text(record):
+    # chat log messages look like "speaker: timestring - content"; the timestring is only noise here
+    speaker = record['speaker']
+    return '%s %s' % (speaker, record['message'].split(' - ', 1)[-1])
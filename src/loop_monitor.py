@@ -0,0 +1,123 @@
+"""
+Event-loop stall detection.
+A heartbeat task on the loop ticks every few milliseconds while a watchdog thread watches it. When
+the heartbeat falls behind by more than the threshold, the watchdog samples the loop thread's stack
+until the loop recovers, then logs how long the stall lasted and the frame it was stuck in.
+"""
+from collections import Counter
+from time import perf_counter, sleep
+import asyncio
+import logging
+import os
+import sys
+import threading
+import traceback
+from src.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+STALL_THRESHOLD_SECONDS = 0.25
+HEARTBEAT_SECONDS = 0.05
+STACK_SAMPLE_SECONDS = 0.05
+PROJECT_DIR = os.path.dirname(os.path.realpath(__file__))
+
+
+class LoopMonitor:
+    def __init__(self, loop, threshold=STALL_THRESHOLD_SECONDS, heartbeat=HEARTBEAT_SECONDS):
+        self.loop = loop
+        self.threshold = threshold
+        self.heartbeat = heartbeat
+        self.last_beat = perf_counter()
+        self.loop_thread = None
+        self.thread = None
+        self.running = False
+        self.stalls = 0
+        self.stalled_seconds = 0.0
+        self.longest = 0.0
+        self.sites = Counter()  # "file:line in function" -> stack samples taken there while stalled
+        self.site_seconds = Counter()  # "file:line in function" -> stall seconds attributed to it
+
+    async def beat(self):
+        self.loop_thread = threading.get_ident()
+        while self.running:
+            self.last_beat = perf_counter()
+            await asyncio.sleep(self.heartbeat)
+
+    def start(self):
+        if self.running:
+            return
+        self.running = True
+        self.loop.create_task(self.beat())
+        self.thread = threading.Thread(target=self.watch, name="loop-monitor", daemon=True)
+        self.thread.start()
+        print("Event Loop Monitor Started!")
+
+    def stop(self):
+        self.running = False
+
+    def sample(self):
+        frame = sys._current_frames().get(self.loop_thread)
+        if frame is None:
+            return None, None
+        stack = traceback.extract_stack(frame)
+        # blame the innermost frame in the bot's own code, falling back to the innermost frame overall
+        ours = [i for i in stack if i.filename.startswith(PROJECT_DIR)]
+        culprit = (ours or stack)[-1]
+        site = f"{os.path.relpath(culprit.filename)}:{culprit.lineno} in {culprit.name}"
+        return site, "".join(traceback.format_list(stack[-8:]))
+
+    def watch(self):
+        while self.running:
+            sleep(self.heartbeat)
+            behind = perf_counter() - self.last_beat - self.heartbeat
+            if behind < self.threshold or self.loop_thread is None:
+                continue
+            beat = self.last_beat
+            samples = Counter()
+            first_stack = None
+            while self.running and self.last_beat == beat:
+                site, stack = self.sample()
+                if site is not None:
+                    samples[site] += 1
+                    first_stack = first_stack or stack
+                sleep(STACK_SAMPLE_SECONDS)
+            self.record(perf_counter() - beat - self.heartbeat, samples, first_stack)
+
+    def record(self, duration, samples, stack):
+        self.stalls += 1
+        self.stalled_seconds += duration
+        self.longest = max(self.longest, duration)
+        metrics.record("loop.stall", duration)
+        site = samples.most_common(1)[0][0] if samples else "unknown"
+        self.sites.update(samples)
+        self.site_seconds[site] += duration
+        logger.warning(f"Event loop stalled for {duration * 1000:.0f}ms in {site}\n{stack or ''}")
+
+    def stats(self, top=5):
+        return {
+            "stalls": self.stalls,
+            "stalled_seconds": self.stalled_seconds,
+            "longest_seconds": self.longest,
+            "top_sites": self.site_seconds.most_common(top),
+        }
+
+    def report(self, top=5):
+        stats = self.stats(top)
+        lines = [
+            f"stalls: {stats['stalls']}, total: {stats['stalled_seconds'] * 1000:.0f}ms, "
+            f"longest: {stats['longest_seconds'] * 1000:.0f}ms"
+        ]
+        for site, seconds in stats["top_sites"]:
+            lines.append(f"{seconds * 1000:>8.0f}ms  {site}")
+        return "\n".join(lines)
+
+
+loop_monitor = None
+
+
+def start_loop_monitor(loop):
+    global loop_monitor
+    if loop_monitor is None:
+        loop_monitor = LoopMonitor(loop)
+    loop_monitor.start()
+    return loop_monitor
@@ -8,11 +8,11 @@ import logging
 import os
 import json
 import re
+import signal
 import traceback
-from typing import Dict
+from typing import Any, Dict
 import aiohttp
 import discord
-import elevenlabs
 from discord import (
     Interaction,
     Message as DiscordMessage,
@@ -22,50 +22,39 @@ from discord import (
     NotFound,
     Option,
 )
-from discord.utils import get as discord_get
 import asyncio
-from uuid import uuid4
-from time import time
-from openai import OpenAI
-import google.generativeai as genai
-from mistralai.client import MistralClient
-from mistralai.models.chat_completion import ChatMessage
-from PIL import Image
-from src.base import Message, Conversation, Prompt
+from time import time, perf_counter
 from src.constants import (
-    BOT_INSTRUCTIONS,
-    BOT_NAME,
     DISCORD_BOT_TOKEN,
-    EXAMPLE_CONVOS,
-    MAX_MESSAGE_HISTORY,
-    OPENAI_API_KEY,
     OWNER_ID,
-    ELEVENLABS_API_KEY,
-    MY_BOT_EXAMPLE_CONVOS,
-    MY_BOT_NAME,
     BOT_INVITE_URL,
-    GOOGLE_AI_KEY,
-    MISTRAL_API_KEY,
-    text_generation_config,
-    image_generation_config,
-    safety_settings,
     bot_template,
     logger,
 )
-from src.utils import (
-    discord_message_to_message,
-)
+from src.utils import shrink_image
 from src import completion
 from src.memory import (
-    gpt3_embedding,
-    save_json,
-    load_convo,
-    add_notes,
-    notes_history,
-    fetch_memories,
-    summarize_memories,
-    timestamp_to_datetime,
+    schedule_summary,
+    start_compaction,
+    start_preload,
+    memory_report,
 )
+from src.ingest import ingest_queue
+from src.response_cache import response_cache
+from src.singleflight import provider_calls, call_key
+from src.metrics import metrics, span, current_guild, start_metrics_server
+from src.loop_monitor import start_loop_monitor
+from src.usage import usage_ledger, track_usage, tag_usage, budget_key, DEFAULT_REQUESTS_PER_MINUTE, DEFAULT_TOKENS_PER_DAY
+from src.footprint import footprint as memory_footprint
+from src.recorder import traffic_recorder
+from src.providers import providers
+from src.bootstrap import bootstrap_guilds, sync_commands
+from src.workers import WorkerPool, WORKER_PROCESSES
+from src.executors import executors, write_json
+from src.outbound import outbound, FINAL, PROGRESS
+from src.entities import entities
+from src.connection import connection
+from src.config_service import config_service
 
 logging.basicConfig(
     format="[%(asctime)s] [%(filename)s:%(lineno)d] %(message)s", level=logging.INFO
@@ -91,32 +80,44 @@ intents = discord.Intents.all()
 intents.message_content = True
 bot = discord.Bot(auto_sync_commands=True, intents=intents)
 print(f"LLM: {llm_provider}")
-mistral = MistralClient(api_key=MISTRAL_API_KEY)
-print(f'Mistral API Key: "{MISTRAL_API_KEY}"')
-genai.configure(api_key=GOOGLE_AI_KEY)
-print(f'Google AI API Key: "{GOOGLE_AI_KEY}"')
-openai = OpenAI(api_key=OPENAI_API_KEY)
-print(f'OpenAI API Key: "{openai.api_key}"')
-elevenlabs.set_api_key(ELEVENLABS_API_KEY)
-print(f'ElevenLabs API Key: "{elevenlabs.get_api_key()}"')
+print(f"Providers: {providers.report()}")
 images_folder = "images"
 edit_mask = f"{images_folder}/mask.png"
 print(f'Edit Mask Path: "{edit_mask}"')
-disconnect_time = None
+metrics_runner = None
+loop_monitor = None
+bootstrap_task = None
+autosave_task = None
+worker_pool = None  # set when WORKER_PROCESSES runs responses in worker processes
+database_lock = asyncio.Lock()  # serializes save_database_async()
 current_messages = {}
 streamMode = False
 print(f'Stream Mode: "{streamMode}"')
 botActivityName = "Waiting For Messages..."
 botActivity = ActivityType.playing
 MAX_HISTORY = 15
-systemPromptStr = f"INSTRUCTIONS: {BOT_INSTRUCTIONS}\n Previous Messages: \n"
-message_history: Dict[int, genai.ChatSession] = {}
+message_history: Dict[int, Any] = {}  # channel id -> Gemini chat session
+history_locks: Dict[int, list] = {}  # channel id -> [asyncio.Lock, users], so one chat session never sends twice at once
+MESSAGE_HISTORY_LIMIT = 200  # Gemini chat sessions kept, least recently used are dropped first
+CURRENT_MESSAGES_LIMIT = 1000
+
+memory_footprint.register("message_history", lambda: message_history, MESSAGE_HISTORY_LIMIT)
+memory_footprint.register("current_messages", lambda: current_messages, CURRENT_MESSAGES_LIMIT)
+memory_footprint.register("database", lambda: database)
+memory_footprint.register("response_cache", lambda: response_cache.entries)
+memory_footprint.register("ingest_pending", lambda: ingest_queue.pending)
+memory_footprint.register("latency_histograms", lambda: metrics.histograms)
+memory_footprint.register("usage_totals", lambda: usage_ledger.totals)
+memory_footprint.register("entity_messages", lambda: entities.messages)
+
 
+def drop_stale_responses(old, new):
+    # replies cached under the old persona's prompt prefixes can never be looked up again
+    response_cache.discard_prefixes({i.prefix for i in old.personas.values()})
 
-text_model = genai.GenerativeModel(
-    model_name="gemini-pro", generation_config=text_generation_config, safety_settings=safety_settings)
-image_model = genai.GenerativeModel(model_name="gemini-pro-vision",
-                                    generation_config=image_generation_config, safety_settings=safety_settings)
+
+config_service.listeners.append(drop_stale_responses)
+connection.listeners.append(outbound.set_online)
 
 
 # ---------------------------------------------Database-------------------------------------------------
@@ -126,8 +127,7 @@ async def save_database_loop():
     Continuously saves the database to a JSON file every 2 minutes.
     """
     while True:
-        with open("database.json", "w") as f:
-            json.dump(database, f, indent=4)
+        await save_database_async(quiet=True)
         await asyncio.sleep(120)
 
 
@@ -136,18 +136,50 @@ def save_database():
     Save the database to a JSON file.
     This function saves the contents of the `database` variable to a JSON file named 'database.json'.
     The file is written with an indentation of 4 spaces.
+    Blocks until written; handlers running on the event loop use save_database_async() instead.
     """
-    with open("database.json", "w") as f:
-        json.dump(database, f, indent=4)
+    write_json("database.json", json.dumps(database), 4)
     print("Database saved!")
 
 
+async def save_database_async(quiet=False):
+    """
+    Save the database to a JSON file without blocking the event loop.
+    The snapshot is taken on the loop, and large databases are pretty-printed and written in the process pool.
+    Saves are serialized, so an older snapshot never overwrites a newer one.
+    """
+    async with database_lock:
+        snapshot = json.dumps(database)
+        await executors.run("json", write_json, "database.json", snapshot, 4, size=len(snapshot))
+    if not quiet:
+        print("Database saved!")
+
+
+async def send_to_history(channel_id, session, formatted_text):
+    # a ChatSession appends to its history on every send, so sends to one channel's session run one at a time
+    entry = history_locks.setdefault(channel_id, [asyncio.Lock(), 0])
+    entry[1] += 1
+    try:
+        async with entry[0]:
+            # recorded here rather than by each caller, so a send shared by identical requests is billed once
+            with track_usage("google", "gemini-pro", "completion") as usage:
+                response = await asyncio.to_thread(session.send_message, formatted_text)
+                usage["characters"] = len(formatted_text) + len(response.text)
+            return response
+    finally:
+        entry[1] -= 1
+        if not entry[1]:
+            del history_locks[channel_id]
+
+
 async def generate_response_with_text(channel_id, message_text):
     try:
         formatted_text = format_discord_message(message_text)
         if not (channel_id in message_history):
-            message_history[channel_id] = text_model.start_chat(history=bot_template)
-        response = message_history[channel_id].send_message(formatted_text)
+            message_history[channel_id] = providers.get("gemini_text").start_chat(history=bot_template)
+        message_history[channel_id] = message_history.pop(channel_id)  # mark as most recently used
+        key = call_key("gemini-pro", channel_id, formatted_text)
+        response = await provider_calls.do(key, send_to_history, channel_id, message_history[channel_id], formatted_text)
         return response.text
     except Exception as e:
         with open('errors.log', 'a+') as errorlog:
@@ -166,14 +198,30 @@ async def generate_response_with_text(channel_id, message_text):
 
 
 async def generate_response_with_image_and_text(image_data, text):
+    image_data = await executors.run("image", shrink_image, image_data, size=len(image_data))
     image_parts = [{"mime_type": "image/jpeg", "data": image_data}]
     prompt_parts = [image_parts[0], f"\n{text if text else 'What is this a picture of?'}"]
-    response = image_model.generate_content(prompt_parts)
+    with track_usage("google", "gemini-pro-vision", "vision") as usage:
+        response = await executors.run("io", providers.get("gemini_image").generate_content, prompt_parts)
+        usage["characters"] = len(prompt_parts[1])
     if (response._error):
         return "❌" + str(response._error)
     return response.text
 
 
+def generate_voice(text, path):
+    """
+    Generates speech for the text and writes it to path; blocking, so handlers run it in the thread pool.
+    """
+    audio = providers.get("elevenlabs").generate(
+        text=text,
+        voice="Roetpv5aIoWbL37AfGp3",
+        model="eleven_multilingual_v2",
+    )
+    with open(path, "wb") as f:
+        f.write(audio)
+
+
 async def split_and_send_messages(message: discord.Message, text, max_length):
     # Split the string into parts
     messages = []
@@ -189,9 +237,22 @@ async def split_and_send_messages(message: discord.Message, text, max_length):
     for i, string in enumerate(messages):
         if i == 0:
             # For the first message, send it and store the result in message_system
-            await message_system.edit(content=string)
+            await timed_edit(message_system, string)
         else:
-            message_system = await channel.send(string)
+            message_system = await outbound.send(channel, string, FINAL)
+
+
+async def timed_edit(message: discord.Message, content: str, priority: int = FINAL):
+    """
+    Edits a message's content through the outbound scheduler, which records how long Discord took.
+    Args:
+        message (discord.Message): The message to edit.
+        content (str): The new content.
+        priority (int): The edit's outbound priority, FINAL for reply content.
+    Returns:
+        discord.Message: The edited message, or None if a newer edit superseded it.
+    """
+    return await outbound.edit(message, content, priority)
 
 
 def format_discord_message(input_string):
@@ -200,20 +261,6 @@ def format_discord_message(input_string):
     return cleaned_content
 
 
-async def check_disconnect_time():
-    """
-    Checks the time since the bot was last disconnected.
-    If the bot has been disconnected for more than 2 minutes, it stops.
-    """
-    global disconnect_time
-    while True:
-        if (disconnect_time is not None and asyncio.get_event_loop().time() - disconnect_time > 60 * 1):  # 2 minutes
-            print("Bot was disconnected for too long, stopping...")
-            await bot.close()
-            break
-        await asyncio.sleep(60)
-
-
 def clean_discord_message(input_string):
     """
     Cleans a Discord message by removing any text between < and > brackets.
@@ -232,12 +279,41 @@ def clean_discord_message(input_string):
 @bot.event
 async def on_disconnect():
     """
-    Saves the database, records the disconnect time, and logs the event.
+    Tells the connection supervisor, which pauses Discord calls until the gateway is back, and saves state.
+    py-cord dispatches this for every failed reconnect attempt, so nothing here may block the loop.
+    """
+    connection.disconnected()
+    await save_state_async()
+
+
+def save_state():
+    """
+    Saves the database and flushes the usage ledger and traffic recorder, once the loop has stopped.
     """
-    global disconnect_time
     save_database()
-    disconnect_time = asyncio.get_event_loop().time()
-    print(f"BOT DISCONNECTED AT {int(disconnect_time)}")
+    usage_ledger.flush()
+    traffic_recorder.flush()
+
+
+async def save_state_async():
+    """
+    Saves the database and flushes the usage ledger and traffic recorder without blocking the event loop.
+    """
+    await save_database_async(quiet=True)
+    await executors.run("io", usage_ledger.flush)
+    await executors.run("io", traffic_recorder.flush)
+
+
+async def stop_bot():
+    """
+    Stops the worker processes, the executors and the config watcher, then closes the Discord connection.
+    /shutdown, SIGTERM and Ctrl+C all stop the bot through here.
+    """
+    if worker_pool is not None:
+        await worker_pool.stop()
+    executors.shutdown()
+    config_service.stop()
+    await connection.stop(bot)
 
 
 @bot.event
@@ -247,27 +323,43 @@ async def on_ready():
     It performs various initialization tasks such as setting up the bot's presence,
     creating necessary roles, and adding guilds to the database.
     """
-    global disconnect_time
+    global metrics_runner, loop_monitor, bootstrap_task, worker_pool, autosave_task
     print(f"Logged in as {bot.user} (ID: {bot.user.id})")
     print(BOT_INVITE_URL)
-    bot.loop.create_task(check_disconnect_time())
-    completion.MY_BOT_NAME = bot.user.name
-    completion.MY_BOT_EXAMPLE_CONVOS = []
-    for c in EXAMPLE_CONVOS:
-        messages = []
-        for m in c.messages:
-            if m.user == BOT_NAME:
-                messages.append(Message(user=bot.user.name, text=m.text))
-            else:
-                messages.append(m)
-        completion.MY_BOT_EXAMPLE_CONVOS.append(Conversation(messages=messages))
-    bot.loop.create_task(save_database_loop())
-    print("Database Autosave Started!")
+    completion.set_bot_identity(bot.user.name)
+    config_service.start(bot.loop)
+    print("Watching config.yaml for changes!")
+    if autosave_task is None or autosave_task.done():  # on_ready runs again after every new session
+        autosave_task = bot.loop.create_task(save_database_loop())
+        print("Database Autosave Started!")
+    if WORKER_PROCESSES and worker_pool is None:
+        if streamMode:
+            print("Stream Mode is not supported with worker processes, replies are sent whole!")
+        worker_pool = WorkerPool(WORKER_PROCESSES)
+        print(f"Starting {WORKER_PROCESSES} worker processes...")
+        try:
+            await worker_pool.start()
+        except Exception as e:
+            print(f"Worker processes failed to start, serving messages in this process instead: {e!r}")
+            await worker_pool.stop()
+            worker_pool = None
+    if worker_pool is None:  # otherwise the workers ingest and compact
+        ingest_queue.start(bot.loop)
+        print("Memory Ingestion Started!")
+        start_compaction(bot.loop)
+        print("Memory Compaction Started!")
+        start_preload(bot.loop)  # usually already started by on_connect
+    if metrics_runner is None:
+        metrics_runner = await start_metrics_server()
+    loop_monitor = start_loop_monitor(bot.loop)
+    usage_ledger.start(bot.loop)
+    print("Usage Ledger Started!")
+    memory_footprint.start(bot.loop)
+    print("Memory Limits Enforcement Started!")
     for guild in bot.guilds:
         guild_id = str(guild.id)
-        print(f"Guild: {guild.name} (ID: {guild_id})")
         if guild_id not in database["Guilds"]:
-            print(f"{guild.name} not found in database. Adding...")
+            print(f"{guild.name} (ID: {guild_id}) not found in database. Adding...")
             database["Guilds"][guild_id] = {
                 "name": guild.name,
                 "images": {},
@@ -275,45 +367,40 @@ async def on_ready():
             }
         if ("name" not in database["Guilds"][guild_id]) or (guild.name not in database["Guilds"][guild_id]["name"]):
             database["Guilds"][guild_id]["name"] = guild.name
-        try:
-            role = discord_get(guild.roles, name=f"{bot.user.name} Admin")
-            owner = await guild.fetch_member(OWNER_ID)
-            if owner is None:
-                print(f"Owner not found in guild!")
-                return
-            if role is not None:
-                print(f"Role ({role.name}) found in guild! Refreshing role...")
-                await role.delete()
-                role = await guild.create_role(name=f"{bot.user.name} Admin", permissions=discord.Permissions(administrator=True))
-                print(f"Recreated Role ({role.name})!")
-                if owner is not None:
-                    print(f"Found {owner.name} (ID: {OWNER_ID}) in guild!")
-                    await owner.add_roles(role)
-                    print(f"Added role ({bot.user.name} Admin) to {owner.name}!")
-                else:
-                    print(f"Owner not found in guild!")
-            if role is None:
-                role = await guild.create_role(name=f"{bot.user.name} Admin", permissions=discord.Permissions(administrator=True))
-                print(f"Role ({role.name}) Not Found. Created Role!")
-                if owner is not None:
-                    print(f"Found {owner.name} (ID: {OWNER_ID}) in guild!")
-                    await owner.add_roles(role)
-                    print(f"Added role ({bot.user.name} Admin) to {owner.name}!")
-                else:
-                    print(f"Owner not found in guild!")
-        except Exception:
-            print(f"Failed to add or get role for Owner!")
-    print(f"{bot.user.name} is ready!")
+    print(f"{bot.user.name} is ready in {len(bot.guilds)} guilds!")
     await bot.change_presence(activity=Activity(type=botActivity, name=botActivityName))
     print(f'Presence set to "{botActivity.name} {botActivityName}"!')
+    # admin roles are set up in the background; messages are served meanwhile
+    if bootstrap_task is None or bootstrap_task.done():
+        bootstrap_task = bot.loop.create_task(bootstrap_guilds(bot.guilds, f"{bot.user.name} Admin", OWNER_ID))
 
 
 @bot.event
 async def on_connect():
     """
     Event handler called when the bot connects to Discord.
+    Overriding on_connect replaces py-cord's own command sync, so commands are synced here,
+    skipping the sync when they are unchanged since the last one.
     """
     print(f"{bot.user.name} connected to Discord!")
+    connection.connected()
+    if not WORKER_PROCESSES:
+        start_preload(bot.loop)  # warms while guilds are still streaming in, replies are answered without memories until then
+        print("Memory Index Loading...")
+    if bot.auto_sync_commands:
+        try:
+            if await sync_commands(bot, database.setdefault("command_sync", {})):
+                await save_database_async()
+        except Exception as e:
+            print(f"Failed to sync commands: {e}")
+
+
+@bot.event
+async def on_resumed():
+    """
+    Event handler called when a dropped gateway session is resumed, with no events missed.
+    """
+    connection.connected(resumed=True)
 
 
 @bot.event
@@ -394,10 +481,23 @@ async def updateDatabase(key, value):
         None
     """
     database[key] = value
-    await save_database()
+    await save_database_async()
     print(f"Updated database with {key}: {value}")
 
 
+def response_cache_enabled(guild):
+    """
+    Checks if an admin has turned on the semantic response cache for a guild.
+    Args:
+        guild (discord.Guild): The guild the message was sent in, or None for DMs.
+    Returns:
+        bool: True if cached replies may be served in this guild, False otherwise.
+    """
+    if guild is None:
+        return False
+    return database["Guilds"].get(str(guild.id), {}).get("response_cache", False)
+
+
 def checkVoice(message: DiscordMessage, prefix: str):
     """
     Checks if a message contains the voice prefix.
@@ -465,6 +565,11 @@ async def on_message(message: DiscordMessage):
     OriginalChannelID = int(OriginalChannel.id)
     if (message.author == bot.user) or message.author.bot or message.author.system or message.mention_everyone:
         return
+    on_message_started = perf_counter()
+    current_guild.set(message.guild.id if message.guild is not None else None)
+    budget_guild = budget_key(message.guild.id if message.guild is not None else None, message.channel.id)
+    tag_usage(guild=budget_guild, channel=message.channel.id, user=message.author.id, message=message.id)
+    traffic_recorder.record_message(message)
     channel = OriginalChannel
     # if message.channel.id in current_messages:
     #     old_message_id = current_messages[message.channel.id]
@@ -502,7 +607,7 @@ async def on_message(message: DiscordMessage):
             threads = user_threads[author_id]["threads"]
             for thread in threads:
                 try:
-                    await bot.fetch_channel(thread["thread_id"])
+                    await entities.channel(bot, thread["thread_id"])
                     print(f'Discord thread (ID: {thread["thread_id"]}) found in database!')
                 except NotFound:
                     print(f'Discord thread (ID: {thread["thread_id"]}) not found! Removing from database...')
@@ -519,9 +624,9 @@ async def on_message(message: DiscordMessage):
                     oldest_thread = threads.pop(0)
                     oldest_thread_id = oldest_thread["thread_id"]
                     oldest_message_id = oldest_thread["message_id"]
-                    oldest_thread_channel = await message.guild.fetch_channel(oldest_thread_id)
+                    oldest_thread_channel = await entities.channel(bot, oldest_thread_id)
                     await oldest_thread_channel.delete()
-                    oldest_message = await message.channel.fetch_message(oldest_message_id)
+                    oldest_message = await entities.message(bot, message.channel, oldest_message_id)
                     await oldest_message.delete()
                     await confirmMessage.delete()
                     print(f"Removed thread {oldest_thread_id} from database")
@@ -530,7 +635,7 @@ async def on_message(message: DiscordMessage):
                     return
             createdThread = None
             try:
-                NewThread = await bot.fetch_channel(message.id)
+                NewThread = await entities.channel(bot, message.id)
                 print("Thread already created!")
                 createdThread = NewThread
             except Exception:
@@ -543,22 +648,29 @@ async def on_message(message: DiscordMessage):
                 return
             threads.append({"thread_id": createdThread.id, "message_id": message.id})
             user_threads[author_id]["threads"] = threads
-            save_database()
-            interactive_response = await createdThread.send(thinkingText)
+            await save_database_async()
+            interactive_response = await outbound.send(createdThread, thinkingText)
             print("Thread Created!")
         elif isinstance(message.channel, discord.DMChannel) or bot.user.mentioned_in(message) or (message.channel.type in {discord.ChannelType.public_thread} and message.channel.parent.name == "gloved-gpt"):
             print("Message is DM or User Thread. Processing...")
-            interactive_response = await channel.send(thinkingText)
+            interactive_response = await outbound.send(channel, thinkingText)
         else:
             return
         try:
-            message = await channel.fetch_message(message.id)
+            message = await entities.message(bot, channel, message.id)
         except NotFound:
-            interactive_response.delete()
+            await outbound.delete(interactive_response)
             return
-        channel = await bot.fetch_channel(interactive_response.channel.id)
+        channel = interactive_response.channel
         current_messages[channel.id] = str(message.id)
         current_messages[message.channel.id] = interactive_response.id
+        guild_budget = database["Guilds"].get(budget_guild, {}).get("budget") if message.guild is not None else None
+        refused = usage_ledger.check_budget(budget_guild, guild_budget)
+        if refused is not None:
+            print(f"Budget exceeded for guild {budget_guild}: {refused}")
+            await timed_edit(interactive_response, f"**```Usage limit reached: {refused}. Try again later.```**")
+            current_messages.pop(channel.id, None)
+            return
         if llm_provider == "google":
             async with channel.typing():
                 # Check for image attachments
@@ -587,203 +699,220 @@ async def on_message(message: DiscordMessage):
 
                     # Fetch message that is being replied to
                     if message.reference is not None:
-                        reply_message = await channel.fetch_message(message.reference.message_id)
+                        reply_message = message.reference.resolved
+                        if not isinstance(reply_message, DiscordMessage):
+                            reply_message = await entities.message(bot, channel, message.reference.message_id)
                         if reply_message.author.id != bot.user.id:
                             query = f"{query} while quoting @{reply_message.author.name} \"{reply_message.clean_content}\""
 
                     response_text = await generate_response_with_text(channel.id, query)
                     # Split the Message so discord does not get upset
                     await split_and_send_messages(interactive_response, response_text, 1700)
-                    del current_messages[channel.id]
+                    traffic_recorder.record_reply(str(OriginalMessageID), len(response_text), perf_counter() - on_message_started)
+                    current_messages.pop(channel.id, None)
                     thinkingText = "**```Response Finished!```** \n"
-                    responseReply = await message.reply(thinkingText)
+                    outbound.flash(message, thinkingText, 0.5)
                     print("Full Response Sent!")
-                    await asyncio.sleep(0.5)
-                    await responseReply.delete()
                     return
-        message = await OriginalChannel.fetch_message(OriginalMessageID)
-        if bot.user.mentioned_in(message):
-            message.content = message.content.removeprefix("<@938447947857821696> ")
-        print("Embedding Message!")
-        vector = gpt3_embedding(message)
-        timestamp = time()
-        timestring = timestring = timestamp_to_datetime(timestamp)
-        user = message.author.name
-        extracted_message = "%s: %s - %s" % (user, timestring, MentionContent)
-        info = {
-            "speaker": user,
-            "timestamp": timestamp,
-            "uuid": str(uuid4()),
-            "vector": vector,
-            "message": extracted_message,
-            "timestring": timestring,
-        }
-        filename = "log_%s_user" % timestamp
-        save_json(f"./src/chat_logs/{filename}.json", info)
-        history = load_convo()
-        print("Loading Memories!")
-        thinkingText = "**```Loading Memories...```**"
-        await interactive_response.edit(content=thinkingText)
-        memories = fetch_memories(vector, history, 5)
-        current_notes, vector = summarize_memories(memories)
-        print(current_notes)
+        message = await entities.message(bot, OriginalChannel, OriginalMessageID)  # shared with the gateway cache, never modified
         print(
-            "-------------------------------------------------------------------------------"
+            f"Message to process - {message.author}: {MentionContent[:50]} - {channel.id} {channel.jump_url}"
         )
-        add_notes(current_notes)
-        if len(notes_history) >= 2:
-            print(notes_history[-2])
-        else:
-            print(
-                "The list does not have enough elements to access the second-to-last element."
+        cache_namespace = message.guild.id if message.guild is not None else None
+        config_version = config_service.current  # kept for the whole response, even if config.yaml changes meanwhile
+        prompt_prefix = config_version.persona(completion.bot_identity).prefix
+        completion_args = dict(model="gpt-4", temperature=1.0)
+        if worker_pool is not None:
+            # split mode: the channel's worker process retrieves memories, renders and completes
+            result = await worker_pool.relay(
+                bot,
+                channel,
+                message,
+                interactive_response,
+                completion_args,
+                content=MentionContent,
+                message_id=OriginalMessageID,
+                text_channel=TextChannel,
+                cache_enabled=response_cache_enabled(message.guild),
+                cache_namespace=cache_namespace,
+                prompt_prefix=prompt_prefix,
+                config_digest=config_version.digest,
             )
-        message_notes = Message(user="memories", text=current_notes)
-        context_notes = None
-        if len(notes_history) >= 2:
-            context_notes = Message(user="context", text=notes_history[-2])
-        else:
-            print("The list does not have enough elements create context")
-        print(
-            f"Message to process - {message.author}: {message.content[:50]} - {channel.id} {channel.jump_url}"
-        )
-        thinkingText = "**```Reading Previous Messages...```**"
-        await interactive_response.edit(content=thinkingText)
-        if not TextChannel:
-            print("Public Thread Message Recieved!")
-            channel_messages = [
-                discord_message_to_message(msg)
-                async for msg in message.channel.history(limit=MAX_MESSAGE_HISTORY)
-            ]
-        else:
-            channel_messages = [discord_message_to_message(message)]
-        if message.thread is None:
-            print("Thread Message Recieved!")
-            print(message.content)
-        channel_messages = [x for x in channel_messages if x is not None]
-        channel_messages.reverse()
-        channel_messages.insert(0, message_notes)
-        if context_notes:
-            channel_messages.insert(0, context_notes)
-        timestamp = time()
-        timestring = timestring = timestamp_to_datetime(timestamp)
-        prompt = Prompt(
-            header=Message(
-                "System", f"Instructions for {MY_BOT_NAME}: {BOT_INSTRUCTIONS}"
-            ),
-            examples=MY_BOT_EXAMPLE_CONVOS,
-            convo=Conversation(
-                channel_messages + [Message(f"{timestring} {MY_BOT_NAME}")]
-            ),
-        )
-        rendered = prompt.render()
-        mentions = re.findall(r"<@(\d+)>", rendered)
-        for mention in mentions:
-            user = await bot.fetch_user(mention)
-            rendered = rendered.replace(f"<@{mention}>", user.name)
-        rendered.replace(f"<|endoftext|>GlovedBot: **```Reading Previous Messages...```**", "")
-        print(rendered)
-        print("Prompt Rendered!")
-        thinkingText = "**```Creating Response...```** \n"
-        await interactive_response.edit(content=thinkingText)
-        # completions = None
-        # if llm_provider == "mistral":
-        #     completions = mistral.chat(
-        #         model="mistral-medium",
-        #         messages=[ChatMessage(role="user", content=rendered)],
-        #         temperature=0.7,
-        #         max_tokens=150,
-        #     )
-        #     full_reply_content = completions.choices[0].message.content
-        #     full_reply_content_combined = ""
-        #     reply_content = [
-        #         full_reply_content[i: i + 2000]
-        #         for i in range(0, len(full_reply_content), 2000)
-        #     ]
-        #     await interactive_response.edit(content=reply_content[0])
-        #     for msg in reply_content[1:]:
-        #         interactive_response = await channel.send(msg)
-        #         print("Message character limit reached. Sending chunk.")
-        # if llm_provider == "openai":
-        completions = openai.chat.completions.create(
-            model="gpt-4",
-            messages=[{"role": "system", "content": rendered}],
-            temperature=1.0,
-            stream=streamMode,
-        )
-        if not streamMode:
-            print("Stream Mode Off")
-            full_reply_content = completions.choices[0].message.content
+            cached_reply = result["reply"] if result["cached"] else None
+            full_reply_content = result["reply"]
             full_reply_content_combined = ""
             reply_content = [
                 full_reply_content[i: i + 2000]
                 for i in range(0, len(full_reply_content), 2000)
             ]
-            await interactive_response.edit(content=reply_content[0])
+            await timed_edit(interactive_response, reply_content[0])
             for msg in reply_content[1:]:
-                interactive_response = await channel.send(msg)
+                interactive_response = await outbound.send(channel, msg, FINAL)
                 print("Message character limit reached. Sending chunk.")
         else:
-            print("Stream Mode On")
-            collected_chunks = []
-            collected_messages = []
-            full_reply_content_combined = ""
-            print("Getting chunks...")
-            for chunk in completions:
-                await asyncio.sleep(0.4)
-                collected_chunks.append(chunk)
-                chunk_message = chunk.choices[0].delta
-                if chunk_message.content is not None:
-                    collected_messages.append(chunk_message)
-                full_reply_content = "".join([m.content for m in collected_messages])
-                if full_reply_content and not full_reply_content.isspace():
-                    await interactive_response.edit(content=thinkingText + full_reply_content)
-                if len(full_reply_content) > 1950:
-                    full_reply_content_combined = full_reply_content
-                    await interactive_response.edit(content=full_reply_content)
-                    interactive_response = await channel.send(thinkingText)
+            response_context = await completion.prepare_response(
+                bot,
+                channel,
+                message,
+                interactive_response,
+                content=MentionContent,
+                message_id=OriginalMessageID,
+                text_channel=TextChannel,
+                cache_enabled=response_cache_enabled(message.guild),
+                cache_namespace=cache_namespace,
+                prompt_prefix=prompt_prefix,
+                config_digest=config_version.digest,
+            )
+            vector = response_context["embed"]
+            cached_reply = response_context["cache"]
+            summarize_after_reply = False
+            if cached_reply is None:  # a hit skipped retrieval and rendering
+                reused_notes, memories = response_context["memories"]
+                current_notes, summary, summarize_after_reply = response_context["notes"]
+                rendered = response_context["render"]
+                print(current_notes)
+                print(
+                    "-------------------------------------------------------------------------------"
+                )
+                print(rendered)
+                print("Prompt Rendered!")
+                thinkingText = "**```Creating Response...```** \n"
+                outbound.edit(interactive_response, thinkingText, PROGRESS)  # not awaited, the reply's edit supersedes it
+            # completions = None
+            # if llm_provider == "mistral":
+            #     completions = providers.get("mistral").chat(
+            #         model="mistral-medium",
+            #         messages=[ChatMessage(role="user", content=rendered)],
+            #         temperature=0.7,
+            #         max_tokens=150,
+            #     )
+            #     full_reply_content = completions.choices[0].message.content
+            #     full_reply_content_combined = ""
+            #     reply_content = [
+            #         full_reply_content[i: i + 2000]
+            #         for i in range(0, len(full_reply_content), 2000)
+            #     ]
+            #     await interactive_response.edit(content=reply_content[0])
+            #     for msg in reply_content[1:]:
+            #         interactive_response = await channel.send(msg)
+            #         print("Message character limit reached. Sending chunk.")
+            # if llm_provider == "openai":
+            if cached_reply is not None:
+                print("Cached Response Found!")
+                full_reply_content = cached_reply
+                full_reply_content_combined = ""
+                reply_content = [
+                    full_reply_content[i: i + 2000]
+                    for i in range(0, len(full_reply_content), 2000)
+                ]
+                await timed_edit(interactive_response, reply_content[0])
+                for msg in reply_content[1:]:
+                    interactive_response = await outbound.send(channel, msg, FINAL)
+                    print("Message character limit reached. Sending chunk.")
+            else:
+                completion_args.update(messages=[{"role": "system", "content": rendered}], stream=streamMode)
+                completion_started = perf_counter()
+                if streamMode:
+                    completions = providers.get("openai").chat.completions.create(**completion_args)
+                else:
+                    key = call_key(completion_args["model"], completion_args["messages"], completion_args["temperature"])
+                    completions = await provider_calls.do(key, asyncio.to_thread, completion.create_completion, **completion_args)
+                if not streamMode:
+                    print("Stream Mode Off")
+                    metrics.record("completion.ttft", perf_counter() - completion_started)
+                    metrics.record("completion.total", perf_counter() - completion_started)
+                    full_reply_content = completions.choices[0].message.content
+                    full_reply_content_combined = ""
+                    reply_content = [
+                        full_reply_content[i: i + 2000]
+                        for i in range(0, len(full_reply_content), 2000)
+                    ]
+                    await timed_edit(interactive_response, reply_content[0])
+                    for msg in reply_content[1:]:
+                        interactive_response = await outbound.send(channel, msg, FINAL)
+                        print("Message character limit reached. Sending chunk.")
+                else:
+                    print("Stream Mode On")
+                    collected_chunks = []
                     collected_messages = []
-                    print("Message character limit reached. Started new message.")
+                    full_reply_content_combined = ""
+                    first_token_seen = False
+                    print("Getting chunks...")
+                    for chunk in completions:
+                        await asyncio.sleep(0)  # edits are paced and collapsed by the outbound scheduler
+                        collected_chunks.append(chunk)
+                        chunk_message = chunk.choices[0].delta
+                        if chunk_message.content is not None:
+                            if not first_token_seen:
+                                first_token_seen = True
+                                metrics.record("completion.ttft", perf_counter() - completion_started)
+                            collected_messages.append(chunk_message)
+                        full_reply_content = "".join([m.content for m in collected_messages])
+                        if full_reply_content and not full_reply_content.isspace():
+                            outbound.edit(interactive_response, thinkingText + full_reply_content, PROGRESS)
+                        if len(full_reply_content) > 1950:
+                            full_reply_content_combined = full_reply_content
+                            await timed_edit(interactive_response, full_reply_content)
+                            interactive_response = await outbound.send(channel, thinkingText)
+                            collected_messages = []
+                            print("Message character limit reached. Started new message.")
+                    metrics.record("completion.total", perf_counter() - completion_started)
+                reply_text = "".join([full_reply_content_combined, full_reply_content])
+                if streamMode:
+                    # streamed responses carry no usage block, so estimate ~4 characters per token
+                    usage_ledger.add("openai", completion_args["model"], "completion", perf_counter() - completion_started,
+                                     characters=len(rendered) + len(reply_text),
+                                     prompt_tokens=len(rendered) // 4, completion_tokens=len(reply_text) // 4)
+                if vector is not None and response_cache_enabled(message.guild):
+                    response_cache.store(cache_namespace, prompt_prefix, vector, "".join([full_reply_content_combined, full_reply_content]))
         # else:
         #     print("No model found! Stopping...")
         #     return
         print("full_reply_content: " + full_reply_content)
-        await interactive_response.edit(content=full_reply_content)
+        await timed_edit(interactive_response, full_reply_content)
+        traffic_recorder.record_reply(
+            str(OriginalMessageID),
+            len(full_reply_content_combined) + len(full_reply_content),
+            perf_counter() - on_message_started,
+            cached=cached_reply is not None,
+        )
+        if worker_pool is None:  # workers summarize and ingest their own replies
+            if summarize_after_reply:
+                schedule_summary(channel.id, memories)
+            ingest_queue.enqueue(
+                f"{OriginalMessageID}:reply",
+                bot.user.name,
+                "".join([full_reply_content_combined, full_reply_content]),
+                channel_id=channel.id,
+                reply_to=OriginalMessageID,
+            )
         # del current_messages[channel.id]
         if len(current_messages) == 0:
             await bot.change_presence(
                 activity=Activity(type=botActivity, name=botActivityName)
             )
         thinkingText = "**```Response Finished!```** \n"
-        responseReply = await message.reply(thinkingText)
+        outbound.flash(message, thinkingText, 0.5)
         print("Full Response Sent!")
-        await asyncio.sleep(0.5)
-        await responseReply.delete()
-        voice = [None]
-        user_id = message.author.id
-        guild = message.guild
-        if guild is not None:
-            member = await guild.fetch_member(user_id)
-            if member.voice is not None:
+        voice = None
+        if message.guild is not None:
+            voice = await entities.voice_state(message.guild, message.author.id)
+            if voice is not None:
                 print("User is in a voice channel!")
-                voice[0] = member.voice
-        if voice[0] is not None:
-            user_id = message.author.id
-            voice_channel = voice[0].channel
+        if voice is not None and providers.is_enabled("elevenlabs"):
+            voice_channel = voice.channel
             print("Voice Channel Found!")
             thinkingText = "**```Getting Voice...```** \n"
-            gettingVoiceMsg = await interactive_response.reply(thinkingText)
+            gettingVoiceMsg = await outbound.reply(interactive_response, thinkingText, PROGRESS)
             full_reply_content_combined = "".join([full_reply_content_combined, full_reply_content])
             full_reply_voice = re.sub(r"\*.*?\*", "", full_reply_content_combined)
             print(f"Creating TTS for: {full_reply_voice}")
             try:
-                audio = elevenlabs.generate(
-                    text=full_reply_voice,
-                    voice="Roetpv5aIoWbL37AfGp3",
-                    model="eleven_multilingual_v2",
-                )
-                await gettingVoiceMsg.delete()
-                with open("voice.mp3", "wb") as f:
-                    f.write(audio)
+                with span("provider.tts"), track_usage("elevenlabs", "eleven_multilingual_v2", "tts") as usage:
+                    usage["characters"] = len(full_reply_voice)
+                    await executors.run("io", generate_voice, full_reply_voice, "voice.mp3")
+                if gettingVoiceMsg is not None:
+                    await outbound.delete(gettingVoiceMsg)
                 voice_client = await voice_channel.connect()
                 await asyncio.sleep(0.5)
                 voice_client.play(FFmpegPCMAudio("voice.mp3", options=f'-filter:a "volume=2.0"'))
@@ -799,57 +928,50 @@ async def on_message(message: DiscordMessage):
         else:
             print("No Voice Channel Found!")
     except Exception as e:
+        traffic_recorder.record_reply(str(OriginalMessageID), 0, perf_counter() - on_message_started, error=True)
         await bot.change_presence(activity=Activity(type=botActivity, name=botActivityName))
         if interactive_response is not None:
             print("Error Occurred! Deleting Response...")
-            await interactive_response.delete()
+            await outbound.delete(interactive_response)
         logger.exception(e)
-        await message.reply(f"Error: {str(e)}", delete_after=10)
+        await outbound.reply(message, f"Error: {str(e)}", delete_after=10)
         if not TextChannel and not message.channel.name == "gloved-gpt":
             return
         try:
-            thread = await bot.fetch_channel(OriginalMessage.thread.id)
-            message = await thread.fetch_message(OriginalMessage.id)
+            thread = await entities.channel(bot, OriginalMessage.thread.id)
+            message = await entities.message(bot, thread, OriginalMessage.id)
             await thread.delete()
             await message.delete()
             print("Message Thread Deleted!")
         except Exception:
             return
+    metrics.record("on_message.total", perf_counter() - on_message_started)
     print("Full Response Sent! Finished Message Event!")
 
 
 @bot.event
 async def on_raw_reaction_add(payload: discord.RawReactionActionEvent):
-    if str(payload.emoji) == ":loud_sound:":
-        voice = [None]
-        guild = await bot.fetch_guild(payload.guild_id)
-        channel = await guild.get_channel(payload.channel_id)
-        message = await channel.fetch_message(payload.message_id)
-        author = await bot.fetch_user(payload.user_id)
-        guild = message.guild
-        if guild is not None:
-            member = await guild.fetch_member(user_id)
-            if member.voice is not None:
-                print("User is in a voice channel!")
-                voice[0] = member.voice
-        if voice[0] is not None:
-            user_id = message.author.id
+    if str(payload.emoji) == "🔊" and payload.guild_id is not None and payload.user_id != bot.user.id:
+        guild = await entities.guild(bot, payload.guild_id)
+        voice = await entities.voice_state(guild, payload.user_id)
+        if voice is not None:
+            print("User is in a voice channel!")
+        if voice is not None and providers.is_enabled("elevenlabs"):
+            channel = await entities.channel(bot, payload.channel_id)
+            message = await entities.message(bot, channel, payload.message_id)
             voice_channel = voice.channel
             print("Voice Channel Found!")
             thinkingText = "**```Getting Voice...```** \n"
-            gettingVoiceMsg = await message.reply(thinkingText)
+            gettingVoiceMsg = await outbound.reply(message, thinkingText, PROGRESS)
             full_reply_content_combined = message.content
             full_reply_voice = re.sub(r"\*.*?\*", "", full_reply_content_combined)
             print(f"Creating TTS for: {full_reply_voice}")
             try:
-                audio = elevenlabs.generate(
-                    text=full_reply_voice,
-                    voice="Roetpv5aIoWbL37AfGp3",
-                    model="eleven_multilingual_v2",
-                )
-                await gettingVoiceMsg.delete()
-                with open("voice.mp3", "wb") as f:
-                    f.write(audio)
+                with span("provider.tts"), track_usage("elevenlabs", "eleven_multilingual_v2", "tts") as usage:
+                    usage["characters"] = len(full_reply_voice)
+                    await executors.run("io", generate_voice, full_reply_voice, "voice.mp3")
+                if gettingVoiceMsg is not None:
+                    await outbound.delete(gettingVoiceMsg)
                 voice_client = await voice_channel.connect()
                 await asyncio.sleep(0.5)
                 voice_client.play(FFmpegPCMAudio("voice.mp3", options=f'-filter:a "volume=2.0"'))
@@ -865,6 +987,16 @@ async def on_raw_reaction_add(payload: discord.RawReactionActionEvent):
         else:
             print("No Voice Channel Found!")
 
+
+@bot.event
+async def on_raw_message_edit(payload: discord.RawMessageUpdateEvent):
+    entities.forget(payload.message_id)  # our cached copy is stale; the gateway cache updates itself
+
+
+@bot.event
+async def on_raw_message_delete(payload: discord.RawMessageDeleteEvent):
+    entities.forget(payload.message_id)
+
 print("Registered Events!")
 
 
@@ -906,6 +1038,187 @@ async def ping(ctx):
     await ctx.respond(f"Pong! Latency is {bot.latency}")
 
 
+@bot.command(description="Shows per-stage response latency percentiles (owner only).")
+async def latency(ctx, scope: Option(str, "Show all guilds or only this one", choices=["all", "guild"], default="all")):  # type: ignore
+    """
+    Sends p50/p95/p99 latency for every instrumented stage and provider call.
+
+    Parameters:
+    - ctx: The context object representing the command invocation.
+    - scope (str): "all" for every guild combined, "guild" for the current guild only (default: "all").
+
+    Returns:
+    - None
+    """
+    if str(ctx.author.id) != str(OWNER_ID):
+        await ctx.respond("You don't have permission to do this!", ephemeral=True)
+        return
+    guild = ctx.guild.id if scope == "guild" and ctx.guild is not None else None
+    report = metrics.report(guild)
+    if loop_monitor is not None:
+        report += "\n\nEvent loop stalls:\n" + loop_monitor.report()
+    report += "\n\nProviders: " + providers.report()
+    report += "\nExecutors: " + executors.report()
+    report += "\nOutbound: " + outbound.report()
+    report += "\nEntity cache hits: " + entities.report()
+    report += "\nConfig: " + config_service.report()
+    report += "\nGateway: " + connection.report()
+    if worker_pool is None:
+        report += "\nMemory index: " + memory_report()
+    if worker_pool is not None:
+        report += "\n\nWorkers:\n" + worker_pool.report()
+    await ctx.respond(f"```\n{report[:1900]}\n```", ephemeral=True)
+
+
+@bot.command(description="Controls the semantic response cache for this server.")
+async def responsecache(ctx: discord.ApplicationContext, action: Option(str, "What to do with the cache", choices=["on", "off", "stats", "clear"], default="stats")):  # type: ignore
+    """
+    Turns the semantic response cache on or off for the current guild, clears it, or shows its hit rate.
+
+    Parameters:
+    - ctx (Context): The context object representing the interaction.
+    - action (str): One of "on", "off", "stats" or "clear" (default: "stats").
+
+    Returns:
+    - None
+    """
+    if ctx.guild is None:
+        await ctx.respond("The response cache is only available in servers.")
+        return
+    if not await check_admin_permissions(ctx):
+        return
+    guild_data = database["Guilds"].setdefault(str(ctx.guild.id), {"name": ctx.guild.name, "images": {}, "user_threads": {}})
+    if action in ("on", "off"):
+        guild_data["response_cache"] = action == "on"
+        if action == "off":
+            response_cache.clear(ctx.guild.id)
+        await save_database_async()
+        await ctx.respond(f"Response cache turned {action}.")
+    elif action == "clear":
+        response_cache.clear(ctx.guild.id)
+        await ctx.respond("Response cache cleared.")
+    else:
+        stats = response_cache.stats(ctx.guild.id)
+        enabled = "on" if guild_data.get("response_cache", False) else "off"
+        await ctx.respond(
+            f"Response cache is {enabled}. Hits: {stats['hits']}, misses: {stats['misses']}, "
+            f"hit rate: {stats['hit_rate']:.1%}, entries: {stats['entries']}"
+        )
+
+
+@bot.command(description="Sets request and token limits for this server.")
+async def budget(ctx: discord.ApplicationContext, requests_per_minute: Option(int, "Responses allowed per minute, 0 for no limit", default=None), tokens_per_day: Option(int, "Provider tokens allowed per day, 0 for no limit", default=None)):  # type: ignore
+    """
+    Sets or shows the current guild's usage budget; requests over budget are refused before any provider is called.
+
+    Parameters:
+    - ctx (Context): The context object representing the interaction.
+    - requests_per_minute (int): Responses allowed per minute, 0 for no limit (default: unchanged).
+    - tokens_per_day (int): Provider tokens allowed per day, 0 for no limit (default: unchanged).
+
+    Returns:
+    - None
+    """
+    if ctx.guild is None:
+        await ctx.respond("Budgets are only available in servers.")
+        return
+    if not await check_admin_permissions(ctx):
+        return
+    guild_data = database["Guilds"].setdefault(str(ctx.guild.id), {"name": ctx.guild.name, "images": {}, "user_threads": {}})
+    budget = guild_data.setdefault("budget", {})
+    if requests_per_minute is not None:
+        budget["requests_per_minute"] = requests_per_minute or None
+    if tokens_per_day is not None:
+        budget["tokens_per_day"] = tokens_per_day or None
+    if requests_per_minute is not None or tokens_per_day is not None:
+        await save_database_async()
+    per_minute = budget.get("requests_per_minute", DEFAULT_REQUESTS_PER_MINUTE)
+    per_day = budget.get("tokens_per_day", DEFAULT_TOKENS_PER_DAY)
+    usage_ledger.load_today()
+    used = usage_ledger.day_tokens[str(ctx.guild.id)]
+    await ctx.respond(
+        f"Requests per minute: {per_minute or 'no limit'}, tokens per day: {per_day or 'no limit'} "
+        f"({used} used today)."
+    )
+
+
+@bot.command(description="Shows provider token usage by server and stage (owner only).")
+async def usage(ctx):
+    """
+    Sends token, character and call totals since startup, grouped by guild and by pipeline stage.
+
+    Parameters:
+    - ctx: The context object representing the command invocation.
+
+    Returns:
+    - None
+    """
+    if str(ctx.author.id) != str(OWNER_ID):
+        await ctx.respond("You don't have permission to do this!", ephemeral=True)
+        return
+    await ctx.respond(f"```\n{usage_ledger.report()[:1900]}\n```", ephemeral=True)
+
+
+@bot.command(description="Shows memory use of long-lived caches and tracemalloc growth (owner only).")
+async def footprint(ctx, action: Option(str, "What to show or do", choices=["sizes", "snapshot", "trim", "stoptrace"], default="sizes")):  # type: ignore
+    """
+    Reports the size of every registered cache, or takes a tracemalloc snapshot and diffs it with the last one.
+
+    Parameters:
+    - ctx: The context object representing the command invocation.
+    - action (str): "sizes" for the structure table, "snapshot" for the top growth sites since the previous
+      snapshot, "trim" to enforce the soft limits now, "stoptrace" to stop tracemalloc (default: "sizes").
+
+    Returns:
+    - None
+    """
+    if str(ctx.author.id) != str(OWNER_ID):
+        await ctx.respond("You don't have permission to do this!", ephemeral=True)
+        return
+    await ctx.defer(ephemeral=True)
+    if action == "snapshot":
+        previous = memory_footprint.snapshot_time
+        growth = await asyncio.to_thread(memory_footprint.take_snapshot)
+        if previous is None:
+            report = "tracemalloc started and first snapshot taken; run again to see growth."
+        else:
+            lines = [f"growth over the last {time() - previous:.0f}s:"]
+            lines += [f"{size / 1024:>+9.1f}KB {count:>+7} {site}" for site, size, count in growth]
+            report = "\n".join(lines)
+    elif action == "trim":
+        dropped = memory_footprint.enforce()
+        report = "Trimmed: " + (", ".join(f"{name} -{count}" for name, count in dropped.items()) or "nothing over its limit")
+    elif action == "stoptrace":
+        memory_footprint.stop_tracing()
+        report = "tracemalloc stopped."
+    else:
+        report = await asyncio.to_thread(memory_footprint.report)
+    await ctx.respond(f"```\n{report[:1900]}\n```", ephemeral=True)
+
+
+@bot.command(description="Turns scrubbed traffic recording on or off (owner only).")
+async def record(ctx, action: Option(str, "What to do", choices=["on", "off", "status"], default="status")):  # type: ignore
+    """
+    Starts or stops the traffic recorder, which writes scrubbed message, provider and reply events for replay.
+
+    Parameters:
+    - ctx: The context object representing the command invocation.
+    - action (str): "on", "off" or "status" (default: "status").
+
+    Returns:
+    - None
+    """
+    if str(ctx.author.id) != str(OWNER_ID):
+        await ctx.respond("You don't have permission to do this!", ephemeral=True)
+        return
+    if action == "on":
+        traffic_recorder.start()
+    elif action == "off":
+        traffic_recorder.stop()
+    state = "on" if traffic_recorder.enabled else "off"
+    await ctx.respond(f"Traffic recording is {state}; {traffic_recorder.events} events recorded since startup.", ephemeral=True)
+
+
 @bot.command(description="Purges messages from the current channel.")
 async def purge(ctx: discord.ApplicationContext, limit: Option(int, "The number of messages to purge (default: 10)", default=10)):  # type: ignore
     """
@@ -948,11 +1261,28 @@ async def shutdown(ctx):
         return
     await ctx.respond(f"{bot.user.display_name} is shutting down.")
     print(f"{bot.user.display_name} is shutting down.")
-    await bot.close()
+    await stop_bot()
 
 print("Registered Commands!")
 
-try:
-    bot.run(DISCORD_BOT_TOKEN)
-finally:
-    asyncio.run(on_disconnect())
+
+def run():
+    """
+    Runs the bot until it is shut down. Start it with `python -m src` (src/__main__.py): process pool
+    children re-run the main module of the process that spawns them, except a package's __main__.
+    """
+    try:
+        bot.loop.add_signal_handler(signal.SIGTERM, lambda: bot.loop.create_task(stop_bot()))
+    except (NotImplementedError, RuntimeError):
+        pass  # no signal handlers on Windows event loops
+    try:
+        bot.loop.run_until_complete(connection.run(bot, DISCORD_BOT_TOKEN))
+    except KeyboardInterrupt:
+        bot.loop.run_until_complete(stop_bot())
+    finally:
+        save_state()
+
+
+if __name__ == "__main__":
+    print("Started as src.main, so process pool children will load it again; start the bot with `python -m src` instead.")
+    run()
@@ -6,12 +6,63 @@ from numpy.linalg import norm
 import numpy as np
 import json
 import os
-from openai import OpenAI
-
-client = OpenAI(api_key=os.environ['OPENAI_API_KEY'])
+import asyncio
+import threading
+from src.segments import write_segment, search_segments, lookup_segments, refresh_manifest
+from src.local_embed import LocalIndex, record_text
+from src.memory_index import MetadataIndex
+from src.singleflight import provider_calls, call_key
+from src.metrics import span
+from src.usage import track_usage, openai_usage
+from src.footprint import footprint
+from src.providers import providers
+from src.executors import executors
 
 
 notes_history = []
+convo_index = None  # uuid -> chat log record, loaded lazily by load_convo_index()
+convo_files = {}  # uuid -> chat log filename, for every record in convo_index
+local_index = LocalIndex()  # offline lexical vectors for every record in convo_index
+metadata_index = MetadataIndex()  # speaker/channel/time bitmaps for every record in convo_index
+notes_index = None  # note blocks, loaded lazily by load_notes_index()
+notes_covered = set()  # uuids covered by some note block, kept in step with notes_index
+index_lock = threading.RLock()  # guards the hot indexes, which retrieval reads from executor threads
+load_lock = threading.Lock()  # one caller builds the hot indexes, the others wait for it
+index_state = "cold"  # "cold", "warming", "ready" or "failed"; see preload_convo_index()
+index_progress = [0, 0]  # chat logs parsed and to parse while warming
+preload_task = None
+
+NOTES_SEARCH_COUNT = 3  # how many of the best note blocks to drill into
+NOTES_REUSE_THRESHOLD = 0.9  # reuse an existing note block as-is above this similarity
+RECENT_UNCOVERED_COUNT = 200  # newest chat logs not yet covered by any note block
+
+channel_summaries = {}  # channel id -> rolling summary written after that channel's previous reply
+summary_blocks = {}  # channel id -> {uuid: timestamp} folded into its rolling summary since its last note block
+summary_tasks = {}  # channel id -> background summarization task
+SYNC_SUMMARY_WHEN_MISSING = True  # summarize on the reply path only when a channel has no summary yet
+SUMMARY_BLOCK_RECORDS = 50  # a channel's rolling summary is saved as a note block once it covers this many new records
+
+HOT_MAX_AGE_DAYS = 14  # chat logs older than this are compacted into cold segments
+HOT_MAX_RECORDS = 5000  # the oldest chat logs beyond this are compacted too
+SEGMENT_SIZE = 1000  # records per cold segment
+DEDUP_THRESHOLD = 0.98  # same-speaker records this similar are merged during compaction
+COLD_REPLACE_WITH_NOTES = False  # drop records already covered by a note block instead of keeping them cold
+MEMORY_DUMPS_KEEP = 200  # newest prompt dumps kept in ./src/memories
+NOTES_HOT_MAX = 500  # note blocks kept before the oldest are merged into coarser ones
+NOTES_MERGE_GROUP = 10  # old note blocks merged into each coarser block
+COMPACTION_INTERVAL = 60 * 60
+compaction_task = None
+NOTES_HISTORY_LIMIT = 100  # soft limits enforced by the footprint registry
+CHANNEL_SUMMARIES_LIMIT = 1000
+
+EMBEDDING_DEADLINE = 3.0  # seconds to wait on the remote embedder before falling back to the local index
+LOCAL_PREFILTER_MIN = 1000  # hot scans larger than this are narrowed by the local index first
+LOCAL_PREFILTER_COUNT = 200  # candidates kept by the local prefilter
+PRELOAD_CHUNK = 500  # chat logs parsed per process pool job when warming the hot index
+CHAT_LOG_BYTES = 32 * 1024  # rough size of one chat log file, mostly its embedding
+
+PERSONAL_MEMORY_COUNT = 2  # extra memories drawn from the speaker's own recent messages
+PERSONAL_MEMORY_DAYS = 30
 
 
 def open_file(filepath):
@@ -40,45 +91,54 @@ def timestamp_to_datetime(unix_time):
 
 def gpt3_embedding(message, engine='text-embedding-ada-002'):
     content = message.content
-    response = client.embeddings.create(input=content, model=engine)
+    with span('provider.embedding'), track_usage('openai', engine, 'embedding') as usage:
+        response = providers.get('openai').embeddings.create(input=content, model=engine)
+        usage.update(openai_usage(response), characters=len(content))
     vector = response.data[0].embedding  # this is a normal list
     return vector
 
 
 def gpt3_response_embedding(response_data, engine='text-embedding-ada-002'):
     content = response_data.reply_text
-    response = client.embeddings.create(input=content, model=engine)
+    with span('provider.embedding'), track_usage('openai', engine, 'embedding') as usage:
+        response = providers.get('openai').embeddings.create(input=content, model=engine)
+        usage.update(openai_usage(response), characters=len(content))
     vector = response.data[0].embedding  # this is a normal list
     return vector
 
 
 def gpt3_memory_embedding(content, engine='text-embedding-ada-002'):
     content = content.encode(encoding='ASCII', errors='ignore').decode()
-    response = client.embeddings.create(input=content, model=engine)
+    with span('provider.embedding'), track_usage('openai', engine, 'embedding') as usage:
+        response = providers.get('openai').embeddings.create(input=content, model=engine)
+        usage.update(openai_usage(response), characters=len(content))
     vector = response.data[0].embedding  # this is a normal list
     return vector
 
 
+def gpt3_batch_embedding(contents, engine='text-embedding-ada-002'):
+    # not ASCII-stripped like single memories: a reply of only emoji or non-Latin text would come out empty and fail the whole batch
+    with span('provider.embedding_batch'), track_usage('openai', engine, 'ingest') as usage:
+        response = providers.get('openai').embeddings.create(input=contents, model=engine)
+        usage.update(openai_usage(response), characters=sum(len(i) for i in contents))
+    return [i.embedding for i in sorted(response.data, key=lambda d: d.index)]
+
+
 def similarity(v1, v2):
     # based upon https://stackoverflow.com/questions/18424228/cosine-similarity-between-2-number-lists
     return np.dot(v1, v2)/(norm(v1)*norm(v2))  # return cosine similarity
 
 
 def fetch_memories(vector, logs, count):
+    # the winners are copied with their score, so concurrent scans never overwrite each other's scores
     scores = list()
     for i in logs:
         if vector == i['vector']:
             # skip this one because it is the same message
             continue
-        score = similarity(i['vector'], vector)
-        i['score'] = score
-        scores.append(i)
-    ordered = sorted(scores, key=lambda d: d['score'], reverse=True)
-    try:
-        ordered = ordered[0:count]
-        return ordered
-    except:
-        return ordered
+        scores.append((similarity(i['vector'], vector), i))
+    ordered = sorted(scores, key=lambda d: d[0], reverse=True)[0:count]
+    return [dict(i, score=score) for score, i in ordered]
 
 
 def add_notes(notes):
@@ -119,14 +179,390 @@ def load_memory():
     return result
 
 
+def chat_log_files():
+    return [i for i in os.listdir('./src/chat_logs') if '.json' in i]  # filter out any non-JSON files
+
+
+def read_chat_logs(files):
+    # returns [(file, record)]; touches no module state, so it can run in the process pool
+    return [(file, load_json('./src/chat_logs/%s' % file)) for file in files]
+
+
+def index_chat_logs(pairs):
+    # builds the hot indexes from read_chat_logs() output aside, then swaps them in unless another caller got there first
+    global convo_index, local_index, metadata_index
+    if convo_index is not None:
+        return convo_index
+    ordered = sorted((data for file, data in pairs), key=lambda d: d['timestamp'])  # sort them all chronologically
+    local, metadata = LocalIndex(), MetadataIndex()
+    for i in ordered:
+        local.add(i['uuid'], record_text(i))
+        metadata.add(i)
+    with index_lock:  # held only for the swap, so save_chat_log() on the event loop never waits on a build
+        if convo_index is None:
+            convo_files.update((data['uuid'], file) for file, data in pairs)
+            local_index, metadata_index = local, metadata
+            convo_index = {i['uuid']: i for i in ordered}
+            refresh_convo_index()  # chat logs saved while the build was running
+    return convo_index
+
+
+def load_convo_index():
+    if convo_index is None:
+        with load_lock:
+            if convo_index is None:
+                index_chat_logs(read_chat_logs(chat_log_files()))
+    return convo_index
+
+
+async def preload_convo_index(chunk=PRELOAD_CHUNK):
+    """
+    Warms the notes and hot indexes off the event loop while the gateway connects. The notes index is
+    small and consulted by every lookup, so it loads first; chat logs are then parsed in the process pool
+    and indexed in a thread. Until both are loaded memory_ready() is False and replies are
+    answered from recent channel history alone. A failed warm-up falls back to loading on first use.
+    """
+    global index_state
+    if convo_index is not None and notes_index is not None:
+        index_state = "ready"
+        return convo_index
+    index_state = "warming"
+    try:
+        with span("memory.preload"):
+            if notes_index is None:
+                notes = await executors.run("io", load_memory)
+                if notes_index is None:
+                    set_notes_index(notes)
+            files = chat_log_files()
+            parts = [files[start:start + chunk] for start in range(0, len(files), chunk)]
+            index_progress[:] = [0, len(files)]
+
+            async def read(part):
+                pairs = await executors.run("json", read_chat_logs, part, size=len(part) * CHAT_LOG_BYTES)
+                index_progress[0] += len(part)
+                return pairs
+
+            results = await asyncio.gather(*(read(part) for part in parts))
+            pairs = [pair for result in results for pair in result]
+            await executors.run("scan", index_chat_logs, pairs, size=len(pairs))
+    except Exception as e:
+        index_state = "failed"
+        print(f"Memory index preload failed, loading it on first use instead: {e}")
+        return None
+    index_state = "ready"
+    print(f"Loaded {len(pairs)} chat logs into the memory index")
+    return convo_index
+
+
+def start_preload(loop=None):
+    global preload_task
+    if preload_task is None or (preload_task.done() and index_state == "failed"):
+        loop = loop or asyncio.get_running_loop()
+        preload_task = loop.create_task(preload_convo_index())
+    return preload_task
+
+
+def memory_ready():
+    # False only while a warm-up is running; cold and failed indexes are loaded on first use instead
+    return index_state != "warming"
+
+
+def memory_report():
+    if index_state == "warming":
+        return f"warming, {index_progress[0]} of {index_progress[1]} chat logs parsed"
+    size = len(convo_index) if convo_index is not None else 0
+    return f"{index_state}, {size} chat logs indexed"
+
+
+def indexed(uuid):
+    # whether a record is in the hot index; while the index is warming nothing is, so callers check again later
+    if memory_ready():
+        load_convo_index()
+    with index_lock:
+        return convo_index is not None and uuid in convo_index
+
+
+def hot_index_size():
+    return len(convo_index) if convo_index is not None else len(chat_log_files())
+
+
+def load_notes_index():
+    if notes_index is None:
+        set_notes_index(load_memory())
+    return notes_index
+
+
+def set_notes_index(notes):
+    # the covered uuids are only rebuilt here, save_notes() adds to them as blocks are written
+    global notes_index, notes_covered
+    covered = set()
+    for note in notes:
+        covered.update(note['uuids'])
+    with index_lock:
+        notes_index, notes_covered = notes, covered
+
+
+def save_chat_log(filename, info):
+    save_json('./src/chat_logs/%s.json' % filename, info)
+    with index_lock:
+        if convo_index is not None:
+            convo_index[info['uuid']] = info
+            convo_files[info['uuid']] = '%s.json' % filename
+            local_index.add(info['uuid'], record_text(info))
+            metadata_index.add(info)
+    return info
+
+
+def refresh_indexes():
+    # pick up chat logs and notes that other processes sharing ./src have written or compacted away
+    refresh_manifest()
+    with index_lock:
+        refresh_convo_index()
+    if notes_index is not None and len([i for i in os.listdir('./src/notes') if '.json' in i]) != len(notes_index):
+        set_notes_index(load_memory())
+
+
+def refresh_convo_index():
+    if convo_index is not None:
+        files = set(chat_log_files())
+        known = {file: uuid for uuid, file in convo_files.items()}
+        removed = [known[file] for file in set(known) - files]
+        for uuid in removed:
+            convo_index.pop(uuid, None)
+            convo_files.pop(uuid, None)
+        local_index.remove(removed)
+        metadata_index.remove(removed)
+        added = list()
+        for file in files - set(known):
+            try:
+                data = load_json('./src/chat_logs/%s' % file)
+            except (FileNotFoundError, ValueError):
+                continue  # compacted away or still being written, seen on a later refresh
+            convo_files[data['uuid']] = file
+            added.append(data)
+        for data in sorted(added, key=lambda d: d['timestamp']):
+            convo_index[data['uuid']] = data
+            local_index.add(data['uuid'], record_text(data))
+            metadata_index.add(data)
+
+
+def save_notes(filename, info):
+    save_json('./src/notes/%s.json' % filename, info)
+    if notes_index is not None:
+        with index_lock:
+            notes_index.append(info)
+            notes_covered.update(info['uuids'])
+    return info
+
+
+def prefilter_logs(logs, text):
+    # narrow a large hot scan down to the records the local index ranks highest for the text
+    if text is None or len(logs) <= LOCAL_PREFILTER_MIN:
+        return logs
+    index = load_convo_index()
+    with index_lock:
+        ranked = local_index.search(text, LOCAL_PREFILTER_COUNT, [i['uuid'] for i in logs])
+        return [index[uuid] for uuid, score in ranked if uuid in index]
+
+
+def fetch_notes_first(vector, count, notes_count=NOTES_SEARCH_COUNT, text=None):
+    # coarse-to-fine retrieval: search the small notes index first, then only the chat logs the best notes cover
+    # returns (note, memories); note is set when an existing note block already covers the query well
+    logs = load_convo_index()
+    notes = load_notes_index()
+    with index_lock:
+        hot = list(logs.values())  # snapshot, the loop keeps adding records while this runs in a thread
+    if not notes:
+        hot = prefilter_logs(hot, text)
+        return None, fetch_memories(vector, hot + search_segments(vector, count), count)
+    best = fetch_memories(vector, notes, notes_count)
+    if best and best[0]['score'] >= NOTES_REUSE_THRESHOLD:
+        return best[0], list()
+    covered = notes_covered
+    uuids = set()
+    for note in best:
+        uuids.update(note['uuids'])
+    with index_lock:
+        candidates = [logs[i] for i in uuids if i in logs]
+        missing = [i for i in uuids if i not in logs]
+    if missing:
+        times = [t for note in best for t in note['times']]
+        candidates += lookup_segments(missing, times)
+    uncovered = [i for i in hot if i['uuid'] not in covered]  # logs are kept in chronological order
+    candidates += uncovered[-RECENT_UNCOVERED_COUNT:]
+    candidates += search_segments(vector, count)
+    return None, fetch_memories(vector, candidates, count)
+
+
+def fetch_filtered_memories(vector, count, where):
+    # scoped retrieval: the metadata indexes pick the matching records before any vector is scored
+    logs = load_convo_index()
+    with index_lock:
+        hot = [logs[i] for i in metadata_index.select(where) if i in logs]
+    return fetch_memories(vector, hot + search_segments(vector, count, where=where), count)
+
+
+def fetch_local_memories(text, count):
+    # fallback retrieval over the hot index when no API vector is available for the query
+    index = load_convo_index()
+    with index_lock:
+        return [dict(index[uuid], score=score) for uuid, score in local_index.search(text, count) if uuid in index]
+
+
+async def embed_with_deadline(message, deadline=EMBEDDING_DEADLINE):
+    # returns None instead of raising when the remote embedder fails or misses its deadline
+    try:
+        key = call_key('text-embedding-ada-002', message.content)
+        call = provider_calls.do(key, asyncio.to_thread, gpt3_embedding, message)
+        return await asyncio.wait_for(call, timeout=deadline)
+    except asyncio.TimeoutError:
+        print(f'Embedding missed its {deadline}s deadline! Falling back to local memories.')
+    except Exception as oops:
+        print('Error embedding message, falling back to local memories:', oops)
+    return None
+
+
+def dedupe_records(records, threshold=DEDUP_THRESHOLD):
+    # merge near-identical records from the same speaker into the earliest one, remembering the merged uuids
+    vectors = np.array([i['vector'] for i in records], dtype=np.float32)
+    vectors /= np.maximum(norm(vectors, axis=1, keepdims=True), 1e-12)
+    kept = list()
+    for n, record in enumerate(records):
+        if kept:
+            scores = vectors[kept] @ vectors[n]
+            best = int(np.argmax(scores))
+            target = records[kept[best]]
+            if scores[best] >= threshold and target['speaker'] == record['speaker']:
+                target.setdefault('merged', list()).append(record['uuid'])
+                continue
+        kept.append(n)
+    return [records[n] for n in kept]
+
+
+def write_cold_segments(records, covered=()):
+    # records a crashed compaction already wrote are skipped, their chat logs only still need removing
+    records = [dict(i) for i in records if i['uuid'] not in covered]
+    written = set()
+    for i in lookup_segments([i['uuid'] for i in records], [i['timestamp'] for i in records]):
+        written.add(i['uuid'])
+        written.update(i.get('merged', ()))
+    records = [i for i in records if i['uuid'] not in written]
+    entries = list()
+    for start in range(0, len(records), SEGMENT_SIZE):
+        block = records[start:start + SEGMENT_SIZE]
+        entries.append(write_segment(dedupe_records(block), block[0]['timestamp'], block[-1]['timestamp']))
+    return entries
+
+
+def remove_files(folder, files):
+    for file in files:
+        try:
+            os.remove(os.path.join(folder, file))
+        except FileNotFoundError:
+            pass
+
+
+def prune_memory_dumps(keep=MEMORY_DUMPS_KEEP):
+    files = sorted(i for i in os.listdir('./src/memories') if i.endswith('_gpt3.txt'))
+    remove_files('./src/memories', files[:-keep] if keep else files)
+
+
+def read_notes():
+    return [(file, load_json('./src/notes/%s' % file)) for file in os.listdir('./src/notes') if '.json' in file]
+
+
+def merge_notes(group):
+    # fold a chronological group of note blocks into one coarser block; uuids already compacted cold are dropped,
+    # those records stay reachable through the segment centroids
+    prompt = open_file('./src/prompt_notes.txt').replace('<<INPUT>>', '\n'.join(note['notes'] for note in group))
+    notes = gpt3_completion(prompt)
+    if notes.startswith('GPT3 error'):
+        raise RuntimeError(notes)
+    vectors = np.array([note['vector'] for note in group], dtype=np.float32)
+    vectors /= np.maximum(norm(vectors, axis=1, keepdims=True), 1e-12)
+    times = [t for note in group for t in note['times']]
+    with index_lock:
+        hot = convo_index or {}
+        uuids = [i for note in group for i in note['uuids'] if i in hot]
+    return {'notes': notes, 'uuids': uuids, 'times': [min(times), max(times)] if times else [], 'uuid': str(uuid4()),
+            'vector': vectors.mean(axis=0).tolist()}
+
+
+def compact_notes(limit=NOTES_HOT_MAX, group=NOTES_MERGE_GROUP):
+    # merge the oldest note blocks past the limit into coarser ones, so ./src/notes and notes_index stay bounded
+    pairs = sorted(read_notes(), key=lambda d: max(d[1]['times'], default=0))
+    excess = len(pairs) - limit
+    if excess <= 0:
+        return 0
+    oldest = pairs[:min(len(pairs), -(-excess * group // (group - 1)))]  # every group of n blocks becomes one
+    merged = 0
+    for start in range(0, len(oldest) - 1, group):
+        chunk = oldest[start:start + group]
+        save_json('./src/notes/notes_%s.json' % time(), merge_notes([note for file, note in chunk]))
+        remove_files('./src/notes', [file for file, note in chunk])
+        merged += len(chunk)
+    return merged
+
+
+async def compact_memories():
+    # move old chat logs out of the hot index into compressed cold segments, then delete their JSON files
+    logs = load_convo_index()
+    with index_lock:
+        logs = list(logs.values())
+    cutoff = time() - HOT_MAX_AGE_DAYS * 24 * 60 * 60
+    overflow = len(logs) - HOT_MAX_RECORDS
+    cold = [i for n, i in enumerate(logs) if n < overflow or i['timestamp'] < cutoff]
+    covered = set()
+    if COLD_REPLACE_WITH_NOTES:
+        load_notes_index()
+        covered = set(notes_covered)
+    if cold:
+        entries = await asyncio.to_thread(write_cold_segments, cold, covered)
+        files = list()
+        with index_lock:
+            for i in cold:
+                convo_index.pop(i['uuid'], None)
+                files.append(convo_files.pop(i['uuid'], None))
+            local_index.remove([i['uuid'] for i in cold])
+            metadata_index.remove([i['uuid'] for i in cold])
+        await asyncio.to_thread(remove_files, './src/chat_logs', [i for i in files if i])
+        print(f"Compacted {len(cold)} chat logs into {len(entries)} cold segments!")
+    merged = await asyncio.to_thread(compact_notes)
+    if merged:
+        set_notes_index(await asyncio.to_thread(load_memory))
+        print(f"Merged {merged} old note blocks into coarser ones!")
+    await asyncio.to_thread(prune_memory_dumps)
+    return len(cold)
+
+
+async def compaction_loop():
+    await start_preload()  # compaction reads the whole hot index, so it waits for the warm-up
+    while True:
+        try:
+            await compact_memories()
+        except Exception as oops:
+            print('Error compacting memories:', oops)
+        await asyncio.sleep(COMPACTION_INTERVAL)
+
+
+def start_compaction(loop=None):
+    global compaction_task
+    if compaction_task is None or compaction_task.done():
+        loop = loop or asyncio.get_running_loop()
+        compaction_task = loop.create_task(compaction_loop())
+    return compaction_task
+
+
 def gpt3_completion(prompt, engine='gpt-3.5-turbo', temp=0.0, top_p=1.0, tokens=600, freq_pen=0.0, pres_pen=0.0, stop=['USER:', 'Jarvis:']):
     max_retry = 5
     retry = 0
     prompt = prompt.encode(encoding='ASCII', errors='ignore').decode()
     while True:
         try:
-            response = client.chat.completions.create(model="gpt-3.5-turbo",
-                                                      messages=[{"role": "system", "content": prompt}])
+            with span('provider.summarize'), track_usage('openai', 'gpt-3.5-turbo', 'summarization') as usage:
+                response = providers.get('openai').chat.completions.create(model="gpt-3.5-turbo",
+                                                          messages=[{"role": "system", "content": prompt}])
+                usage.update(openai_usage(response), characters=len(prompt))
 
             text = response.choices[0].message.content.strip()
             text = re.sub('[\r\n]+', '\n', text)
@@ -142,21 +578,73 @@ def gpt3_completion(prompt, engine='gpt-3.5-turbo', temp=0.0, top_p=1.0, tokens=
             sleep(1)
 
 
-def summarize_memories(memories):  # summarize a block of memories into one payload
+def summarize_memories(memories, previous=None):  # fold a block of memories into the previous summary
     memories = sorted(memories, key=lambda d: d['timestamp'], reverse=False)  # sort them chronologically
     block = ''
-    identifiers = list()
-    timestamps = list()
     for mem in memories:
         block += mem['message'] + '\n\n'
-        identifiers.append(mem['uuid'])
-        timestamps.append(mem['timestamp'])
     block = block.strip()
-    prompt = open_file('./src/prompt_notes.txt').replace('<<INPUT>>', block)
-    notes = gpt3_completion(prompt)
-    # SAVE NOTES
-    vector = gpt3_memory_embedding(block)
-    info = {'notes': notes, 'uuids': identifiers, 'times': timestamps, 'uuid': str(uuid4()), 'vector': vector}
-    filename = 'notes_%s.json' % time()
-    save_json('./src/notes/%s' % filename, info)
-    return notes, vector
+    rolled = block if not previous else 'EARLIER NOTES:\n%s\n\nNEW MESSAGES:\n%s' % (previous, block)
+    prompt = open_file('./src/prompt_notes.txt').replace('<<INPUT>>', rolled)
+    return gpt3_completion(prompt)
+
+
+def save_summary_block(notes, covered):
+    # SAVE NOTES: the rolling summary as it stands once it covers a whole block of records
+    info = {'notes': notes, 'uuids': list(covered), 'times': sorted(covered.values()), 'uuid': str(uuid4()),
+            'vector': gpt3_memory_embedding(notes)}
+    filename = 'notes_%s' % time()
+    return save_notes(filename, info)
+
+
+def memories_to_text(memories):
+    memories = sorted(memories, key=lambda d: d['timestamp'], reverse=False)
+    return '\n'.join(mem['message'] for mem in memories)
+
+
+async def refresh_summary(channel_id, memories):
+    # the channel's summary is rewritten in place; a note block is only saved every SUMMARY_BLOCK_RECORDS new records
+    previous = channel_summaries.get(channel_id)
+    key = call_key('summarize', sorted(i['uuid'] for i in memories), previous)
+    with span('summarization'):
+        notes = await provider_calls.do(key, asyncio.to_thread, summarize_memories, memories, previous)
+    channel_summaries.pop(channel_id, None)  # keep the most recently summarized channels last
+    channel_summaries[channel_id] = notes
+    add_notes(notes)
+    block = summary_blocks.setdefault(channel_id, {})
+    block.update((i['uuid'], i['timestamp']) for i in memories if i['uuid'] not in notes_covered)
+    if len(block) >= SUMMARY_BLOCK_RECORDS:
+        del summary_blocks[channel_id]
+        await asyncio.to_thread(save_summary_block, notes, block)
+    return notes
+
+
+def schedule_summary(channel_id, memories):
+    # refresh the channel's rolling summary off the reply path; refreshes for a channel run in order so the newest wins
+    if not memories:
+        return None
+    previous = summary_tasks.get(channel_id)
+
+    async def run():
+        if previous is not None and not previous.done():
+            await asyncio.wait([previous])
+        try:
+            return await refresh_summary(channel_id, memories)
+        except Exception as oops:
+            print('Error refreshing summary:', oops)
+        finally:
+            if summary_tasks.get(channel_id) is task:
+                del summary_tasks[channel_id]
+
+    task = asyncio.get_running_loop().create_task(run())
+    summary_tasks[channel_id] = task
+    return task
+
+
+footprint.register("notes_history", lambda: notes_history, NOTES_HISTORY_LIMIT)
+footprint.register("channel_summaries", lambda: channel_summaries, CHANNEL_SUMMARIES_LIMIT)
+footprint.register("summary_blocks", lambda: summary_blocks, CHANNEL_SUMMARIES_LIMIT)
+footprint.register("convo_index", lambda: convo_index)
+footprint.register("local_index", lambda: local_index)
+footprint.register("metadata_index", lambda: metadata_index)
+footprint.register("notes_index", lambda: notes_index)
@@ -0,0 +1,118 @@
+"""
+Secondary indexes over chat log metadata, so scoped memory queries only score the records they match.
+Every hot record gets a row id; each speaker, channel and day bucket keeps a bitmap of its rows
+(a Python int used as a bitset), and a filter is answered by AND-ing the relevant bitmaps.
+"""
+from dataclasses import dataclass
+from typing import Optional
+import numpy as np
+
+TIME_BUCKET_SECONDS = 24 * 60 * 60
+
+
+@dataclass(frozen=True)
+class MemoryFilter:
+    speaker: Optional[str] = None
+    channel_id: Optional[int] = None
+    since: Optional[float] = None
+    until: Optional[float] = None
+
+    def matches(self, record):
+        if self.speaker is not None and record.get('speaker') != self.speaker:
+            return False
+        if self.channel_id is not None and record.get('channel_id') != self.channel_id:
+            return False
+        if self.since is not None and record['timestamp'] < self.since:
+            return False
+        if self.until is not None and record['timestamp'] > self.until:
+            return False
+        return True
+
+
+def bitmap_rows(bitmap):
+    if not bitmap:
+        return np.zeros(0, dtype=np.int64)
+    raw = np.frombuffer(bitmap.to_bytes((bitmap.bit_length() + 7) // 8, 'little'), dtype=np.uint8)
+    return np.flatnonzero(np.unpackbits(raw, bitorder='little'))
+
+
+class MetadataIndex:
+    def __init__(self):
+        self.uuids = list()  # row id -> uuid, None once removed
+        self.rows = {}  # uuid -> row id
+        self.timestamps = list()  # row id -> timestamp
+        self.alive = 0
+        self.speakers = {}  # speaker -> bitmap
+        self.channels = {}  # channel id -> bitmap
+        self.buckets = {}  # day bucket -> bitmap
+
+    def __len__(self):
+        return len(self.rows)
+
+    def add(self, record):
+        uuid = record['uuid']
+        if uuid in self.rows:
+            return
+        row = len(self.uuids)
+        bit = 1 << row
+        self.uuids.append(uuid)
+        self.timestamps.append(record['timestamp'])
+        self.rows[uuid] = row
+        self.alive |= bit
+        speaker = record.get('speaker')
+        self.speakers[speaker] = self.speakers.get(speaker, 0) | bit
+        channel = record.get('channel_id')
+        self.channels[channel] = self.channels.get(channel, 0) | bit
+        bucket = int(record['timestamp'] // TIME_BUCKET_SECONDS)
+        self.buckets[bucket] = self.buckets.get(bucket, 0) | bit
+
+    def remove(self, uuids):
+        for uuid in uuids:
+            row = self.rows.pop(uuid, None)
+            if row is not None:
+                self.uuids[row] = None
+                self.alive &= ~(1 << row)
+        if self.uuids and len(self.rows) * 2 < len(self.uuids):
+            self.rebuild()
+
+    def rebuild(self):
+        # reclaim the row ids of removed records by renumbering the survivors
+        survivors = [(uuid, row) for row, uuid in enumerate(self.uuids) if uuid is not None]
+        speakers = {row: key for key, bitmap in self.speakers.items() for row in bitmap_rows(bitmap & self.alive)}
+        channels = {row: key for key, bitmap in self.channels.items() for row in bitmap_rows(bitmap & self.alive)}
+        timestamps = self.timestamps
+        self.__init__()
+        for uuid, row in survivors:
+            self.add({'uuid': uuid, 'timestamp': timestamps[row], 'speaker': speakers.get(row), 'channel_id': channels.get(row)})
+
+    def time_bitmap(self, since, until):
+        first = int(since // TIME_BUCKET_SECONDS) if since is not None else None
+        last = int(until // TIME_BUCKET_SECONDS) if until is not None else None
+        bitmap = 0
+        for bucket, rows in self.buckets.items():
+            if (first is None or bucket >= first) and (last is None or bucket <= last):
+                bitmap |= rows
+        return bitmap
+
+    def select(self, where):
+        """
+        Finds the hot records matching a filter without touching any vectors.
+        Args:
+            where (MemoryFilter): The predicates to apply.
+        Returns:
+            list: The uuids of the matching records.
+        """
+        bitmap = self.alive
+        if where.speaker is not None:
+            bitmap &= self.speakers.get(where.speaker, 0)
+        if where.channel_id is not None:
+            bitmap &= self.channels.get(where.channel_id, 0)
+        if where.since is not None or where.until is not None:
+            bitmap &= self.time_bitmap(where.since, where.until)
+        result = list()
+        for row in bitmap_rows(bitmap):
+            # buckets are whole days, so rows in the edge buckets still need an exact check
+            timestamp = self.timestamps[row]
+            if (where.since is None or timestamp >= where.since) and (where.until is None or timestamp <= where.until):
+                result.append(self.uuids[row])
+        return result
@@ -0,0 +1,147 @@
+"""
+Lightweight latency instrumentation.
+Spans time a named stage and feed streaming histograms kept per stage and per guild, which report
+p50/p95/p99 as text for the owner's /latency command or in Prometheus format over a local endpoint.
+"""
+from contextlib import contextmanager
+from time import perf_counter
+import contextvars
+import math
+import os
+
+HISTOGRAM_MIN_SECONDS = 0.0001
+HISTOGRAM_GROWTH = 1.15  # each bucket is 15% wider than the last, so percentiles are within ~7%
+HISTOGRAM_BUCKETS = 120  # covers 0.1ms up to roughly half a day
+METRICS_HOST = "127.0.0.1"
+METRICS_PORT = int(os.environ.get("METRICS_PORT", "0"))  # 0 leaves the local endpoint off
+
+current_guild = contextvars.ContextVar("current_guild", default=None)  # guild label for spans in this task
+
+
+class Histogram:
+    """
+    A fixed-size log-bucketed histogram; memory use does not grow with the number of samples.
+    """
+
+    def __init__(self):
+        self.buckets = [0] * HISTOGRAM_BUCKETS
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, seconds):
+        index = 0
+        if seconds > HISTOGRAM_MIN_SECONDS:
+            index = min(int(math.log(seconds / HISTOGRAM_MIN_SECONDS, HISTOGRAM_GROWTH)) + 1, HISTOGRAM_BUCKETS - 1)
+        self.buckets[index] += 1
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+
+    def percentile(self, q):
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for index, count in enumerate(self.buckets):
+            seen += count
+            if seen >= rank:
+                return min(HISTOGRAM_MIN_SECONDS * HISTOGRAM_GROWTH ** max(index - 0.5, 0), self.max)
+        return self.max
+
+
+class Metrics:
+    def __init__(self):
+        self.histograms = {}  # (stage, guild) -> Histogram, guild None is the all-guilds total
+        self.gauges = {}  # name -> function returning its current value, e.g. a queue depth
+
+    def record(self, stage, seconds, guild=None):
+        if guild is None:
+            guild = current_guild.get()
+        keys = [(stage, None)] if guild is None else [(stage, None), (stage, str(guild))]
+        for key in keys:
+            if key not in self.histograms:
+                self.histograms[key] = Histogram()
+            self.histograms[key].add(seconds)
+
+    @contextmanager
+    def span(self, stage, guild=None):
+        """
+        Times the enclosed block, whether it finishes or raises, and records it under the stage name.
+        """
+        start = perf_counter()
+        try:
+            yield
+        finally:
+            self.record(stage, perf_counter() - start, guild)
+
+    def gauge(self, name, getter):
+        self.gauges[name] = getter
+
+    def rows(self, guild=None):
+        guild = None if guild is None else str(guild)
+        for (stage, label), histogram in sorted(self.histograms.items(), key=lambda i: (i[0][0], i[0][1] or "")):
+            if label == guild:
+                yield stage, histogram
+
+    def report(self, guild=None):
+        lines = ["stage                      count     p50ms     p95ms     p99ms     maxms"]
+        for stage, h in self.rows(guild):
+            lines.append(
+                f"{stage:<24} {h.count:>7} {h.percentile(0.5) * 1000:>9.1f} {h.percentile(0.95) * 1000:>9.1f} "
+                f"{h.percentile(0.99) * 1000:>9.1f} {h.max * 1000:>9.1f}"
+            )
+        if len(lines) == 1:
+            lines.append("(no samples yet)")
+        if guild is None:
+            for name, getter in sorted(self.gauges.items()):
+                lines.append(f"{name:<24} {getter():>7}")
+        return "\n".join(lines)
+
+    def prometheus(self):
+        lines = [
+            "# HELP glovedbot_stage_seconds Latency of bot pipeline stages and provider calls.",
+            "# TYPE glovedbot_stage_seconds summary",
+        ]
+        for (stage, guild), h in sorted(self.histograms.items(), key=lambda i: (i[0][0], i[0][1] or "")):
+            labels = f'stage="{stage}"' + ("" if guild is None else f',guild="{guild}"')
+            for q in (0.5, 0.95, 0.99):
+                lines.append(f'glovedbot_stage_seconds{{{labels},quantile="{q}"}} {h.percentile(q):.6f}')
+            lines.append(f"glovedbot_stage_seconds_sum{{{labels}}} {h.total:.6f}")
+            lines.append(f"glovedbot_stage_seconds_count{{{labels}}} {h.count}")
+        if self.gauges:
+            lines.append("# HELP glovedbot_gauge Current values such as executor queue depths.")
+            lines.append("# TYPE glovedbot_gauge gauge")
+            for name, getter in sorted(self.gauges.items()):
+                lines.append(f'glovedbot_gauge{{name="{name}"}} {getter()}')
+        return "\n".join(lines) + "\n"
+
+
+metrics = Metrics()
+span = metrics.span
+
+
+async def start_metrics_server(host=METRICS_HOST, port=METRICS_PORT):
+    """
+    Serves /metrics (Prometheus) and /latency (plain text) on a local port.
+    Returns:
+        The aiohttp runner, or None if no port is configured.
+    """
+    if not port:
+        return None
+    from aiohttp import web
+
+    async def prometheus(request):
+        return web.Response(text=metrics.prometheus(), content_type="text/plain")
+
+    async def latency(request):
+        return web.Response(text=metrics.report(request.query.get("guild")) + "\n", content_type="text/plain")
+
+    app = web.Application()
+    app.router.add_get("/metrics", prometheus)
+    app.router.add_get("/latency", latency)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    print(f"Metrics endpoint listening on http://{host}:{port}/metrics")
+    return runner
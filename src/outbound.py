@@ -0,0 +1,265 @@
+"""
+Prioritized, rate-budgeted outbound Discord REST calls.
+Every send, edit and delete made while answering a message goes through one scheduler with a token
+bucket per route (call kind and channel) and a global one. Calls are served by priority, so the reply's
+content goes out before new placeholder messages, and both go out before progress text. Pending edits
+to the same message collapse into the latest one, unless it is less urgent than the pending edit (progress
+text arriving after the final content), which is dropped instead. Progress and cosmetic calls are also
+dropped instead of waiting when their route is short of budget or when they have gone stale. While the
+gateway is down the scheduler is paused: calls keep queueing and go out once it is back, minus the ones
+gone stale.
+"""
+from time import perf_counter
+import asyncio
+import itertools
+import discord
+from src.metrics import metrics
+
+FINAL = 0  # the reply's content
+NEW = 1  # new messages such as the "Processing Message..." placeholder, and cleanup deletes
+PROGRESS = 2  # status text and streamed partial content, superseded by the next edit
+COSMETIC = 3  # decorations such as the "Response Finished!" flash
+PRIORITY_NAMES = {FINAL: "final", NEW: "new", PROGRESS: "progress", COSMETIC: "cosmetic"}
+PRIORITY_RESERVE = {FINAL: 0, NEW: 0, PROGRESS: 1, COSMETIC: 2}  # route tokens a call must leave for more urgent ones
+
+ROUTE_CAPACITY = 5  # Discord allows bursts of 5 message sends or edits per channel
+ROUTE_RATE = 1.0  # route tokens refilled per second, 5 per 5 seconds
+GLOBAL_CAPACITY = 50  # Discord's global limit is 50 requests per second
+GLOBAL_RATE = 50.0
+DROPPABLE_MAX_AGE = 3.0  # progress and cosmetic calls waiting longer than this are stale and dropped
+
+
+class TokenBucket:
+    def __init__(self, capacity, rate):
+        self.capacity = capacity
+        self.rate = rate
+        self.tokens = float(capacity)
+        self.updated = perf_counter()
+
+    def refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        return self.tokens
+
+    def wait_for(self, tokens):
+        # seconds until the bucket holds this many tokens
+        return max(0.0, (tokens - self.tokens) / self.rate)
+
+
+class Call:
+    def __init__(self, kind, route, target, priority, factory, seq, future):
+        self.kind = kind  # "send", "edit" or "delete"
+        self.route = route
+        self.target = target  # id of the message acted on, None for sends
+        self.priority = priority
+        self.factory = factory  # returns the coroutine doing the REST call
+        self.seq = seq
+        self.futures = [future]  # every caller collapsed into this call
+        self.submitted = perf_counter()
+        self.updated = self.submitted
+
+    @property
+    def droppable(self):
+        return self.priority >= PROGRESS
+
+
+class OutboundScheduler:
+    """
+    Queues Discord REST calls and runs them in priority order within per-route and global budgets.
+    Submitting returns a future right away: await it for the result, or leave progress calls unawaited.
+    Dropped and superseded calls resolve to None.
+    """
+
+    def __init__(self, route_capacity=ROUTE_CAPACITY, route_rate=ROUTE_RATE, global_capacity=GLOBAL_CAPACITY, global_rate=GLOBAL_RATE, max_age=DROPPABLE_MAX_AGE):
+        self.route_capacity = route_capacity
+        self.route_rate = route_rate
+        self.global_bucket = TokenBucket(global_capacity, global_rate)
+        self.max_age = max_age
+        self.buckets = {}  # route -> TokenBucket
+        self.queue = []  # calls waiting for budget
+        self.edits = {}  # message id -> its pending edit, for collapsing
+        self.inflight = set()  # message ids with a call running, so calls on one message never overtake each other
+        self.wakeup = asyncio.Event()
+        self.online = asyncio.Event()  # cleared while the gateway is down
+        self.online.set()
+        self.seq = itertools.count()
+        self.task = None
+        self.tasks = set()  # running flash() tasks
+        self.sent = {name: 0 for name in PRIORITY_NAMES.values()}
+        self.collapsed = 0
+        self.dropped = 0
+        self.rate_limited = 0
+        metrics.gauge("outbound.depth", lambda: len(self.queue))
+
+    def start(self, loop=None):
+        if self.task is None or self.task.done():
+            loop = loop or asyncio.get_running_loop()
+            self.task = loop.create_task(self.run())
+        return self.task
+
+    def set_online(self, online):
+        # a connection listener: pauses sending while the gateway is down, flushes the queue once it is back
+        if online:
+            self.online.set()
+            self.wakeup.set()
+        else:
+            self.online.clear()
+
+    def submit(self, kind, channel_id, target, priority, factory):
+        self.start()
+        future = asyncio.get_running_loop().create_future()
+        if kind == "edit" and target in self.edits:
+            call = self.edits[target]
+            self.collapsed += 1
+            if priority > call.priority:
+                future.set_result(None)  # never let progress text replace the pending final content
+                return future
+            call.factory = factory  # only the latest content is worth sending
+            call.priority = priority
+            call.updated = perf_counter()
+            call.futures.append(future)
+            return future
+        call = Call(kind, f"{kind}:{channel_id}", target, priority, factory, next(self.seq), future)
+        if kind == "edit":
+            self.edits[target] = call
+        elif kind == "delete" and target in self.edits:
+            pending = self.edits.pop(target)  # edits to a message about to be deleted are moot
+            self.queue.remove(pending)
+            self.finish(pending, None)
+            self.collapsed += 1
+        self.queue.append(call)
+        self.wakeup.set()
+        return future
+
+    def send(self, channel, content=None, priority=NEW, **kwargs):
+        return self.submit("send", channel.id, None, priority, lambda: channel.send(content, **kwargs))
+
+    def reply(self, message, content=None, priority=NEW, **kwargs):
+        return self.submit("send", message.channel.id, None, priority, lambda: message.reply(content, **kwargs))
+
+    def edit(self, message, content, priority=FINAL):
+        return self.submit("edit", message.channel.id, message.id, priority, lambda: message.edit(content=content))
+
+    def delete(self, message, priority=NEW):
+        return self.submit("delete", message.channel.id, message.id, priority, lambda: message.delete())
+
+    def flash(self, message, content, seconds, priority=COSMETIC):
+        # replies with short-lived status text in the background; skipped entirely when the budget is short
+        task = asyncio.get_running_loop().create_task(self.show_briefly(message, content, seconds, priority))
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+        return task
+
+    async def show_briefly(self, message, content, seconds, priority):
+        try:
+            sent = await self.reply(message, content, priority)
+            if sent is not None:
+                await asyncio.sleep(seconds)
+                await self.delete(sent)
+        except Exception as e:
+            print(f"Failed to show {content!r}: {e}")
+
+    def finish(self, call, result=None, error=None):
+        for future in call.futures:
+            if future.done():
+                continue
+            if error is None:
+                future.set_result(result)
+            else:
+                future.set_exception(error)
+                future.exception()  # collapsed callers often never await theirs; the ones that do still get the error
+
+    def drop(self, call):
+        self.queue.remove(call)
+        if self.edits.get(call.target) is call:
+            del self.edits[call.target]
+        self.dropped += 1
+        self.finish(call, None)
+
+    def bucket(self, route):
+        if route not in self.buckets:
+            self.buckets[route] = TokenBucket(self.route_capacity, self.route_rate)
+        return self.buckets[route]
+
+    def next_call(self):
+        """
+        Picks the most urgent call that has budget, dropping stale or unaffordable droppable calls.
+        Returns:
+            tuple: (call or None, seconds to wait before looking again when no call is ready)
+        """
+        now = perf_counter()
+        self.global_bucket.refill(now)
+        wait = None
+        urgent = set()  # routes with a more urgent call still waiting for budget
+        for call in sorted(self.queue, key=lambda i: (i.priority, i.seq)):
+            if call.target is not None and call.target in self.inflight:
+                continue
+            if call.droppable and now - call.updated > self.max_age:
+                self.drop(call)
+                continue
+            bucket = self.bucket(call.route)
+            bucket.refill(now)
+            needed = 1 + PRIORITY_RESERVE[call.priority]
+            if bucket.tokens >= needed and call.route not in urgent and self.global_bucket.tokens >= 1:
+                return call, 0.0
+            if call.droppable and (needed > bucket.capacity or call.route in urgent):
+                self.drop(call)  # progress text is not worth delaying real content for
+                continue
+            urgent.add(call.route)
+            seconds = max(bucket.wait_for(needed), self.global_bucket.wait_for(1))
+            wait = seconds if wait is None else min(wait, seconds)
+        return None, wait
+
+    async def run(self):
+        while True:
+            if not self.online.is_set():
+                await self.online.wait()
+            call, wait = self.next_call()
+            if call is None:
+                self.wakeup.clear()
+                try:
+                    await asyncio.wait_for(self.wakeup.wait(), wait)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            self.queue.remove(call)
+            if self.edits.get(call.target) is call:
+                del self.edits[call.target]
+            self.bucket(call.route).tokens -= 1
+            self.global_bucket.tokens -= 1
+            if call.target is not None:
+                self.inflight.add(call.target)
+            asyncio.get_running_loop().create_task(self.execute(call))
+
+    async def execute(self, call):
+        name = PRIORITY_NAMES[call.priority]
+        metrics.record(f"outbound.{name}.wait", perf_counter() - call.submitted)
+        start = perf_counter()
+        try:
+            result = await call.factory()
+        except discord.HTTPException as e:
+            if e.status == 429:
+                self.rate_limited += 1
+                self.bucket(call.route).tokens = 0  # our budget was off, back the route off for a while
+            if call.droppable:
+                print(f"Dropped {name} {call.kind} after an error: {e}")
+                self.finish(call, None)
+            else:
+                self.finish(call, error=e)
+        except Exception as e:
+            self.finish(call, error=e)
+        else:
+            self.sent[name] += 1
+            self.finish(call, result)
+        finally:
+            metrics.record(f"discord.{call.kind}", perf_counter() - start)
+            self.inflight.discard(call.target)
+            self.wakeup.set()
+
+    def report(self):
+        sent = ", ".join(f"{name}: {count}" for name, count in self.sent.items())
+        paused = "" if self.online.is_set() else ", paused"
+        return f"sent ({sent}), {self.collapsed} collapsed, {self.dropped} dropped, {self.rate_limited} rate limited, {len(self.queue)} queued{paused}"
+
+
+outbound = OutboundScheduler()
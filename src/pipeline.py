@@ -0,0 +1,120 @@
+"""
+A small stage graph for async work.
+Each stage declares the stages it depends on and starts as soon as they finish, so independent
+stages run concurrently. A stage can have its own timeout and a fallback that supplies its result
+when it fails or times out. Stages may also depend on inputs already in the context when it runs.
+A stage can end the run early, e.g. on a cache hit: the stages not finished by then are skipped and
+leave no result in the context.
+"""
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+import asyncio
+import logging
+from src.metrics import span
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(frozen=True)
+class Stage:
+    name: str
+    run: Callable[[Dict[str, Any]], Awaitable[Any]]
+    deps: Tuple[str, ...] = ()
+    timeout: Optional[float] = None
+    fallback: Optional[Callable[[Dict[str, Any], Exception], Any]] = None
+    stop: Optional[Callable[[Any], bool]] = None  # skips the unfinished stages when it returns True for the result
+
+
+class Pipeline:
+    """
+    Runs stages over a shared context dict; each stage's result is stored in the context under its name.
+    """
+
+    def __init__(self, stages: List[Stage], name: str = "pipeline", inputs: Tuple[str, ...] = ()):
+        self.name = name
+        self.inputs = inputs  # context keys filled in by the caller that stages may depend on
+        self.stages = self.order(stages, inputs)
+
+    @staticmethod
+    def order(stages: List[Stage], inputs: Tuple[str, ...] = ()) -> List[Stage]:
+        by_name = {stage.name: stage for stage in stages}
+        ordered, visiting, done = [], set(), set()
+
+        def visit(stage):
+            if stage.name in done:
+                return
+            if stage.name in visiting:
+                raise ValueError(f"Pipeline stage {stage.name} depends on itself")
+            visiting.add(stage.name)
+            for dep in stage.deps:
+                if dep in inputs:
+                    continue
+                if dep not in by_name:
+                    raise ValueError(f"Pipeline stage {stage.name} depends on unknown stage {dep}")
+                visit(by_name[dep])
+            visiting.discard(stage.name)
+            done.add(stage.name)
+            ordered.append(stage)
+
+        for stage in stages:
+            visit(stage)
+        return ordered
+
+    async def run_stage(self, stage: Stage, ctx: Dict[str, Any], tasks: Dict[str, asyncio.Task], stopped: asyncio.Future):
+        deps = [tasks[dep] for dep in stage.deps if dep not in self.inputs]
+        if deps:
+            await asyncio.gather(*deps)
+        try:
+            with span(f"{self.name}.{stage.name}"):
+                if stage.timeout is None:
+                    result = await stage.run(ctx)
+                else:
+                    result = await asyncio.wait_for(stage.run(ctx), timeout=stage.timeout)
+        except Exception as e:
+            if stage.fallback is None:
+                raise
+            logger.warning(f"Pipeline stage {stage.name} failed, using fallback: {e!r}")
+            result = stage.fallback(ctx, e)
+        ctx[stage.name] = result
+        if stage.stop is not None and stage.stop(result) and not stopped.done():
+            stopped.set_result(stage.name)
+        return result
+
+    async def run(self, ctx: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Runs every stage, each as soon as its dependencies are done.
+        Args:
+            ctx (dict): The inputs the stages read; stage results are added to it.
+        Returns:
+            dict: The same context, with every stage's result.
+        Raises:
+            Exception: The first error from a stage without a fallback; the remaining stages are cancelled.
+        """
+        with span(f"{self.name}.total"):
+            return await self.run_stages(ctx)
+
+    async def run_stages(self, ctx: Dict[str, Any]) -> Dict[str, Any]:
+        tasks: Dict[str, asyncio.Task] = {}
+        stopped = asyncio.get_running_loop().create_future()
+        for stage in self.stages:
+            tasks[stage.name] = asyncio.ensure_future(self.run_stage(stage, ctx, tasks, stopped))
+        finished = asyncio.gather(*tasks.values())
+        try:
+            await asyncio.wait([finished, stopped], return_when=asyncio.FIRST_COMPLETED)
+            if finished.done():
+                finished.result()  # raises the first error from a stage without a fallback
+        except BaseException:
+            await self.cancel(tasks, finished)
+            raise
+        if not finished.done():
+            logger.info(f"Pipeline stopped early by stage {stopped.result()}")
+            await self.cancel(tasks, finished)
+        return ctx
+
+    @staticmethod
+    async def cancel(tasks: Dict[str, asyncio.Task], finished: asyncio.Future):
+        for task in tasks.values():
+            task.cancel()
+        await asyncio.gather(*tasks.values(), return_exceptions=True)
+        if finished.done() and not finished.cancelled():
+            finished.exception()  # retrieved, so asyncio does not log it as never retrieved
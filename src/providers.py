@@ -0,0 +1,117 @@
+"""
+Lazily built provider clients.
+Provider SDKs are imported and their clients constructed on first use, and only for the providers
+listed in ENABLED_PROVIDERS, so startup does not pay for SDKs the bot is not using.
+"""
+from time import perf_counter
+import threading
+from src.constants import (
+    ENABLED_PROVIDERS,
+    GOOGLE_AI_ENDPOINT,
+    GOOGLE_AI_KEY,
+    OPENAI_API_KEY,
+    ELEVENLABS_API_KEY,
+    MISTRAL_API_KEY,
+    MISTRAL_ENDPOINT,
+    text_generation_config,
+    image_generation_config,
+    safety_settings,
+)
+
+
+class ProviderDisabled(RuntimeError):
+    pass
+
+
+def require_key(name, value):
+    if not value:
+        raise ProviderDisabled(f"{name} is not set")
+    return value
+
+
+def build_openai():
+    from openai import OpenAI
+    return OpenAI(api_key=require_key("OPENAI_API_KEY", OPENAI_API_KEY))
+
+
+def build_genai():
+    import google.generativeai as genai
+    if GOOGLE_AI_ENDPOINT:
+        genai.configure(api_key=require_key("GOOGLE_AI_KEY", GOOGLE_AI_KEY), transport="rest", client_options={"api_endpoint": GOOGLE_AI_ENDPOINT})
+    else:
+        genai.configure(api_key=require_key("GOOGLE_AI_KEY", GOOGLE_AI_KEY))
+    return genai
+
+
+def build_gemini_text():
+    genai = providers.get("genai")
+    return genai.GenerativeModel(model_name="gemini-pro", generation_config=text_generation_config, safety_settings=safety_settings)
+
+
+def build_gemini_image():
+    genai = providers.get("genai")
+    return genai.GenerativeModel(model_name="gemini-pro-vision", generation_config=image_generation_config, safety_settings=safety_settings)
+
+
+def build_mistral():
+    from mistralai.client import MistralClient
+    return MistralClient(api_key=require_key("MISTRAL_API_KEY", MISTRAL_API_KEY), endpoint=MISTRAL_ENDPOINT)
+
+
+def build_elevenlabs():
+    import elevenlabs
+    elevenlabs.set_api_key(require_key("ELEVENLABS_API_KEY", ELEVENLABS_API_KEY))
+    return elevenlabs
+
+
+PROVIDER_REGISTRY = {  # client name -> (provider it belongs to in ENABLED_PROVIDERS, factory)
+    "openai": ("openai", build_openai),
+    "genai": ("google", build_genai),
+    "gemini_text": ("google", build_gemini_text),
+    "gemini_image": ("google", build_gemini_image),
+    "mistral": ("mistral", build_mistral),
+    "elevenlabs": ("elevenlabs", build_elevenlabs),
+}
+
+
+class Providers:
+    def __init__(self, enabled=ENABLED_PROVIDERS):
+        self.enabled = set(enabled)
+        self.clients = {}  # client name -> built client
+        self.load_seconds = {}  # client name -> seconds its import and construction took
+        self.lock = threading.RLock()  # clients are first used from worker threads too; factories may nest
+
+    def get(self, name):
+        """
+        Returns a provider client, importing its SDK and building it on first use.
+        Raises:
+            ProviderDisabled: The provider is not enabled or its API key is missing.
+        """
+        client = self.clients.get(name)
+        if client is not None:
+            return client
+        provider, build = PROVIDER_REGISTRY[name]
+        if provider not in self.enabled:
+            raise ProviderDisabled(f"The {provider} provider is not in ENABLED_PROVIDERS")
+        with self.lock:
+            if name not in self.clients:
+                start = perf_counter()
+                self.clients[name] = build()
+                self.load_seconds[name] = perf_counter() - start
+                print(f"Loaded {name} client in {self.load_seconds[name] * 1000:.0f}ms")
+        return self.clients[name]
+
+    def is_enabled(self, provider):
+        return provider in self.enabled
+
+    def install(self, name, client):
+        # use an already built client, e.g. a stand-in for benchmarks
+        with self.lock:
+            self.clients[name] = client
+
+    def report(self):
+        loaded = ", ".join(f"{name} {seconds * 1000:.0f}ms" for name, seconds in self.load_seconds.items())
+        return f"enabled: {', '.join(sorted(self.enabled))}; loaded: {loaded or 'none yet'}"
+
+
+providers = Providers()
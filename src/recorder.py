@@ -0,0 +1,111 @@
+"""
+Opt-in traffic recorder.
+Writes scrubbed inbound message events (timing, guild/channel/thread ids, content length, attachments),
+every provider call with its timing and size, and each reply's outcome as rotating JSONL files, which
+benchmarks/replay.py re-drives against the bot. Message text, replies and user ids are never written;
+authors are kept only as salted hashes so bursts from one user still show up.
+"""
+from time import time
+import hashlib
+import json
+import os
+import threading
+from src.usage import usage_ledger
+
+RECORDING_DIR = "./src/recordings"
+RECORDING_MAX_BYTES = 32 * 1024 * 1024  # start a new file past this size
+RECORDING_KEEP = 20  # newest recording files kept
+RECORDING_ENABLED = os.environ.get("TRAFFIC_RECORDING", "") == "1"
+
+
+class TrafficRecorder:
+    def __init__(self, enabled=RECORDING_ENABLED, folder=RECORDING_DIR, max_bytes=RECORDING_MAX_BYTES, keep=RECORDING_KEEP):
+        self.enabled = enabled
+        self.folder = folder
+        self.max_bytes = max_bytes
+        self.keep = keep
+        self.salt = os.urandom(16).hex()  # per process, so hashed authors cannot be joined across recordings
+        self.file = None
+        self.written = 0
+        self.events = 0
+        self.lock = threading.Lock()  # provider calls are recorded from worker threads too
+
+    def scrub(self, value):
+        return hashlib.sha256(f"{self.salt}:{value}".encode("utf-8")).hexdigest()[:16]
+
+    def open(self):
+        os.makedirs(self.folder, exist_ok=True)
+        path = os.path.join(self.folder, f"traffic_{time():.3f}.jsonl")
+        self.file = open(path, "a", encoding="utf-8")
+        self.written = 0
+        files = sorted(i for i in os.listdir(self.folder) if i.startswith("traffic_") and i.endswith(".jsonl"))
+        for old in files[:-self.keep]:
+            os.remove(os.path.join(self.folder, old))
+        print(f"Recording traffic to {path}")
+
+    def record(self, kind, **fields):
+        if not self.enabled:
+            return
+        line = json.dumps(dict(kind=kind, time=time(), **fields)) + "\n"
+        with self.lock:
+            if self.file is None or self.written >= self.max_bytes:
+                self.close_file()
+                self.open()
+            self.file.write(line)
+            self.written += len(line)
+            self.events += 1
+
+    def record_message(self, message):
+        channel = message.channel
+        parent = getattr(channel, "parent", None)
+        self.record(
+            "message",
+            message_id=str(message.id),
+            guild_id=message.guild.id if message.guild is not None else None,
+            channel_id=channel.id,
+            channel_type=str(getattr(channel, "type", "")),
+            parent_id=parent.id if parent is not None else None,
+            author=self.scrub(message.author.id),
+            content_length=len(message.content),
+            is_reply=message.reference is not None,
+            attachments=[{"ext": os.path.splitext(i.filename)[1].lower(), "size": i.size} for i in message.attachments],
+        )
+
+    def record_provider(self, provider, model, stage, seconds, tags, prompt_tokens, completion_tokens, characters, error):
+        self.record(
+            "provider",
+            message_id=tags.get("message"),
+            provider=provider,
+            model=model,
+            stage=stage,
+            seconds=seconds,
+            prompt_tokens=prompt_tokens,
+            completion_tokens=completion_tokens,
+            characters=characters,
+            error=error,
+        )
+
+    def record_reply(self, message_id, characters, seconds, cached=False, error=False):
+        self.record("reply", message_id=message_id, characters=characters, seconds=seconds, cached=cached, error=error)
+
+    def start(self):
+        self.enabled = True
+
+    def stop(self):
+        self.enabled = False
+        with self.lock:
+            self.close_file()
+
+    def close_file(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+    def flush(self):
+        with self.lock:
+            if self.file is not None:
+                self.file.flush()
+
+
+traffic_recorder = TrafficRecorder()
+usage_ledger.listeners.append(traffic_recorder.record_provider)
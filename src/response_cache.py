@@ -0,0 +1,99 @@
+"""
+An opt-in semantic cache of bot replies.
+Entries are keyed by the query embedding plus a hash of the static prompt prefix, and a new message
+reuses a stored reply when it is similar enough, recent enough and asked in the same namespace.
+"""
+from collections import defaultdict
+from time import time
+from numpy.linalg import norm
+import numpy as np
+import hashlib
+
+CACHE_SIMILARITY_THRESHOLD = 0.97
+CACHE_TTL_SECONDS = 10 * 60
+CACHE_MAX_ENTRIES = 256  # per namespace, the oldest are evicted first
+
+
+def prefix_hash(*parts):
+    return hashlib.sha256("\n".join(str(i) for i in parts).encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    def __init__(self, threshold=CACHE_SIMILARITY_THRESHOLD, ttl=CACHE_TTL_SECONDS, max_entries=CACHE_MAX_ENTRIES):
+        self.threshold = threshold
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.entries = {}  # namespace -> [(created, prefix, vector, reply)]
+        self.counts = defaultdict(lambda: {"hits": 0, "misses": 0, "stores": 0})  # namespace -> counters
+
+    def expire(self, namespace):
+        cutoff = time() - self.ttl
+        entries = [i for i in self.entries.get(namespace, []) if i[0] >= cutoff]
+        if entries:
+            self.entries[namespace] = entries
+        else:
+            self.entries.pop(namespace, None)
+        return entries
+
+    def lookup(self, namespace, prefix, vector):
+        """
+        Finds a stored reply for a near-duplicate query.
+        Args:
+            namespace: Where the reply may be reused, e.g. a channel id.
+            prefix (str): Hash of the static prompt prefix the reply was generated with.
+            vector (list): The query embedding.
+        Returns:
+            str: The cached reply, or None on a miss.
+        """
+        entries = [i for i in self.expire(namespace) if i[1] == prefix]
+        if entries:
+            query = np.asarray(vector, dtype=np.float32)
+            query = query / max(norm(query), 1e-12)
+            scores = np.array([i[2] for i in entries]) @ query
+            best = int(np.argmax(scores))
+            if scores[best] >= self.threshold:
+                self.counts[namespace]["hits"] += 1
+                return entries[best][3]
+        self.counts[namespace]["misses"] += 1
+        return None
+
+    def store(self, namespace, prefix, vector, reply):
+        if not reply or reply.isspace():
+            return
+        vector = np.asarray(vector, dtype=np.float32)
+        vector = vector / max(norm(vector), 1e-12)
+        entries = self.expire(namespace)
+        entries.append((time(), prefix, vector, reply))
+        self.entries[namespace] = entries[-self.max_entries:]
+        self.counts[namespace]["stores"] += 1
+
+    def discard_prefixes(self, prefixes):
+        # drops replies generated under prompt prefixes that can no longer be looked up
+        for namespace in list(self.entries):
+            entries = [i for i in self.entries[namespace] if i[1] not in prefixes]
+            if entries:
+                self.entries[namespace] = entries
+            else:
+                del self.entries[namespace]
+
+    def clear(self, namespace=None):
+        if namespace is None:
+            self.entries.clear()
+        else:
+            self.entries.pop(namespace, None)
+
+    def stats(self, namespace=None):
+        """
+        Args:
+            namespace: The namespace to report on, None for totals over all of them.
+        """
+        if namespace is None:
+            counts = {key: sum(i[key] for i in self.counts.values()) for key in ("hits", "misses", "stores")}
+            entries = sum(len(i) for i in self.entries.values())
+        else:
+            counts = dict(self.counts.get(namespace, {"hits": 0, "misses": 0, "stores": 0}))
+            entries = len(self.entries.get(namespace, []))
+        lookups = counts["hits"] + counts["misses"]
+        return dict(counts, hit_rate=counts["hits"] / lookups if lookups else 0.0, entries=entries)
+
+response_cache = ResponseCache()
@@ -0,0 +1,176 @@
+"""
+Cold memory segments: compressed, read-only blocks of old chat logs.
+Each segment stores its vectors as a float16 matrix next to its records, and the manifest keeps
+one centroid per segment so a query only opens the few segments closest to it, and a small bloom
+filter of its uuids so a uuid lookup only opens the segments that may hold it.
+"""
+from functools import lru_cache
+from numpy.linalg import norm
+import numpy as np
+import base64
+import hashlib
+import json
+import os
+
+SEGMENTS_DIR = './src/segments'
+MANIFEST_FILE = os.path.join(SEGMENTS_DIR, 'manifest.json')
+COLD_SEARCH_SEGMENTS = 3  # segments opened per query, picked by centroid similarity
+COLD_CACHE_SEGMENTS = 8  # decoded segments kept in RAM
+UUID_FILTER_BITS = 10  # bloom filter bits per uuid, about 1% of lookups open a segment for nothing
+UUID_FILTER_HASHES = 7
+
+manifest = None  # list of {'file', 'count', 'start', 'end', 'centroid', 'uuids'}, loaded lazily by load_manifest()
+manifest_mtime = None  # modification time of the manifest file when it was loaded or saved
+
+
+def manifest_file_mtime():
+    return os.path.getmtime(MANIFEST_FILE) if os.path.exists(MANIFEST_FILE) else None
+
+
+def load_manifest():
+    global manifest, manifest_mtime
+    if manifest is None:
+        manifest_mtime = manifest_file_mtime()
+        if manifest_mtime is not None:
+            with open(MANIFEST_FILE, 'r', encoding='utf-8') as infile:
+                manifest = json.load(infile)
+        else:
+            manifest = list()
+    return manifest
+
+
+def refresh_manifest():
+    # drop the loaded manifest when another process has written segments since
+    global manifest
+    if manifest is not None and manifest_file_mtime() != manifest_mtime:
+        manifest = None
+
+
+def save_manifest(entries):
+    global manifest, manifest_mtime
+    os.makedirs(SEGMENTS_DIR, exist_ok=True)
+    temp = MANIFEST_FILE + '.tmp'
+    with open(temp, 'w', encoding='utf-8') as outfile:
+        json.dump(entries, outfile)
+    os.replace(temp, MANIFEST_FILE)
+    manifest = entries
+    manifest_mtime = manifest_file_mtime()
+
+
+def filter_bits(uuid, size):
+    digest = hashlib.sha256(uuid.encode('utf-8')).digest()
+    return [int.from_bytes(digest[i * 4:i * 4 + 4], 'little') % size for i in range(UUID_FILTER_HASHES)]
+
+
+def uuid_filter(uuids):
+    size = max(len(uuids) * UUID_FILTER_BITS, 64)
+    bits = bytearray(size // 8 + 1)
+    for uuid in uuids:
+        for bit in filter_bits(uuid, size):
+            bits[bit // 8] |= 1 << (bit % 8)
+    return {'size': size, 'bits': base64.b64encode(bytes(bits)).decode('ascii')}
+
+
+def may_hold(entry, uuids):
+    # segments written before the filters existed have none and are always opened
+    if 'uuids' not in entry:
+        return list(uuids)
+    size, bits = entry['uuids']['size'], base64.b64decode(entry['uuids']['bits'])
+    return [i for i in uuids if all(bits[bit // 8] >> (bit % 8) & 1 for bit in filter_bits(i, size))]
+
+
+def write_segment(records, start=None, end=None):
+    # records must be in chronological order and carry a 'vector'; start/end cover any records merged away
+    os.makedirs(SEGMENTS_DIR, exist_ok=True)
+    vectors = np.array([i['vector'] for i in records], dtype=np.float32)
+    meta = [{k: v for k, v in i.items() if k not in ('vector', 'score')} for i in records]
+    start = records[0]['timestamp'] if start is None else start
+    end = records[-1]['timestamp'] if end is None else end
+    filename = 'segment_%s_%s.npz' % (start, end)
+    path = os.path.join(SEGMENTS_DIR, filename)
+    temp = path + '.tmp'
+    with open(temp, 'wb') as outfile:
+        np.savez_compressed(outfile, vectors=vectors.astype(np.float16),
+                            meta=np.frombuffer(json.dumps(meta, ensure_ascii=False).encode('utf-8'), dtype=np.uint8))
+    os.replace(temp, path)
+    centroid = vectors.mean(axis=0)
+    uuids = [uuid for i in records for uuid in [i['uuid']] + i.get('merged', [])]
+    entry = {'file': filename, 'count': len(records), 'start': start, 'end': end, 'centroid': centroid.tolist(), 'uuids': uuid_filter(uuids)}
+    # a segment rewritten under the same name replaces its old entry instead of being listed twice
+    save_manifest([i for i in load_manifest() if i['file'] != filename] + [entry])
+    load_segment.cache_clear()
+    return entry
+
+
+@lru_cache(maxsize=COLD_CACHE_SEGMENTS)
+def load_segment(filename):
+    with np.load(os.path.join(SEGMENTS_DIR, filename), allow_pickle=False) as data:
+        vectors = data['vectors'].astype(np.float32)
+        meta = json.loads(data['meta'].tobytes().decode('utf-8'))
+    vectors /= np.maximum(norm(vectors, axis=1, keepdims=True), 1e-12)
+    return vectors, meta
+
+
+def nearest_segments(vector, count=COLD_SEARCH_SEGMENTS, where=None):
+    entries = load_manifest()
+    if where is not None:
+        entries = [i for i in entries if (where.since is None or i['end'] >= where.since) and (where.until is None or i['start'] <= where.until)]
+    if not entries:
+        return list()
+    centroids = np.array([i['centroid'] for i in entries], dtype=np.float32)
+    scores = centroids @ np.asarray(vector, dtype=np.float32) / np.maximum(norm(centroids, axis=1), 1e-12)
+    order = np.argsort(-scores)[:count]
+    return [entries[i] for i in order]
+
+
+def to_record(meta, row):
+    record = dict(meta)
+    record['vector'] = row.tolist()
+    return record
+
+
+def search_segments(vector, count, segments=COLD_SEARCH_SEGMENTS, where=None):
+    # returns the best cold records across the segments whose centroids are closest to the query
+    query = np.asarray(vector, dtype=np.float32)
+    query = query / max(norm(query), 1e-12)
+    hits = list()
+    for entry in nearest_segments(vector, segments, where):
+        vectors, meta = load_segment(entry['file'])
+        rows = np.arange(len(meta))
+        if where is not None:
+            rows = np.array([i for i, record in enumerate(meta) if where.matches(record)], dtype=np.int64)
+            if not len(rows):
+                continue
+        scores = vectors[rows] @ query
+        for i in np.argsort(-scores)[:count]:
+            record = to_record(meta[rows[i]], vectors[rows[i]])
+            record['score'] = float(scores[i])
+            hits.append(record)
+    return sorted(hits, key=lambda d: d['score'], reverse=True)[:count]
+
+
+def stored_uuids(uuids):
+    # which of the uuids are already in a cold segment, kept or merged into another record
+    found = set()
+    for entry in load_manifest():
+        candidates = set(may_hold(entry, uuids))
+        if not candidates:
+            continue
+        vectors, meta = load_segment(entry['file'])
+        for record in meta:
+            found.update(candidates.intersection([record['uuid']] + record.get('merged', [])))
+    return found
+
+
+def lookup_segments(uuids, times):
+    # fetch cold records by uuid, only opening segments whose time range covers one of the given timestamps
+    uuids = set(uuids)
+    result = list()
+    for entry in load_manifest():
+        if not any(entry['start'] <= t <= entry['end'] for t in times):
+            continue
+        vectors, meta = load_segment(entry['file'])
+        for i, record in enumerate(meta):
+            if record['uuid'] in uuids or uuids.intersection(record.get('merged', ())):
+                result.append(to_record(record, vectors[i]))
+    return result
@@ -0,0 +1,49 @@
+"""
+Single-flight deduplication of provider calls.
+Identical requests that overlap in time share one upstream call and its result or error.
+"""
+import asyncio
+import hashlib
+import json
+
+
+def call_key(model, *inputs):
+    # canonical hash of the model plus everything that shapes its output
+    payload = json.dumps([model, inputs], sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class SingleFlight:
+    def __init__(self):
+        self.calls = {}  # key -> task running the upstream call
+        self.started = 0
+        self.shared = 0
+
+    async def do(self, key, fn, *args, **kwargs):
+        """
+        Runs `fn(*args, **kwargs)` unless an identical call is already in flight, in which case its outcome is shared.
+        A caller being cancelled never cancels the upstream call the other callers are waiting on.
+        Args:
+            key (str): The call's canonical hash, see call_key().
+            fn: A coroutine function making the upstream call.
+        Returns:
+            The upstream call's result; its exception is raised to every caller.
+        """
+        task = self.calls.get(key)
+        if task is None:
+            task = asyncio.ensure_future(fn(*args, **kwargs))
+            self.calls[key] = task
+            self.started += 1
+            task.add_done_callback(lambda done: self.forget(key, done))
+        else:
+            self.shared += 1
+        return await asyncio.shield(task)
+
+    def forget(self, key, task):
+        if self.calls.get(key) is task:
+            del self.calls[key]
+        if not task.cancelled():
+            task.exception()  # mark the error as retrieved even if every caller went away
+
+
+provider_calls = SingleFlight()
@@ -0,0 +1,173 @@
+"""
+Token usage and cost accounting.
+Every provider call is recorded with its tokens, characters and latency and tagged with the guild,
+channel, user and pipeline stage it served. Usage is aggregated in memory, appended to a daily JSONL
+file in the background, and checked against per-guild request and token budgets before dispatch.
+"""
+from collections import defaultdict, deque
+from contextlib import contextmanager
+from datetime import date
+from time import time, perf_counter
+import asyncio
+import contextvars
+import json
+import os
+import threading
+
+USAGE_DIR = "./src/usage"
+USAGE_FLUSH_SECONDS = 60
+DEFAULT_REQUESTS_PER_MINUTE = None  # per guild, None for no limit
+DEFAULT_TOKENS_PER_DAY = None  # per guild, None for no limit
+
+usage_tags = contextvars.ContextVar("usage_tags", default={})  # guild/channel/user of the message being served
+
+COUNTERS = ("calls", "prompt_tokens", "completion_tokens", "characters", "seconds")
+
+
+def budget_key(guild_id, channel_id):
+    # DMs have no guild, so each DM channel gets its own budget and its usage is recorded under the same key
+    return str(guild_id) if guild_id is not None else f"dm:{channel_id}"
+
+
+def tag_usage(**tags):
+    usage_tags.set({k: (str(v) if v is not None else None) for k, v in tags.items()})
+
+
+def openai_usage(response):
+    usage = getattr(response, "usage", None)
+    if usage is None:
+        return {}
+    return {"prompt_tokens": usage.prompt_tokens or 0, "completion_tokens": getattr(usage, "completion_tokens", 0) or 0}
+
+
+class UsageLedger:
+    def __init__(self):
+        self.pending = defaultdict(lambda: dict.fromkeys(COUNTERS, 0))  # tags -> counters not yet flushed
+        self.totals = defaultdict(lambda: dict.fromkeys(COUNTERS, 0))  # (guild, stage) -> counters since start
+        self.day = None
+        self.day_tokens = defaultdict(int)  # guild -> tokens used today
+        self.requests = defaultdict(deque)  # guild -> dispatch times in the last minute
+        self.flush_task = None
+        self.lock = threading.Lock()  # provider calls are recorded from worker threads too
+        self.listeners = []  # called with every recorded provider call, e.g. by the traffic recorder
+        self.persist = True  # off in worker processes, which hand their usage to the gateway to record
+
+    def add(self, provider, model, stage, seconds, prompt_tokens=0, completion_tokens=0, characters=0, error=False):
+        tags = usage_tags.get()
+        guild = tags.get("guild")
+        key = (guild, tags.get("channel"), tags.get("user"), stage, provider, model)
+        values = {"calls": 1, "prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens, "characters": characters, "seconds": seconds}
+        if self.persist:
+            with self.lock:
+                for counters in (self.pending[key], self.totals[(guild, stage)]):
+                    for name, value in values.items():
+                        counters[name] += value
+                self.load_today()
+                self.day_tokens[guild] += prompt_tokens + completion_tokens
+        for listener in self.listeners:
+            listener(provider, model, stage, seconds, tags, prompt_tokens, completion_tokens, characters, error)
+
+    @contextmanager
+    def track(self, provider, model, stage):
+        """
+        Times a provider call and records it; fill in the yielded dict with tokens or characters.
+        """
+        usage = {}
+        start = perf_counter()
+        try:
+            yield usage
+        except Exception:
+            usage["error"] = True
+            raise
+        finally:
+            self.add(provider, model, stage, perf_counter() - start, **usage)
+
+    def load_today(self):
+        # rebuild today's per-guild token counts from the flushed file after a restart or at midnight
+        today = date.today().isoformat()
+        if self.day == today:
+            return
+        self.day = today
+        self.day_tokens = defaultdict(int)
+        path = os.path.join(USAGE_DIR, f"usage_{today}.jsonl")
+        if os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as infile:
+                for line in infile:
+                    row = json.loads(line)
+                    self.day_tokens[row["guild"]] += row["prompt_tokens"] + row["completion_tokens"]
+
+    def check_budget(self, guild_id, budget=None):
+        """
+        Checks a guild's budgets and, if there is room, counts one more request against them.
+        Args:
+            guild_id: The guild the request is for, or "dm:<channel id>" for DMs, so each DM has its own budget.
+            budget (dict): Optional "requests_per_minute" and "tokens_per_day" overrides for the guild.
+        Returns:
+            str: Why the request is refused, or None if it may be dispatched.
+        """
+        budget = budget or {}
+        guild = str(guild_id) if guild_id is not None else None
+        per_minute = budget.get("requests_per_minute", DEFAULT_REQUESTS_PER_MINUTE)
+        per_day = budget.get("tokens_per_day", DEFAULT_TOKENS_PER_DAY)
+        now = time()
+        recent = self.requests[guild]
+        while recent and recent[0] < now - 60:
+            recent.popleft()
+        if per_minute is not None and len(recent) >= per_minute:
+            return f"this server is limited to {per_minute} requests per minute"
+        self.load_today()
+        if per_day is not None and self.day_tokens[guild] >= per_day:
+            return f"this server has used its {per_day} tokens for today"
+        recent.append(now)
+        return None
+
+    def flush(self):
+        with self.lock:
+            if not self.pending:
+                return 0
+            pending, self.pending = self.pending, defaultdict(lambda: dict.fromkeys(COUNTERS, 0))
+        os.makedirs(USAGE_DIR, exist_ok=True)
+        path = os.path.join(USAGE_DIR, f"usage_{date.today().isoformat()}.jsonl")
+        now = time()
+        with open(path, "a", encoding="utf-8") as outfile:
+            for (guild, channel, user, stage, provider, model), counters in pending.items():
+                row = {"time": now, "guild": guild, "channel": channel, "user": user, "stage": stage, "provider": provider, "model": model}
+                row.update(counters)
+                outfile.write(json.dumps(row) + "\n")
+        return len(pending)
+
+    async def flush_loop(self):
+        while True:
+            await asyncio.sleep(USAGE_FLUSH_SECONDS)
+            try:
+                await asyncio.to_thread(self.flush)
+            except Exception as e:
+                print(f"Error flushing usage: {e}")
+
+    def start(self, loop=None):
+        if self.flush_task is None or self.flush_task.done():
+            loop = loop or asyncio.get_running_loop()
+            self.flush_task = loop.create_task(self.flush_loop())
+        return self.flush_task
+
+    def report(self, top=10):
+        by_guild = defaultdict(lambda: dict.fromkeys(COUNTERS, 0))
+        by_stage = defaultdict(lambda: dict.fromkeys(COUNTERS, 0))
+        for (guild, stage), counters in self.totals.items():
+            for name, value in counters.items():
+                by_guild[guild][name] += value
+                by_stage[stage][name] += value
+
+        def rows(title, groups):
+            lines = [f"{title:<24} {'calls':>7} {'tokens':>10} {'chars':>9} {'seconds':>9}"]
+            ranked = sorted(groups.items(), key=lambda i: i[1]["prompt_tokens"] + i[1]["completion_tokens"], reverse=True)
+            for name, c in ranked[:top]:
+                tokens = c["prompt_tokens"] + c["completion_tokens"]
+                lines.append(f"{str(name):<24} {c['calls']:>7} {tokens:>10} {c['characters']:>9} {c['seconds']:>9.1f}")
+            return lines
+
+        return "\n".join(rows("guild", by_guild) + [""] + rows("stage", by_stage))
+
+
+usage_ledger = UsageLedger()
+track_usage = usage_ledger.track
@@ -45,3 +45,34 @@ def is_last_message_stale(
 #         logger.info(f"Messages from {channel} not allowed")
 #         return True
 #     return False
+
+
+IMAGE_MAX_SIDE = 2048  # larger attachments are downscaled before they are sent to the vision model
+
+
+def shrink_image(data: bytes, max_side: int = IMAGE_MAX_SIDE) -> bytes:
+    """
+    Downscales an image to fit max_side and re-encodes it as JPEG, the type the vision request declares.
+    Runs in the process pool for large attachments, so Pillow is only imported where it is used.
+
+    Args:
+        data (bytes): The downloaded image.
+        max_side (int): The longest side allowed, in pixels.
+
+    Returns:
+        bytes: The re-encoded image, or the original bytes when it is small enough or cannot be read.
+    """
+    from io import BytesIO
+    from PIL import Image
+
+    try:
+        image = Image.open(BytesIO(data))
+        if max(image.size) <= max_side:
+            return data
+        image.thumbnail((max_side, max_side))
+        output = BytesIO()
+        image.convert("RGB").save(output, format="JPEG", quality=90)
+        return output.getvalue()
+    except Exception as e:
+        logger.warning(f"Could not downscale image: {e}")
+        return data
@@ -0,0 +1,381 @@
+"""
+Optional split deployment across processes.
+With WORKER_PROCESSES set, the gateway process keeps the Discord connection and the Discord reads of
+each response, and hands the memory, prompt and completion work to a pool of worker processes over a
+Unix socket. Each channel is pinned to one worker, which answers that channel's messages in order.
+Workers share the chat logs, notes and segments under ./src and pick up each other's writes before
+every job; response cache entries and channel summaries stay with the worker that owns the channel.
+A worker that exits or stops answering pings is killed and restarted; only its in-flight jobs fail.
+
+    WORKER_PROCESSES=4 python -m src
+"""
+from dataclasses import asdict
+from time import perf_counter
+from types import SimpleNamespace
+import asyncio
+import itertools
+import json
+import os
+import struct
+import sys
+import tempfile
+import traceback
+import zlib
+from src import completion
+from src.base import Message
+from src.footprint import footprint
+from src.ingest import ingest_queue
+from src.executors import executors
+from src.memory import refresh_indexes, schedule_summary, start_compaction, start_preload
+from src.metrics import metrics, span
+from src.response_cache import response_cache
+from src.singleflight import provider_calls, call_key
+from src.usage import usage_ledger, usage_tags, tag_usage
+
+WORKER_PROCESSES = int(os.environ.get("WORKER_PROCESSES", "0"))  # 0 keeps everything in the gateway process
+WORKER_JOB_TIMEOUT = 180.0
+WORKER_START_TIMEOUT = 60.0
+WORKER_PING_SECONDS = 10.0
+WORKER_PING_TIMEOUT = 30.0  # a worker that has not answered a ping for this long is restarted
+WORKER_STOP_TIMEOUT = 10.0
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+FRAME_HEADER = struct.Struct("!I")  # every frame is a length-prefixed JSON object
+
+
+class WorkerLost(RuntimeError):
+    pass
+
+
+async def read_frame(reader):
+    try:
+        header = await reader.readexactly(FRAME_HEADER.size)
+        return json.loads(await reader.readexactly(FRAME_HEADER.unpack(header)[0]))
+    except (asyncio.IncompleteReadError, ConnectionError):
+        return None
+
+
+def write_frame(writer, frame):
+    data = json.dumps(frame).encode("utf-8")
+    writer.write(FRAME_HEADER.pack(len(data)) + data)
+
+
+def channel_worker(channel_id, count):
+    # stable across processes and restarts, unlike hash()
+    return zlib.crc32(str(channel_id).encode("utf-8")) % count
+
+
+# ---------------------------------------------Gateway-------------------------------------------------
+
+class Worker:
+    def __init__(self, index):
+        self.index = index
+        self.process = None
+        self.writer = None
+        self.connected = asyncio.Event()
+        self.pending = {}  # job id -> future for its result
+        self.last_pong = perf_counter()
+        self.jobs = 0
+        self.restarts = 0
+        self.starting = False  # the monitor leaves a worker alone while it is being spawned
+
+
+class WorkerPool:
+    def __init__(self, count=WORKER_PROCESSES):
+        self.workers = [Worker(i) for i in range(count)]
+        self.path = os.path.join(tempfile.gettempdir(), f"glovedbot_{os.getpid()}.sock")
+        self.ids = itertools.count()
+        self.server = None
+        self.monitor_task = None
+
+    async def start(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+        self.server = await asyncio.start_unix_server(self.accept, self.path)
+        self.monitor_task = asyncio.get_running_loop().create_task(self.monitor())  # first, so a worker that fails to start is retried
+        results = await asyncio.gather(*(self.spawn(worker) for worker in self.workers), return_exceptions=True)
+        failed = [(worker, result) for worker, result in zip(self.workers, results) if isinstance(result, Exception)]
+        for worker, result in failed:
+            print(f"Worker {worker.index} failed to start, retrying: {result!r}")
+        if len(failed) == len(self.workers):
+            raise RuntimeError("no worker process started")
+        print(f"Started {len(self.workers) - len(failed)} of {len(self.workers)} worker processes!")
+
+    async def spawn(self, worker):
+        worker.connected.clear()
+        worker.starting = True
+        env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [REPO_DIR, os.environ.get("PYTHONPATH")])))
+        try:
+            worker.process = await asyncio.create_subprocess_exec(sys.executable, "-m", "src.workers", self.path, str(worker.index), env=env)
+            await asyncio.wait_for(worker.connected.wait(), timeout=WORKER_START_TIMEOUT)
+        finally:
+            worker.starting = False
+            worker.last_pong = perf_counter()  # a worker that failed to connect is restarted after WORKER_PING_TIMEOUT
+
+    async def accept(self, reader, writer):
+        hello = await read_frame(reader)
+        if hello is None:
+            writer.close()
+            return
+        worker = self.workers[hello["worker"]]
+        worker.writer = writer
+        worker.connected.set()
+        try:
+            while True:
+                frame = await read_frame(reader)
+                if frame is None:
+                    break
+                if frame.get("pong"):
+                    worker.last_pong = perf_counter()
+                    continue
+                future = worker.pending.pop(frame["id"], None)
+                if future is None or future.done():
+                    continue
+                if frame["ok"]:
+                    future.set_result(frame["result"])
+                else:
+                    future.set_exception(RuntimeError(frame["error"]))
+        finally:
+            if worker.writer is writer:
+                worker.writer = None
+                worker.connected.clear()
+                self.fail_pending(worker, "closed its connection")
+
+    def fail_pending(self, worker, reason):
+        for future in worker.pending.values():
+            if not future.done():
+                future.set_exception(WorkerLost(f"Worker {worker.index} {reason}"))
+        worker.pending.clear()
+
+    async def submit(self, channel_id, kind, payload, timeout=WORKER_JOB_TIMEOUT):
+        """
+        Sends a job to the worker that owns the channel and waits for its result.
+        Raises:
+            WorkerLost: The worker died or was restarted before answering.
+            RuntimeError: The job failed in the worker.
+        """
+        worker = self.workers[channel_worker(channel_id, len(self.workers))]
+        await asyncio.wait_for(worker.connected.wait(), timeout=WORKER_START_TIMEOUT)
+        job_id = next(self.ids)
+        future = asyncio.get_running_loop().create_future()
+        worker.pending[job_id] = future
+        worker.jobs += 1
+        write_frame(worker.writer, {"id": job_id, "kind": kind, "channel": str(channel_id), "payload": payload})
+        try:
+            return await asyncio.wait_for(future, timeout=timeout)
+        finally:
+            worker.pending.pop(job_id, None)
+
+    async def relay(self, bot, channel, message, interactive_response, completion_args, **inputs):
+        """
+        Runs the Discord stages of a response here and everything else in the channel's worker.
+        Args:
+            completion_args (dict): Completion model settings, without the messages.
+            **inputs: content, message_id, text_channel, cache_enabled, cache_namespace, prompt_prefix and config_digest.
+        Returns:
+            dict: The "reply", whether it came from the response "cache", and the worker's "seconds".
+        """
+        ctx = dict(inputs, bot=bot, channel=channel, message=message, interactive_response=interactive_response)
+        await completion.gateway_pipeline.run(ctx)
+        payload = dict(
+            inputs,
+            channel_id=channel.id,
+            author=message.author.name,
+            message_content=message.content,
+            history=[asdict(i) for i in ctx["history"]],
+            mentions=ctx["mentions"],
+            bot_name=completion.bot_identity,
+            tags=usage_tags.get(),
+            completion_args=completion_args,
+        )
+        with span("worker.relay"):
+            result = await self.submit(channel.id, "respond", payload)
+        metrics.record("worker.job", result["seconds"])
+        for tags, call in result.pop("usage"):
+            # recorded here so budgets, totals and the traffic recorder see worker calls
+            token = usage_tags.set(tags)
+            try:
+                usage_ledger.add(*call)
+            finally:
+                usage_tags.reset(token)
+        return result
+
+    async def monitor(self):
+        while True:
+            await asyncio.sleep(WORKER_PING_SECONDS)
+            for worker in self.workers:
+                if worker.starting:
+                    continue
+                try:
+                    if worker.process is None:
+                        await self.restart(worker, "never started")
+                    elif worker.process.returncode is not None:
+                        await self.restart(worker, f"exited with code {worker.process.returncode}")
+                    elif perf_counter() - worker.last_pong > WORKER_PING_TIMEOUT:
+                        await self.restart(worker, "stopped answering")
+                    elif worker.writer is not None:
+                        write_frame(worker.writer, {"ping": True})
+                except Exception as e:
+                    print(f"Error restarting worker {worker.index}: {e}")
+
+    async def restart(self, worker, reason):
+        pid = worker.process.pid if worker.process is not None else None
+        print(f"Worker {worker.index} (PID: {pid}) {reason}, restarting...")
+        worker.connected.clear()
+        if worker.process is not None and worker.process.returncode is None:
+            worker.process.kill()
+            await worker.process.wait()
+        if worker.writer is not None:
+            worker.writer.close()
+            worker.writer = None
+        self.fail_pending(worker, reason)
+        worker.restarts += 1
+        await self.spawn(worker)
+
+    async def stop(self):
+        if self.monitor_task is not None:
+            self.monitor_task.cancel()
+        for worker in self.workers:
+            if worker.writer is not None:
+                worker.writer.close()  # workers flush and exit once the gateway hangs up
+        for worker in self.workers:
+            if worker.process is None or worker.process.returncode is not None:
+                continue
+            try:
+                await asyncio.wait_for(worker.process.wait(), timeout=WORKER_STOP_TIMEOUT)
+            except asyncio.TimeoutError:
+                worker.process.kill()
+        if self.server is not None:
+            self.server.close()
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+    def report(self):
+        lines = []
+        for worker in self.workers:
+            pid = worker.process.pid if worker.process is not None else None
+            state = "up" if worker.connected.is_set() else "down"
+            lines.append(f"worker {worker.index}: {state}, PID {pid}, {worker.jobs} jobs, {len(worker.pending)} in flight, {worker.restarts} restarts")
+        return "\n".join(lines)
+
+
+# ---------------------------------------------Worker-------------------------------------------------
+
+unsent_usage = []  # provider calls with their tags, shipped back with the next job result
+
+
+def collect_usage(provider, model, stage, seconds, tags, prompt_tokens, completion_tokens, characters, error):
+    unsent_usage.append([tags, [provider, model, stage, seconds, prompt_tokens, completion_tokens, characters, error]])
+
+
+def take_usage():
+    calls = list(unsent_usage)
+    del unsent_usage[:len(calls)]
+    return calls
+
+
+class JobUsers:
+    # stands in for the bot's user cache when render_stage resolves mentions
+    def __init__(self, names):
+        self.names = names
+
+    def get_user(self, user_id):
+        name = self.names.get(str(user_id))
+        return SimpleNamespace(name=name) if name is not None else None
+
+
+async def respond(payload):
+    refresh_indexes()
+    if completion.bot_identity != payload["bot_name"]:
+        completion.set_bot_identity(payload["bot_name"])
+    tag_usage(**payload["tags"])
+    message_id = payload["message_id"]
+    channel_id = payload["channel_id"]
+    ctx = dict(
+        content=payload["content"],
+        message_id=message_id,
+        text_channel=payload["text_channel"],
+        cache_enabled=payload["cache_enabled"],
+        cache_namespace=payload["cache_namespace"],
+        prompt_prefix=payload["prompt_prefix"],
+        config_digest=payload["config_digest"],  # a version this worker has not seen yet is read from config.yaml
+        bot=JobUsers(payload["mentions"]),
+        channel=SimpleNamespace(id=channel_id),
+        message=SimpleNamespace(id=message_id, content=payload["message_content"], author=SimpleNamespace(name=payload["author"])),
+        interactive_response=None,
+        history=[Message(**i) for i in payload["history"]],
+        mentions=payload["mentions"],
+    )
+    await completion.worker_pipeline.run(ctx)
+    reply = ctx["cache"]
+    if reply is None:  # a hit skipped retrieval and rendering
+        rendered = ctx["render"]
+        args = dict(payload["completion_args"], messages=[{"role": "system", "content": rendered}], stream=False)
+        key = call_key(args["model"], args["messages"], args["temperature"])
+        completions = await provider_calls.do(key, asyncio.to_thread, completion.create_completion, **args)
+        reply = completions.choices[0].message.content
+        if ctx["embed"] is not None and payload["cache_enabled"]:
+            response_cache.store(payload["cache_namespace"], payload["prompt_prefix"], ctx["embed"], reply)
+        reused_notes, memories = ctx["memories"]
+        current_notes, summary, summarize_after_reply = ctx["notes"]
+        if summarize_after_reply:
+            schedule_summary(channel_id, memories)
+    ingest_queue.enqueue(f"{message_id}:reply", payload["bot_name"], reply, channel_id=channel_id, reply_to=message_id)
+    return {"reply": reply, "cached": ctx["cache"] is not None}
+
+
+JOBS = {"respond": respond}
+
+
+async def handle(frame, writer, locks):
+    # jobs for one channel run one at a time, in the order the gateway sent them
+    channel = frame["channel"]
+    entry = locks.setdefault(channel, [asyncio.Lock(), 0])
+    entry[1] += 1
+    started = perf_counter()
+    try:
+        async with entry[0]:
+            result = await JOBS[frame["kind"]](frame["payload"])
+        result.update(seconds=perf_counter() - started, usage=take_usage())
+        write_frame(writer, {"id": frame["id"], "ok": True, "result": result})
+    except Exception as e:
+        traceback.print_exc()
+        write_frame(writer, {"id": frame["id"], "ok": False, "error": f"{type(e).__name__}: {e}"})
+    finally:
+        entry[1] -= 1
+        if not entry[1]:
+            del locks[channel]
+
+
+async def serve(path, index):
+    usage_ledger.persist = False
+    usage_ledger.listeners.append(collect_usage)
+    executors.processes = 0  # workers are separate processes already, so their process-pool work runs in threads
+    reader, writer = await asyncio.open_unix_connection(path)
+    write_frame(writer, {"worker": index, "pid": os.getpid()})
+    loop = asyncio.get_running_loop()
+    ingest_queue.start(loop)
+    footprint.start(loop)
+    if index == 0:
+        start_compaction(loop)  # one compactor for the shared chat logs
+    start_preload(loop)
+    print(f"Worker {index} (PID: {os.getpid()}) ready!")
+    locks = {}
+    tasks = set()
+    while True:
+        frame = await read_frame(reader)
+        if frame is None:
+            break
+        if frame.get("ping"):
+            write_frame(writer, {"pong": True})
+            continue
+        task = loop.create_task(handle(frame, writer, locks))
+        tasks.add(task)
+        task.add_done_callback(tasks.discard)
+    print(f"Worker {index} (PID: {os.getpid()}) disconnected, finishing up...")
+    if tasks:
+        await asyncio.wait(tasks, timeout=WORKER_STOP_TIMEOUT)
+    await ingest_queue.flush()
+
+
+if __name__ == "__main__":
+    asyncio.run(serve(sys.argv[1], int(sys.argv[2])))
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# lets plain `pytest` import the bot's modules as `src.*`, like `python -m pytest` from the repo root does
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
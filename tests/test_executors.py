@@ -0,0 +1,60 @@
+import os
+import subprocess
+import sys
+import textwrap
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+PROBE = textwrap.dedent("""
+    loaded = []  # names the bot module ran under in this process
+
+
+    def bot_loads():
+        return loaded
+""")
+
+BOT = textwrap.dedent("""
+    import asyncio
+    from src.executors import executors
+    from launcher import probe
+
+    probe.loaded.append(__name__)
+
+
+    async def check():
+        try:
+            return await executors.run("json", probe.bot_loads)
+        finally:
+            executors.shutdown()
+
+
+    def run():
+        print(asyncio.run(check()))
+
+
+    if __name__ == "__main__":
+        run()
+""")
+
+
+def launch(tmp_path, module):
+    package = tmp_path / "launcher"
+    package.mkdir(exist_ok=True)
+    (package / "__init__.py").write_text("")
+    (package / "probe.py").write_text(PROBE)
+    (package / "bot.py").write_text(BOT)
+    (package / "__main__.py").write_text("from launcher.bot import run\n\nif __name__ == '__main__':\n    run()\n")
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join([str(tmp_path), ROOT]), EXECUTOR_PROCESSES="1")
+    result = subprocess.run([sys.executable, "-m", module], cwd=tmp_path, env=env, capture_output=True, text=True, timeout=120)
+    assert result.returncode == 0, result.stderr
+    return result.stdout.strip().splitlines()[-1]
+
+
+def test_pool_children_skip_a_package_main(tmp_path):
+    # started like `python -m src`, the bot module is never loaded again in the pool
+    assert launch(tmp_path, "launcher") == "[]"
+
+
+def test_pool_children_rerun_a_module_main(tmp_path):
+    # started like `python -m src.main`, every pool child runs the bot module again
+    assert launch(tmp_path, "launcher.bot") == "['__mp_main__']"
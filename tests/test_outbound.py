@@ -0,0 +1,141 @@
+import asyncio
+import gc
+from src.outbound import OutboundScheduler, FINAL, NEW, PROGRESS
+
+
+class Channel:
+    def __init__(self, id=1):
+        self.id = id
+
+
+class Message:
+    def __init__(self, log, id=10, fail=None):
+        self.id = id
+        self.channel = Channel()
+        self.log = log
+        self.fail = fail
+
+    async def edit(self, content):
+        self.log.append(("edit", content))
+        if content == self.fail:
+            raise RuntimeError(content)
+        return content
+
+    async def delete(self):
+        self.log.append(("delete", self.id))
+
+
+def roomy():
+    return OutboundScheduler(route_capacity=50, route_rate=50.0)
+
+
+def call(log, name):
+    async def run():
+        log.append(name)
+        return name
+    return run
+
+
+def test_calls_go_out_by_priority():
+    log = []
+
+    async def main():
+        outbound = roomy()
+        futures = [
+            outbound.submit("send", 1, None, PROGRESS, call(log, "progress")),
+            outbound.submit("send", 1, None, NEW, call(log, "new")),
+            outbound.submit("send", 1, None, FINAL, call(log, "final")),
+        ]
+        return await asyncio.gather(*futures)
+
+    assert asyncio.run(main()) == ["progress", "new", "final"]
+    assert log == ["final", "new", "progress"]
+
+
+def test_pending_edits_collapse_into_the_latest():
+    log = []
+
+    async def main():
+        outbound = roomy()
+        message = Message(log)
+        first = outbound.edit(message, "partial", PROGRESS)
+        second = outbound.edit(message, "done", FINAL)
+        return await first, await second, outbound.collapsed
+
+    assert asyncio.run(main()) == ("done", "done", 1)
+    assert log == [("edit", "done")]
+
+
+def test_late_progress_edit_never_replaces_pending_final_content():
+    log = []
+
+    async def main():
+        outbound = roomy()
+        message = Message(log)
+        final = outbound.edit(message, "done", FINAL)
+        progress = outbound.edit(message, "still typing", PROGRESS)
+        return await final, await progress
+
+    assert asyncio.run(main()) == ("done", None)
+    assert log == [("edit", "done")]
+
+
+def test_delete_drops_pending_edits():
+    log = []
+
+    async def main():
+        outbound = roomy()
+        message = Message(log)
+        edit = outbound.edit(message, "done", FINAL)
+        await outbound.delete(message)
+        return await edit
+
+    assert asyncio.run(main()) is None
+    assert log == [("delete", 10)]
+
+
+def test_progress_is_dropped_when_the_route_is_short_of_budget():
+    log = []
+
+    async def main():
+        outbound = OutboundScheduler(route_capacity=1, route_rate=1.0)
+        progress = outbound.submit("send", 1, None, PROGRESS, call(log, "progress"))
+        final = outbound.submit("send", 1, None, FINAL, call(log, "final"))
+        return await progress, await final, outbound.dropped
+
+    assert asyncio.run(main()) == (None, "final", 1)
+    assert log == ["final"]
+
+
+def test_stale_progress_is_dropped():
+    log = []
+
+    async def main():
+        outbound = OutboundScheduler(route_capacity=50, route_rate=50.0, max_age=0.01)
+        outbound.set_online(False)
+        progress = outbound.submit("send", 1, None, PROGRESS, call(log, "progress"))
+        final = outbound.submit("send", 1, None, FINAL, call(log, "final"))
+        await asyncio.sleep(0.05)
+        outbound.set_online(True)
+        return await progress, await final
+
+    assert asyncio.run(main()) == (None, "final")
+    assert log == ["final"]
+
+
+def test_error_reaches_collapsed_callers_without_unretrieved_warnings(caplog):
+    log = []
+
+    async def main():
+        outbound = roomy()
+        message = Message(log, fail="done")
+        outbound.edit(message, "partial", PROGRESS)  # never awaited, like progress edits in the bot
+        final = outbound.edit(message, "done", FINAL)
+        try:
+            await final
+        except RuntimeError as e:
+            return str(e)
+
+    assert asyncio.run(main()) == "done"
+    gc.collect()
+    assert "never retrieved" not in caplog.text
@@ -0,0 +1,90 @@
+import asyncio
+import pytest
+from src.pipeline import Pipeline, Stage
+
+
+def stage(name, log, value=None, delay=0.0, deps=(), **kwargs):
+    async def run(ctx):
+        log.append(f"{name} start")
+        await asyncio.sleep(delay)
+        log.append(f"{name} end")
+        return value if value is not None else name
+    return Stage(name, run, deps, **kwargs)
+
+
+def test_stages_run_after_their_dependencies():
+    log = []
+    pipeline = Pipeline([stage("reply", log, deps=("memory", "history")), stage("memory", log, delay=0.01), stage("history", log)])
+    ctx = asyncio.run(pipeline.run({}))
+    assert [i.name for i in pipeline.stages] == ["memory", "history", "reply"]
+    assert log.index("reply start") > max(log.index("memory end"), log.index("history end"))
+    assert ctx == {"memory": "memory", "history": "history", "reply": "reply"}
+
+
+def test_independent_stages_run_concurrently():
+    log = []
+    pipeline = Pipeline([stage("a", log, delay=0.05), stage("b", log, delay=0.05)])
+    asyncio.run(pipeline.run({}))
+    assert log[:2] == ["a start", "b start"]
+
+
+def test_stages_may_depend_on_inputs():
+    async def echo(ctx):
+        return ctx["message"].upper()
+
+    ctx = asyncio.run(Pipeline([Stage("echo", echo, ("message",))], inputs=("message",)).run({"message": "hi"}))
+    assert ctx["echo"] == "HI"
+
+
+def test_unknown_and_circular_dependencies_are_rejected():
+    with pytest.raises(ValueError, match="unknown stage"):
+        Pipeline([stage("a", [], deps=("missing",))])
+    with pytest.raises(ValueError, match="depends on itself"):
+        Pipeline([stage("a", [], deps=("b",)), stage("b", [], deps=("a",))])
+
+
+def test_timed_out_stage_uses_its_fallback():
+    log = []
+    errors = []
+
+    def fallback(ctx, error):
+        errors.append(error)
+        return "fallback"
+
+    pipeline = Pipeline([stage("slow", log, delay=1.0, timeout=0.01, fallback=fallback), stage("after", log, deps=("slow",))])
+    ctx = asyncio.run(pipeline.run({}))
+    assert ctx["slow"] == "fallback"
+    assert isinstance(errors[0], asyncio.TimeoutError)
+    assert ctx["after"] == "after"
+
+
+def test_failed_stage_uses_its_fallback():
+    async def broken(ctx):
+        raise RuntimeError("down")
+
+    ctx = asyncio.run(Pipeline([Stage("broken", broken, fallback=lambda ctx, e: str(e))]).run({}))
+    assert ctx["broken"] == "down"
+
+
+def test_error_without_fallback_cancels_the_other_stages():
+    log = []
+
+    async def broken(ctx):
+        raise RuntimeError("down")
+
+    pipeline = Pipeline([Stage("broken", broken), stage("slow", log, delay=1.0), stage("after", log, deps=("broken",))])
+    with pytest.raises(RuntimeError, match="down"):
+        asyncio.run(pipeline.run({}))
+    assert log == ["slow start"]
+
+
+def test_stop_skips_unfinished_stages():
+    log = []
+    pipeline = Pipeline([
+        stage("cache", log, value="hit", stop=lambda result: result == "hit"),
+        stage("slow", log, delay=1.0),
+        stage("reply", log, delay=0.05, deps=("cache",)),
+    ])
+    ctx = asyncio.run(asyncio.wait_for(pipeline.run({}), 0.5))
+    assert ctx == {"cache": "hit"}
+    assert "slow end" not in log and "reply end" not in log
@@ -0,0 +1,68 @@
+import pytest
+import src.response_cache as cache_module
+from src.response_cache import ResponseCache, prefix_hash
+
+PREFIX = prefix_hash("system prompt", "persona")
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(cache_module, "time", lambda: now[0])
+    return now
+
+
+def test_near_duplicate_query_hits():
+    cache = ResponseCache(threshold=0.97)
+    cache.store(1, PREFIX, [1.0, 0.0], "hello")
+    assert cache.lookup(1, PREFIX, [2.0, 0.1]) == "hello"  # similarity ~0.999, scale does not matter
+    assert cache.stats(1)["hits"] == 1
+
+
+def test_query_below_threshold_misses():
+    cache = ResponseCache(threshold=0.97)
+    cache.store(1, PREFIX, [1.0, 0.0], "hello")
+    assert cache.lookup(1, PREFIX, [1.0, 0.3]) is None  # similarity ~0.958
+    assert cache.stats(1)["misses"] == 1
+
+
+def test_lookup_picks_the_closest_reply():
+    cache = ResponseCache(threshold=0.5)
+    cache.store(1, PREFIX, [1.0, 0.0], "far")
+    cache.store(1, PREFIX, [1.0, 1.0], "close")
+    assert cache.lookup(1, PREFIX, [1.0, 0.9]) == "close"
+
+
+def test_namespace_and_prefix_must_match():
+    cache = ResponseCache()
+    cache.store(1, PREFIX, [1.0, 0.0], "hello")
+    assert cache.lookup(2, PREFIX, [1.0, 0.0]) is None
+    assert cache.lookup(1, prefix_hash("another prompt"), [1.0, 0.0]) is None
+    cache.discard_prefixes({PREFIX})
+    assert cache.lookup(1, PREFIX, [1.0, 0.0]) is None
+
+
+def test_entries_expire_after_the_ttl(clock):
+    cache = ResponseCache(ttl=60)
+    cache.store(1, PREFIX, [1.0, 0.0], "hello")
+    clock[0] += 59
+    assert cache.lookup(1, PREFIX, [1.0, 0.0]) == "hello"
+    clock[0] += 2
+    assert cache.lookup(1, PREFIX, [1.0, 0.0]) is None
+    assert cache.stats()["entries"] == 0
+
+
+def test_oldest_entries_are_evicted(clock):
+    cache = ResponseCache(threshold=0.99, max_entries=2)
+    for i, vector in enumerate(([1.0, 0.0], [0.0, 1.0], [-1.0, 0.0])):
+        clock[0] += 1
+        cache.store(1, PREFIX, vector, f"reply {i}")
+    assert cache.lookup(1, PREFIX, [1.0, 0.0]) is None
+    assert cache.lookup(1, PREFIX, [-1.0, 0.0]) == "reply 2"
+    assert cache.stats(1)["entries"] == 2
+
+
+def test_blank_replies_are_not_stored():
+    cache = ResponseCache()
+    cache.store(1, PREFIX, [1.0, 0.0], "  ")
+    assert cache.stats()["stores"] == 0
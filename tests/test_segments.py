@@ -0,0 +1,89 @@
+import numpy as np
+import pytest
+import src.segments as segments
+
+
+@pytest.fixture(autouse=True)
+def segments_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(segments, "SEGMENTS_DIR", str(tmp_path))
+    monkeypatch.setattr(segments, "MANIFEST_FILE", str(tmp_path / "manifest.json"))
+    monkeypatch.setattr(segments, "manifest", None)
+    segments.load_segment.cache_clear()
+    yield tmp_path
+    segments.load_segment.cache_clear()
+
+
+def record(uuid, timestamp, vector, **fields):
+    return dict(fields, uuid=uuid, timestamp=timestamp, speaker="user", message=f"message {uuid}", vector=vector)
+
+
+def write_two_segments():
+    first = segments.write_segment([
+        record("a", 100.0, [1.0, 0.0, 0.0]),
+        record("b", 110.0, [0.9, 0.1, 0.0], merged=["b-old"]),
+    ])
+    second = segments.write_segment([
+        record("c", 200.0, [0.0, 1.0, 0.0]),
+        record("d", 210.0, [0.0, 0.0, 1.0]),
+    ])
+    return first, second
+
+
+def test_round_trip():
+    entry, _ = write_two_segments()
+    assert (entry["file"], entry["count"], entry["start"], entry["end"]) == ("segment_100.0_110.0.npz", 2, 100.0, 110.0)
+    vectors, meta = segments.load_segment(entry["file"])
+    assert [i["uuid"] for i in meta] == ["a", "b"]
+    assert meta[1]["merged"] == ["b-old"] and "vector" not in meta[0]
+    assert np.allclose(np.linalg.norm(vectors, axis=1), 1.0, atol=1e-3)
+    assert np.allclose(vectors[1], np.array([0.9, 0.1, 0.0]) / np.linalg.norm([0.9, 0.1, 0.0]), atol=1e-3)
+
+
+def test_manifest_is_reloaded_from_disk():
+    write_two_segments()
+    segments.manifest = None
+    assert [i["file"] for i in segments.load_manifest()] == ["segment_100.0_110.0.npz", "segment_200.0_210.0.npz"]
+
+
+def test_rewritten_segment_replaces_its_entry():
+    write_two_segments()
+    segments.write_segment([record("a", 100.0, [1.0, 0.0, 0.0]), record("b", 110.0, [0.0, 1.0, 0.0])])
+    assert len(segments.load_manifest()) == 2
+
+
+def test_search_returns_the_closest_records():
+    write_two_segments()
+    hits = segments.search_segments([0.0, 1.0, 0.3], 2)
+    assert [i["uuid"] for i in hits] == ["c", "d"]
+    assert hits[0]["score"] > hits[1]["score"]
+    assert len(hits[0]["vector"]) == 3
+
+
+def test_search_only_opens_the_nearest_segments():
+    write_two_segments()
+    hits = segments.search_segments([1.0, 0.0, 0.0], 10, segments=1)
+    assert {i["uuid"] for i in hits} == {"a", "b"}
+
+
+def test_search_without_segments_is_empty():
+    assert segments.search_segments([1.0, 0.0, 0.0], 5) == []
+
+
+def test_lookup_by_uuid_and_time():
+    write_two_segments()
+    found = segments.lookup_segments(["a", "b-old", "c"], [100.0, 110.0])
+    assert sorted(i["uuid"] for i in found) == ["a", "b"]  # c's segment does not cover the given times
+    assert segments.lookup_segments(["c"], [205.0])[0]["uuid"] == "c"
+
+
+def test_stored_uuids_include_merged_records():
+    write_two_segments()
+    assert segments.stored_uuids(["a", "b-old", "d", "missing"]) == {"a", "b-old", "d"}
+
+
+def test_uuid_filter_skips_segments_without_the_uuid():
+    entry, _ = write_two_segments()
+    assert segments.may_hold(entry, ["a", "b", "b-old"]) == ["a", "b", "b-old"]
+    absent = ["missing-%d" % i for i in range(100)]
+    assert len(segments.may_hold(entry, absent)) < 10
+    assert segments.may_hold({"file": "old.npz"}, absent) == absent  # segments from before the filters
@@ -0,0 +1,92 @@
+import asyncio
+import pytest
+from src.singleflight import SingleFlight, call_key
+
+
+class Upstream:
+    def __init__(self, result="reply", error=None, delay=0.02):
+        self.result = result
+        self.error = error
+        self.delay = delay
+        self.calls = 0
+        self.cancelled = False
+
+    async def __call__(self, *args):
+        self.calls += 1
+        try:
+            await asyncio.sleep(self.delay)
+        except asyncio.CancelledError:
+            self.cancelled = True
+            raise
+        if self.error is not None:
+            raise self.error
+        return self.result
+
+
+def test_call_key_ignores_dict_order():
+    assert call_key("gpt", {"a": 1, "b": 2}) == call_key("gpt", {"b": 2, "a": 1})
+    assert call_key("gpt", "hi") != call_key("other", "hi")
+
+
+def test_overlapping_calls_share_one_upstream_call():
+    flight, upstream = SingleFlight(), Upstream()
+
+    async def main():
+        return await asyncio.gather(*(flight.do("key", upstream) for _ in range(3)))
+
+    assert asyncio.run(main()) == ["reply"] * 3
+    assert upstream.calls == 1
+    assert (flight.started, flight.shared) == (1, 2)
+    assert flight.calls == {}
+
+
+def test_different_keys_and_later_calls_go_upstream():
+    flight, upstream = SingleFlight(), Upstream()
+
+    async def main():
+        await asyncio.gather(flight.do("a", upstream), flight.do("b", upstream))
+        await flight.do("a", upstream)
+
+    asyncio.run(main())
+    assert upstream.calls == 3
+
+
+def test_error_is_raised_to_every_caller():
+    flight, upstream = SingleFlight(), Upstream(error=RuntimeError("rate limited"))
+
+    async def main():
+        return await asyncio.gather(*(flight.do("key", upstream) for _ in range(2)), return_exceptions=True)
+
+    results = asyncio.run(main())
+    assert all(isinstance(i, RuntimeError) and str(i) == "rate limited" for i in results)
+    assert upstream.calls == 1
+
+
+def test_cancelled_caller_does_not_cancel_the_shared_call():
+    flight, upstream = SingleFlight(), Upstream(delay=0.05)
+
+    async def main():
+        first = asyncio.ensure_future(flight.do("key", upstream))
+        second = asyncio.ensure_future(flight.do("key", upstream))
+        await asyncio.sleep(0.01)
+        first.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await first
+        return await second
+
+    assert asyncio.run(main()) == "reply"
+    assert not upstream.cancelled
+
+
+def test_error_with_no_caller_left_is_retrieved(caplog):
+    flight, upstream = SingleFlight(), Upstream(error=RuntimeError("down"))
+
+    async def main():
+        caller = asyncio.ensure_future(flight.do("key", upstream))
+        await asyncio.sleep(0.005)
+        caller.cancel()
+        await asyncio.sleep(0.05)
+
+    asyncio.run(main())
+    assert "never retrieved" not in caplog.text
+    assert flight.calls == {}
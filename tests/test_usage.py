@@ -0,0 +1,67 @@
+import contextvars
+import pytest
+import src.usage as usage
+from src.usage import UsageLedger, budget_key, tag_usage
+
+
+@pytest.fixture
+def ledger(tmp_path, monkeypatch):
+    monkeypatch.setattr(usage, "USAGE_DIR", str(tmp_path))
+    return UsageLedger()
+
+
+def record(ledger, guild, tokens, channel=None):
+    def add():
+        tag_usage(guild=guild, channel=channel, user=1)
+        ledger.add("openai", "gpt", "completion", 0.1, prompt_tokens=tokens)
+    contextvars.copy_context().run(add)
+
+
+def test_requests_per_minute(ledger, monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(usage, "time", lambda: now[0])
+    budget = {"requests_per_minute": 2}
+    assert ledger.check_budget(1, budget) is None
+    assert ledger.check_budget(1, budget) is None
+    assert "2 requests per minute" in ledger.check_budget(1, budget)
+    assert ledger.check_budget(2, budget) is None  # other guilds have their own budget
+    now[0] += 61
+    assert ledger.check_budget(1, budget) is None
+
+
+def test_refused_requests_are_not_counted(ledger):
+    budget = {"requests_per_minute": 1}
+    ledger.check_budget(1, budget)
+    ledger.check_budget(1, budget)
+    assert len(ledger.requests["1"]) == 1
+
+
+def test_tokens_per_day(ledger):
+    budget = {"tokens_per_day": 100}
+    record(ledger, 1, 60)
+    assert ledger.check_budget(1, budget) is None
+    record(ledger, 1, 40)
+    assert "100 tokens" in ledger.check_budget(1, budget)
+    assert ledger.check_budget(2, budget) is None
+
+
+def test_tokens_per_day_survive_a_restart(ledger):
+    record(ledger, 1, 100)
+    ledger.flush()
+    assert "100 tokens" in UsageLedger().check_budget(1, {"tokens_per_day": 100})
+
+
+def test_dm_usage_counts_against_its_own_budget(ledger):
+    budget = {"tokens_per_day": 100}
+    key = budget_key(None, 5)
+    assert key == "dm:5"
+    assert budget_key(7, 5) == "7"
+    record(ledger, key, 100, channel=5)
+    assert "100 tokens" in ledger.check_budget(key, budget)
+    assert ledger.check_budget(budget_key(None, 6), budget) is None
+    assert ledger.check_budget(None, budget) is None
+
+
+def test_no_budget_means_no_limit(ledger):
+    record(ledger, 1, 10 ** 9)
+    assert all(ledger.check_budget(1) is None for _ in range(100))